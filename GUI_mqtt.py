@@ -1,14 +1,28 @@
+import os
 import sys
 from argparse import ArgumentParser, RawTextHelpFormatter
-from PySide6.QtWidgets import QApplication, QMainWindow
-from PySide6.QtCore import Signal, Slot, Qt, QObject, Property
+from PySide6.QtWidgets import QApplication, QMainWindow, QLabel, QWidget, QGridLayout, QScrollArea, QPushButton
+from PySide6.QtCore import Signal, Slot, Qt, QObject, Property, QTimer, QThread
 from PySide6.QtGui import QOpenGLFunctions, QSurfaceFormat
 from gui2 import Ui_MainWindow
 from PySide6.QtOpenGLWidgets import QOpenGLWidget
 from OpenGL.GL import *
-from OpenGL.GLU import *
 import paho.mqtt.client as mqtt
 import json
+import time
+import uuid
+import ctypes
+import numpy as np
+from collections import deque
+import scene
+from plots import TelemetryHistory, PlotWidget
+from shmring import SharedTelemetry
+from transport import MqttTransport, UdpTransport
+from download import RunReceiver
+from rpc import RpcClient
+from runstore import RunStore
+from viewer import ViewerWindow
+from telemetry import TelemetryModel, Snapshot, SyntheticFeed, LoopbackBroker, simulatedRig, TOPICS, decode, decodeBatch
 
 class MqttClient(QObject):
     Disconnected = 0
@@ -21,14 +35,15 @@ class MqttClient(QObject):
     connected = Signal()
     disconnected = Signal()
     stateChanged = Signal(int)
-    hostnameChanged = Signal(int)
+    hostnameChanged = Signal(str)
     portChanged = Signal(int)
     keepAliveChanged = Signal(int)
     cleanSessionChanged = Signal(int)
     protocolVersionChanged = Signal(int)
     messageSignal = Signal(object)
+    connectFailed = Signal(int)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, client=None):
         super(MqttClient, self).__init__(parent)
 
         self.m_hostname = ''
@@ -38,12 +53,19 @@ class MqttClient(QObject):
         self.m_protocolVersion = MqttClient.MQTT_3_1
 
         self.m_state = MqttClient.Disconnected
-
-        self.m_client = mqtt.Client(clean_session=self.m_cleanSession, protocol=self.m_protocolVersion)
+        self.m_sink = None
+        # seconds between connection attempts, doubling from min up to max
+        self.m_reconnectMin = 1
+        self.m_reconnectMax = 30
+        self.m_failures = 0
+
+        # client can be a stand-in with the same interface, see telemetry.LoopbackBroker
+        self.m_client = client or mqtt.Client(clean_session=self.m_cleanSession, protocol=self.m_protocolVersion)
         
         self.m_client.on_connect = self.on_connect
         self.m_client.on_message = self.on_message
         self.m_client.on_disconnect = self.on_disconnect
+        self.m_client.on_connect_fail = self.on_connect_fail
 
     @Property(int, notify=stateChanged)
     def state(self):
@@ -108,8 +130,12 @@ class MqttClient(QObject):
 
     @Slot()
     def connectToHost(self):
+        # returns at once: paho connects on its network thread and tries again
+        # with exponential backoff while the broker cannot be reached, and
+        # after the connection drops
         if self.m_hostname:
-            self.m_client.connect(self.m_hostname, port=self.port, keepalive=self.keepAlive)
+            self.m_client.reconnect_delay_set(self.m_reconnectMin, self.m_reconnectMax)
+            self.m_client.connect_async(self.m_hostname, port=self.port, keepalive=self.keepAlive)
             self.state = MqttClient.Connecting
             self.m_client.loop_start()
 
@@ -125,39 +151,236 @@ class MqttClient(QObject):
        if self.state == MqttClient.Connected:
            self.m_client.publish(topic,payload,qos)
 
-    def on_message(self, mqttc, obj, msg):
-        mstr=msg.payload.decode('utf-8')
-        self.messageSignal.emit(msg)
+    def setSink(self, sink):
+        # sink(topic, payload) is called on paho's network thread instead of
+        # emitting messageSignal, so raw messages never queue up on the GUI thread
+        self.m_sink = sink
 
-    def on_connect(self, *args):
+    def on_message(self, mqttc, obj, msg):
+        if self.m_sink is not None:
+            self.m_sink(msg.topic, msg.payload)
+        else:
+            self.messageSignal.emit(msg)
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            # refused by the broker, paho tries again
+            self.on_connect_fail(client, userdata)
+            return
+        self.m_failures = 0
         self.state = MqttClient.Connected
         self.connected.emit()
 
-    def on_disconnect(self, *args):
-        self.state = MqttClient.Disconnected
+    def on_connect_fail(self, client, userdata):
+        self.m_failures += 1
+        self.connectFailed.emit(self.m_failures)
+
+    def on_disconnect(self, client, userdata, rc):
+        # rc 0 is disconnectFromHost(), anything else is a drop paho reconnects after
+        self.state = MqttClient.Disconnected if rc == 0 else MqttClient.Connecting
         self.disconnected.emit()
                     
+class TelemetryWorker(QObject):
+    # Lives on its own thread. push() only stamps and queues the raw message;
+    # decoding and aggregation happen here, and the GUI gets at most `rate`
+    # batches per second however fast messages arrive. One worker can serve
+    # several rigs: every batch is a dict of rig name -> Snapshot.
+    snapshotReady = Signal(object)
+
+    def __init__(self, rate=60):
+        super(TelemetryWorker, self).__init__()
+        self.queue=deque()
+        self.rate=rate
+        self.pushed=0
+        self.errors=0
+        self.thread=QThread()
+        self.thread.setObjectName('TelemetryWorker')
+        self.moveToThread(self.thread)
+        self.thread.started.connect(self.startTimer)
+
+    def push(self, topic, payload):
+        self.pushed+=1
+        self.queue.append((time.monotonic(), '', topic, payload))
+
+    def sink(self, rig, prefix=''):
+        # push() for one rig, strips the rig's topic prefix
+        queue=self.queue
+        n=len(prefix)
+        def push(topic, payload):
+            self.pushed+=1
+            queue.append((time.monotonic(), rig, topic[n:], payload))
+        return push
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.thread.quit()
+        self.thread.wait()
+
+    @Slot()
+    def startTimer(self):
+        self.timer=QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.flush)
+        self.thread.finished.connect(self.timer.stop, Qt.DirectConnection)
+        self.timer.start(max(int(1000/self.rate),1))
+
+    @Slot()
+    def flush(self):
+        n=len(self.queue)
+        if n==0:
+            return
+        batches={}
+        for i in range(n):
+            stamp, rig, topic, payload = self.queue.popleft()
+            stamps, payloads = batches.setdefault((rig, topic), ([], []))
+            stamps.append(stamp)
+            payloads.append(payload)
+        snapshots={}
+        for (rig, topic), (stamps, payloads) in batches.items():
+            snapshot=snapshots.get(rig)
+            if snapshot is None:
+                snapshot=snapshots[rig]=Snapshot()
+            try:
+                vals=decodeBatch(topic, payloads)
+            except ValueError:
+                # a bad payload spoils the batch, decode one by one and skip it
+                vals=[]
+                good=[]
+                for stamp, payload in zip(stamps, payloads):
+                    try:
+                        vals.append(decode(topic, payload))
+                        good.append(stamp)
+                    except ValueError:
+                        snapshot.errors+=1
+                        self.errors+=1
+                stamps=good
+            snapshot.add(stamps, topic, vals)
+        self.snapshotReady.emit(snapshots)
+
+class LagMonitor(QObject):
+    # Event loop latency: how late a precise timer on the GUI thread fires
+    def __init__(self, interval=10, seconds=2, parent=None):
+        super(LagMonitor, self).__init__(parent)
+        self.interval=interval/1000
+        self.lags=deque(maxlen=int(seconds/self.interval))
+        self.last=time.perf_counter()
+        self.timer=QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(interval)
+
+    def tick(self):
+        now=time.perf_counter()
+        self.lags.append(max(now-self.last-self.interval,0.0))
+        self.last=now
+
+    def mean(self):
+        return 1000*sum(self.lags)/len(self.lags) if self.lags else 0.0
+
+    def max(self):
+        return 1000*max(self.lags) if self.lags else 0.0
+
+class FrameClock(QObject):
+    # Display refresh timer shared by every panel in the process, so N rigs
+    # still cost one timer wakeup and one lag monitor per frame
+    tick = Signal()
+
+    def __init__(self, refresh=None, parent=None):
+        super(FrameClock, self).__init__(parent)
+        if refresh is None:
+            screen=QApplication.primaryScreen()
+            refresh=screen.refreshRate() if screen else 60
+        self.lag=LagMonitor(parent=self)
+        self.timer=QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(max(int(1000/(refresh or 60)),1))
+
 class MainWindow(QMainWindow):
-    phiSignal = Signal(float)
-    thetaSignal = Signal(float)
-    motor1signal = Signal(float)
-    motor2signal = Signal(float)
-    motor3signal = Signal(float)
-    motor4signal = Signal(float)
-    def __init__(self, transparent):
+    downloadProgress = Signal(str)
+    commandReply = Signal(object, object)
+    statusReceived = Signal(object)
+
+    def __init__(self, transparent, plotwindow=30, plotmethod='lttb', labelrate=10, plotrate=30, hud=True, synthetic=0, worker=None,
+                 hostname='192.168.0.13', port=1883, rig='', broker=None, clock=None, shm=False, udp=0):
         super(MainWindow, self).__init__()
+        # time to first frame, printed by renderFrame
+        self.created = time.perf_counter()
+        self.firstFrame = None
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
         if transparent:
             self.setAttribute(Qt.WA_TranslucentBackground)
             self.setAttribute(Qt.WA_NoSystemBackground, False)
         self.glwidget = OpenGLWidget(transparent)
-
-        self.client = MqttClient(self)
+        self.history = TelemetryHistory()
+        self.plot = PlotWidget(self.history, plotwindow, plotmethod)
+        self.model = TelemetryModel()
+
+        # rig is the topic namespace: telemetry arrives as rig/loadcell and
+        # commands go out as rig/start. An empty rig uses the plain topic names.
+        self.rig = rig
+        self.prefix = rig+'/' if rig else ''
+        if rig:
+            self.setWindowTitle(rig)
+
+        # decoding runs on the worker thread, the GUI only receives snapshots
+        self.ownWorker = worker is None
+        self.worker = worker or TelemetryWorker()
+        self.worker.snapshotReady.connect(self.on_snapshot)
+        if self.ownWorker:
+            self.worker.start()
+        self.clock = clock or FrameClock(self.screen().refreshRate() if self.screen() else 60, self)
+        self.lag = self.clock.lag
+
+        self.client = MqttClient(self, broker.client() if broker is not None else None)
         self.client.stateChanged.connect(self.on_stateChanged)
-        self.client.messageSignal.connect(self.on_messageSignal)
-        self.client.hostname='192.168.0.13'
-        self.client.connectToHost()
+        self.client.connectFailed.connect(self.showConnection)
+        # telemetry transports feeding the worker: always MQTT, which also
+        # carries the replies to commands, plus UDP datagrams on port udp
+        self.transports = [MqttTransport(self.client)]
+        if udp:
+            self.transports.append(UdpTransport(port=udp))
+        # downloaded runs are stored under runs/, their chunks come on MQTT
+        # and go to the receiver instead of the worker
+        self.store = RunStore(os.path.join('runs', rig) if rig else 'runs')
+        self.download = RunReceiver(self.store, self.publish, self.downloadProgress.emit)
+        # tare, weigh, start, stop and save are requests the Pi replies to
+        self.rpc = RpcClient(self.publish, uuid.uuid4().hex[:12])
+        sink=self.worker.sink(rig, self.prefix)
+        chunks=self.prefix+'download/chunk'
+        replies=self.prefix+self.rpc.reply
+        status=self.prefix+'status'
+        def route(topic, payload):
+            if topic==chunks:
+                self.download.receive(payload)
+            elif topic==replies:
+                self.rpc.receive(payload)
+            elif topic==status:
+                self.statusReceived.emit(payload)
+            else:
+                sink(topic, payload)
+        self.transports[0].start(route)
+        for transport in self.transports[1:]:
+            transport.start(sink)
+        self.client.hostname=hostname
+        self.client.port=port
+        # broker connection state
+        self.connection_label = QLabel()
+        self.ui.gridLayout.addWidget(QLabel('Broker'), 16, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.connection_label, 16, 1, 1, 1)
+        self.showConnection()
+        # with shm the loadcell and IMU samples come from the acquisition
+        # process' shared memory rings, MQTT still carries commands, weight and time
+        self.shared = SharedTelemetry(rig) if shm else None
+        self.feed = None
+        if synthetic:
+            self.feed = SyntheticFeed(self.worker.sink(rig), synthetic)
+            self.feed.start()
+        else:
+            self.client.connectToHost()
 
         # initialize buttons and sliders
         self.ui.tar_button.clicked.connect(self.tare)
@@ -167,7 +390,33 @@ class MainWindow(QMainWindow):
         self.ui.pushButton.clicked.connect(self.saveToFile)
         self.ui.autolevel_button.clicked.connect(self.autoLevel)
         self.ui.angle_button.clicked.connect(self.angle)
-        self.ui.GL_layout.addWidget(self.glwidget)
+        self.download_button = QPushButton('Download run')
+        self.download_label = QLabel()
+        self.ui.gridLayout.addWidget(self.download_button, 13, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.download_label, 13, 1, 1, 1)
+        self.download_button.clicked.connect(self.downloadRun)
+        self.downloadProgress.connect(self.download_label.setText)
+        # rolling thrust statistics computed on the Pi
+        self.metrics_label = QLabel()
+        self.ui.gridLayout.addWidget(QLabel('Thrust mean/std/min/max'), 14, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.metrics_label, 14, 1, 1, 1)
+        # asks again when a download stalls
+        self.downloadTimer = QTimer(self)
+        self.downloadTimer.timeout.connect(self.download.check)
+        self.downloadTimer.start(1000)
+        # command replies and round trip times, unanswered commands time out
+        self.command_label = QLabel()
+        self.ui.gridLayout.addWidget(QLabel('Last command'), 15, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.command_label, 15, 1, 1, 1)
+        self.commandReply.connect(self.on_commandReply)
+        # the Pi's retained state, the broker sends it on subscribing
+        self.statusReceived.connect(self.on_status)
+        self.lastError = None
+        self.rpcTimer = QTimer(self)
+        self.rpcTimer.timeout.connect(self.rpc.check)
+        self.rpcTimer.start(250)
+        self.ui.GL_layout.addWidget(self.glwidget, 0, 0)
+        self.ui.GL_layout.addWidget(self.plot, 0, 1)
         self.ui.weight_val_label.setText(str(0.0))
         self.ui.roll_val_label.setText(str(0.0))
         self.ui.pitch_val_label.setText(str(0.0))
@@ -180,119 +429,307 @@ class MainWindow(QMainWindow):
         self.ui.time_val_label.setText('00:00:00.00')
         self.ui.phi_slider.valueChanged.connect(self.updateSliders)
         self.ui.theta_slider.valueChanged.connect(self.updateSliders)
-        self.phiSignal.connect(self.glwidget.phiRotation)
-        self.thetaSignal.connect(self.glwidget.thetaRotation)
-        self.motor1signal.connect(self.glwidget.motor1)
-        self.motor2signal.connect(self.glwidget.motor2)
-        self.motor3signal.connect(self.glwidget.motor3)
-        self.motor4signal.connect(self.glwidget.motor4)
         self.angleflag=False
 
-    def phiSignalemit(self,phi):
-        self.phiSignal.emit(phi)
-
-    def thetaSignalemit(self, theta):
-        self.thetaSignal.emit(theta)
-
-    def motor1signalemit(self,motor1):
-        self.motor1signal.emit(motor1)
-
-    def motor2signalemit(self,motor2):
-        self.motor2signal.emit(motor2)
-
-    def motor3signalemit(self,motor3):
-        self.motor3signal.emit(motor3)
-
-    def motor4signalemit(self,motor4):
-        self.motor4signal.emit(motor4)
+        # frame clock: the scene is repainted at most once per display refresh,
+        # labels and plots at their own lower rates, whatever the message rate
+        self.labelInterval=1.0/labelrate
+        self.plotInterval=1.0/plotrate
+        self.lastLabels=0.0
+        self.lastPlot=0.0
+        self.frames=0
+        self.frameCount=0
+        self.lastMessages=0
+        self.lastHud=time.monotonic()
+        self.hud=None
+        if hud:
+            self.hud=QLabel(self.glwidget)
+            self.hud.setStyleSheet('color: white; background-color: rgba(0,0,0,128); padding: 2px;')
+            self.hud.move(4,4)
+        self.clock.tick.connect(self.renderFrame)
+
+    def renderFrame(self):
+        now=time.monotonic()
+        model=self.model
+        if self.firstFrame is None and self.isVisible():
+            self.firstFrame=time.perf_counter()-self.created
+            print('first frame {:.0f} ms after the window was created'.format(1000*self.firstFrame))
+        if self.shared is not None:
+            self.pollShared()
+        if model.sceneDirty:
+            model.sceneDirty=False
+            self.glwidget.setScene(model.imu[0], model.imu[1], model.loadcell[:4])
+            self.frames+=1
+            self.frameCount+=1
+        if model.labelsDirty and now-self.lastLabels>=self.labelInterval:
+            model.labelsDirty=False
+            self.lastLabels=now
+            self.updateLabels()
+        if now-self.lastPlot>=self.plotInterval:
+            self.lastPlot=now
+            self.plot.update()
+        if self.hud is not None and now-self.lastHud>=1.0:
+            fps=self.frames/(now-self.lastHud)
+            rate=(model.messages-self.lastMessages)/(now-self.lastHud)
+            text=f'frame {self.glwidget.frameTime():.2f} ms  {fps:.0f} fps  {rate:.0f} msg/s  lag {self.lag.mean():.1f}/{self.lag.max():.1f} ms'
+            lost=sum(transport.lost for transport in self.transports)
+            if lost:
+                text+=f'  lost {lost}'
+            self.hud.setText(text)
+            self.hud.adjustSize()
+            self.frames=0
+            self.lastMessages=model.messages
+            self.lastHud=now
+
+    def pollShared(self):
+        # records are read in place and copied once, into the plot history
+        for topic, views in self.shared.poll().items():
+            for rows in views:
+                if topic=='loadcell':
+                    self.history.extendLoadcell(rows[:,0], rows[:,1:])
+                else:
+                    self.history.extendImu(rows[:,0], rows[:,1:])
+                self.model.update(topic, rows[-1,1:].tolist())
+                self.model.messages+=len(rows)-1
+
+    def updateLabels(self):
+        model=self.model
+        val=model.loadcell
+        self.ui.weight_val_label.setText(str(model.weight))
+        self.ui.force_val_label.setText(str(val[4]))
+        self.ui.m1_val_label.setText(str(val[0]))
+        self.ui.m2_val_label.setText(str(val[1]))
+        self.ui.m3_val_label.setText(str(val[2]))
+        self.ui.m4_val_label.setText(str(val[3]))
+        self.ui.pitch_val_label.setText(str(round(model.imu[0],4)))
+        self.ui.roll_val_label.setText(str(round(model.imu[1],4)))
+        self.ui.time_val_label.setText(model.time)
+        if model.metrics is not None:
+            thrust=model.metrics['thrust']
+            if model.metrics['ratio'] is not None:
+                self.ui.label_2ratio_val.setText(str(model.metrics['ratio']))
+            if thrust is not None:
+                self.metrics_label.setText(f'{thrust["mean"]} / {thrust["std"]} / {thrust["min"]} / {thrust["max"]}')
 
     @Slot(int)
     def on_stateChanged(self, state):
+        # every (re)connect subscribes again, a clean session forgets them
         if state == MqttClient.Connected:
             print(state)
-            self.client.subscribe('weight')
-            self.client.subscribe('loadcell')
-            self.client.subscribe('IMU')
-            self.client.subscribe('time')
-            self.client.subscribe('ratio')
-
-    @Slot(str)
-    def on_messageSignal(self, msg):
-        if msg.topic == 'weight':
-            try:
-                mstr=msg.payload.decode('utf-8')
-                self.ui.weight_val_label.setText(str(mstr))
-            except ValueError:
-                print('error: Not a number')
-        if msg.topic == 'loadcell':
-            try:
-                val=msg.payload.decode('utf-8')
-                val=json.loads(val)
-                self.ui.force_val_label.setText(str(val[4]))
-                self.ui.m1_val_label.setText(str(val[0]))
-                self.ui.m2_val_label.setText(str(val[1]))
-                self.ui.m3_val_label.setText(str(val[2]))
-                self.ui.m4_val_label.setText(str(val[3]))
-                self.motor1signalemit(val[0])
-                self.motor2signalemit(val[1])
-                self.motor3signalemit(val[2])
-                self.motor4signalemit(val[3])
-                #self.ui.label_2ratio_val.setText(str(round((val[4]/float(str(self.ui.weight_val_label.text()))),2)))
-            except ValueError:
-                print('error: Not a number')
-        if msg.topic == 'IMU':
-            try:
-                val=msg.payload.decode('utf-8')
-                val=json.loads(val)
-                self.ui.pitch_val_label.setText(str(round(val[0],4)))
-                self.ui.roll_val_label.setText(str(round(val[1],4)))
-                self.phiSignalemit(val[0])
-                self.thetaSignalemit(val[1])
-            except ValueError:
-                print('error: Not a number')
-        if msg.topic == 'time':
-                val=msg.payload.decode('utf-8')
-                self.ui.time_val_label.setText(val)
+            for topic in TOPICS:
+                self.client.subscribe(self.prefix+topic)
+            self.client.subscribe(self.prefix+'download/chunk')
+            self.client.subscribe(self.prefix+self.rpc.reply)
+            self.client.subscribe(self.prefix+'status')
+        self.showConnection()
+
+    @Slot()
+    def showConnection(self):
+        client=self.client
+        address=f'{client.hostname}:{client.port}'
+        if client.state == MqttClient.Connected:
+            text, color = 'connected to '+address, 'green'
+        elif client.state == MqttClient.Connecting:
+            text, color = 'connecting to '+address, 'orange'
+            if client.m_failures:
+                text+=f', failed attempts: {client.m_failures}'
+        else:
+            text, color = 'not connected', 'red'
+        self.connection_label.setText(text)
+        self.connection_label.setStyleSheet('color: '+color)
+
+    def publish(self, topic, payload=None):
+        self.client.publish(self.prefix+topic, payload)
+
+    @Slot(object)
+    def on_snapshot(self, snapshots):
+        snapshot=snapshots.get(self.rig)
+        if snapshot is None:
+            return
+        if snapshot.errors:
+            print('error: Not a number')
+        self.model.apply(snapshot)
+        self.history.extendLoadcell(snapshot.loadcellTimes, snapshot.loadcell)
+        self.history.extendImu(snapshot.imuTimes, snapshot.imu)
+
+    def closeEvent(self, event):
+        if self.feed is not None:
+            self.feed.stop()
+        if self.shared is not None:
+            self.shared.close()
+        for transport in self.transports:
+            transport.stop()
+        # also ends paho's reconnect attempts
+        self.client.disconnectFromHost()
+        if self.ownWorker:
+            self.worker.stop()
+        super(MainWindow, self).closeEvent(event)
+
+    def command(self, name):
+        # the reply comes on the MQTT thread, the label is updated on this one
+        self.rpc.call(name, done=self.commandReply.emit)
+
+    @Slot(object, object)
+    def on_commandReply(self, reply, rtt):
+        stats=self.rpc.stats()
+        if reply['ok']:
+            if reply['command']=='weigh':
+                self.model.update('weight', str(reply['result']))
+            text=f'{reply["command"]} ok in {1000*rtt:.1f} ms'
+        else:
+            text=f'{reply["command"]} failed: {reply["error"]}'
+            if reply['command']=='start':
+                self.ui.pushButton.setEnabled(True)
+        if stats['mean'] is not None:
+            text+=f' (mean {stats["mean"]} ms, max {stats["max"]} ms, {stats["pending"]} pending, {stats["timeouts"]} timeouts)'
+        self.command_label.setText(text)
+
+    @Slot(object)
+    def on_status(self, payload):
+        # a GUI started mid-run takes the mode, setpoints, weight and run from
+        # it, later ones follow what other GUIs on the same rig change
+        try:
+            status=json.loads(payload.decode('utf-8'))
+        except ValueError:
+            return
+        if not status.get('online', True):
+            self.command_label.setText('rig offline')
+            return
+        error=status.get('error')
+        if error is not None and error!=self.lastError:
+            self.command_label.setText(f'{error["command"]} refused: {error["error"]}')
+        self.lastError=error
+        if status['weight'] is not None:
+            self.model.update('weight', str(status['weight']))
+        self.showMode(status['mode']=='angle')
+        for slider, value in zip((self.ui.phi_slider, self.ui.theta_slider), status['setpoint']):
+            # not back at the user while dragging, and not published again
+            if not slider.isSliderDown():
+                slider.blockSignals(True)
+                slider.setValue(round(value*10))
+                slider.blockSignals(False)
+        self.ui.pushButton.setEnabled(not status['run']['active'])
 
     def tare(self):
-        self.client.publish('tare')
+        self.command('tare')
 
     def weigh(self):
-        self.client.publish('weigh')
+        self.command('weigh')
     def startIMU(self):
-        self.client.publish('start')
         self.ui.pushButton.setEnabled(False)
+        self.command('start')
         self.autoLevel()
 
     def stop(self):
-        self.client.publish('stop')
+        self.command('stop')
         self.ui.pushButton.setEnabled(True)
 
     def updateSliders(self):
         msg=(self.ui.phi_slider.value()/10,self.ui.theta_slider.value()/10)
         msg=json.dumps(msg)
-        self.client.publish(topic='updateSliders',payload=msg)
+        self.publish(topic='updateSliders',payload=msg)
 
     def autoLevel(self):
-        self.client.publish('autolevel')
-        self.ui.angle_button.setEnabled(True)
-        self.ui.autolevel_button.setEnabled(False)
-        self.ui.phi_slider.setEnabled(False)
-        self.ui.theta_slider.setEnabled(False)
-        self.angleflag=False
+        self.publish('autolevel')
+        self.showMode(False)
                     
     def angle(self):
-        self.client.publish('angle')
-        self.ui.autolevel_button.setEnabled(True)
-        self.ui.angle_button.setEnabled(False)
-        self.ui.phi_slider.setEnabled(True)
-        self.ui.theta_slider.setEnabled(True)
+        self.publish('angle')
+        self.showMode(True)
         self.ui.phi_slider.setValue(0.0)
         self.ui.theta_slider.setValue(0.0)
-        self.angleflag=True
+
+    def showMode(self, angle):
+        # buttons and sliders of angle or autolevel mode
+        self.ui.autolevel_button.setEnabled(angle)
+        self.ui.angle_button.setEnabled(not angle)
+        self.ui.phi_slider.setEnabled(angle)
+        self.ui.theta_slider.setEnabled(angle)
+        self.angleflag=angle
 
     def saveToFile(self):
-        self.client.publish('savetofile')
+        self.command('savetofile')
+
+    def downloadRun(self):
+        # the current run, finished or still recording
+        self.download.request('current')
+
+class Dashboard(QMainWindow):
+    # Several rigs side by side, one MainWindow panel per rig. The panels share
+    # one decode worker and one frame clock, and repaint as one top level window,
+    # so a rig adds its own drawing but no threads, timers or window flushes.
+    def __init__(self, rigs, transparent=False, columns=2, broker=None, **options):
+        super(Dashboard, self).__init__()
+        self.setWindowTitle('Test bench - '+', '.join(rig for rig, hostname, port in rigs))
+        self.worker=TelemetryWorker()
+        self.worker.start()
+        self.clock=FrameClock(self.screen().refreshRate() if self.screen() else 60, self)
+        self.lag=self.clock.lag
+        grid=QWidget()
+        layout=QGridLayout(grid)
+        self.panels=[]
+        # one UDP port per rig, counting up from udp
+        udp=options.pop('udp', 0)
+        for i, (rig, hostname, port) in enumerate(rigs):
+            panel=MainWindow(transparent, worker=self.worker, clock=self.clock, rig=rig, hostname=hostname, port=port, broker=broker,
+                             udp=udp+i if udp else 0, **options)
+            panel.setWindowFlags(Qt.Widget)
+            layout.addWidget(panel, i//columns, i%columns)
+            self.panels.append(panel)
+        area=QScrollArea()
+        area.setWidgetResizable(True)
+        area.setWidget(grid)
+        self.setCentralWidget(area)
+
+    def closeEvent(self, event):
+        for panel in self.panels:
+            panel.close()
+        self.worker.stop()
+        super(Dashboard, self).closeEvent(event)
+
+def parseRig(spec):
+    # NAME@HOST[:PORT], or just HOST[:PORT] for a rig on plain topic names
+    rig, _, address = spec.rpartition('@')
+    hostname, _, port = address.partition(':')
+    return rig, hostname, int(port or 1883)
+
+VERTEX_SHADER_120 = '''#version 120
+attribute vec3 position;
+attribute vec3 color;
+attribute float lift;
+uniform mat4 mvp;
+uniform float scale;
+varying vec3 v_color;
+void main() {
+    v_color = color;
+    gl_Position = mvp * vec4(position.xy, position.z + lift*scale, 1.0);
+}
+'''
+FRAGMENT_SHADER_120 = '''#version 120
+varying vec3 v_color;
+void main() {
+    gl_FragColor = vec4(v_color, 1.0);
+}
+'''
+VERTEX_SHADER_150 = '''#version 150
+in vec3 position;
+in vec3 color;
+in float lift;
+uniform mat4 mvp;
+uniform float scale;
+out vec3 v_color;
+void main() {
+    v_color = color;
+    gl_Position = mvp * vec4(position.xy, position.z + lift*scale, 1.0);
+}
+'''
+FRAGMENT_SHADER_150 = '''#version 150
+in vec3 v_color;
+out vec4 fragColor;
+void main() {
+    fragColor = vec4(v_color, 1.0);
+}
+'''
 
 class OpenGLWidget(QOpenGLWidget, QOpenGLFunctions):
     def __init__(self, transparent, parent=None):
@@ -306,6 +743,8 @@ class OpenGLWidget(QOpenGLWidget, QOpenGLFunctions):
         self.motor2_val=0
         self.motor3_val=0
         self.motor4_val=0
+        self.projection=scene.perspective(45,960/540,0.1,100.0)
+        self.frameTimes=deque(maxlen=120) # paintGL durations in seconds
 
     def phiRotation(self):
         return self.phi_rotation
@@ -356,677 +795,99 @@ class OpenGLWidget(QOpenGLWidget, QOpenGLFunctions):
             self.motor4_val=val/196.2
             self.update()
 
+    def setScene(self, phi, theta, motors):
+        # all values of one frame at once, a single repaint
+        self.phi_rotation=phi
+        self.theta_rotation=theta
+        self.motor1_val, self.motor2_val, self.motor3_val, self.motor4_val = [val/196.2 for val in motors]
+        self.update()
+
+    def frameTime(self):
+        # mean paintGL time of the last frames in ms
+        if not self.frameTimes:
+            return 0.0
+        return 1000*sum(self.frameTimes)/len(self.frameTimes)
+
+    def compileShader(self, source, shaderType):
+        shader=glCreateShader(shaderType)
+        glShaderSource(shader, source)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            raise RuntimeError('shader compile failed: '+glGetShaderInfoLog(shader).decode())
+        return shader
+
     def initializeGL(self):
-        glShadeModel(GL_SMOOTH)
         glClearColor(0.0,0.0,0.0,0.0 if self._transparent else 1)
         glClearDepth(1.0)
         glEnable(GL_DEPTH_TEST)
         glDepthFunc(GL_LEQUAL)
-        glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)
-    
+
+        if self._core:
+            vertex, fragment = VERTEX_SHADER_150, FRAGMENT_SHADER_150
+        else:
+            vertex, fragment = VERTEX_SHADER_120, FRAGMENT_SHADER_120
+        self.program=glCreateProgram()
+        glAttachShader(self.program, self.compileShader(vertex, GL_VERTEX_SHADER))
+        glAttachShader(self.program, self.compileShader(fragment, GL_FRAGMENT_SHADER))
+        glBindAttribLocation(self.program, 0, 'position')
+        glBindAttribLocation(self.program, 1, 'color')
+        glBindAttribLocation(self.program, 2, 'lift')
+        glLinkProgram(self.program)
+        if not glGetProgramiv(self.program, GL_LINK_STATUS):
+            raise RuntimeError('shader link failed: '+glGetProgramInfoLog(self.program).decode())
+        self.mvpLocation=glGetUniformLocation(self.program, 'mvp')
+        self.scaleLocation=glGetUniformLocation(self.program, 'scale')
+
+        # static geometry is uploaded once, only the bar scales and the matrix change per frame
+        vertices, self.ranges = scene.build()
+        self.vao=None
+        if self._core:
+            self.vao=glGenVertexArrays(1)
+            glBindVertexArray(self.vao)
+        self.vbo=glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        if self._core:
+            self.setupAttributes()
+            glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def setupAttributes(self):
+        stride=scene.VERTEX_SIZE*4
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(1)
+        glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(12))
+        glEnableVertexAttribArray(2)
+        glVertexAttribPointer(2, 1, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(24))
+
     def paintGL(self):
+        start=time.perf_counter()
         glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
-        glLoadIdentity()
-        glTranslatef(0.0,0.0,-2)
-        # rotate with IMU values
-        glRotate(90-self.phi_rotation,-1,0,0) # x axis
-        glRotate(self.theta_rotation,0,-1,0) # y axis
-
-        # GL graphic definition
-        # MAIN PLATE
-        plate_top=((0.5,-1.0,0.0),(1.0,-0.5,0.0),(1.0,0.5,0.0),(0.5,1.0,0.0),(-0.5,1.0,0.0),(-1.0,0.5,0.0),(-1.0,-0.5,0.0),(-0.5,-1.0,0.0))
-        plate_bottom=((0.5,-1.0,-0.05),(1.0,-0.5,-0.05),(1.0,0.5,-0.05),(0.5,1.0,-0.05),(-0.5,1.0,-0.05),(-1.0,0.5,-0.05),(-1.0,-0.5,-0.05),(-0.5,-1.0,-0.05))
-        #MOTOR TOWERS
-        tower1_bottom=((0.65,-0.65,0.0),(0.65,-0.55,0.0),(0.55,-0.55,0.0),(0.55,-0.65,0.0))
-        tower1_top=((0.65,-0.65,0.1),(0.65,-0.55,0.1),(0.55,-0.55,0.1),(0.55,-0.65,0.1))
-        tower2_bottom=((0.65,0.65,0.0),(0.65,0.55,0.0),(0.55,0.55,0.0),(0.55,0.65,0.0))
-        tower2_top=((0.65,0.65,0.1),(0.65,0.55,0.1),(0.55,0.55,0.1),(0.55,0.65,0.1))
-        tower3_bottom=((-0.65,0.65,0.0),(-0.65,0.55,0.0),(-0.55,0.55,0.0),(-0.55,0.65,0.0))
-        tower3_top=((-0.65,0.65,0.1),(-0.65,0.55,0.1),(-0.55,0.55,0.1),(-0.55,0.65,0.1))
-        tower4_bottom=((-0.65,-0.65,0.0),(-0.65,-0.55,0.0),(-0.55,-0.55,0.0),(-0.55,-0.65,0.0))
-        tower4_top=((-0.65,-0.65,0.1),(-0.65,-0.55,0.1),(-0.55,-0.55,0.1),(-0.55,-0.65,0.1))
-        # MOTORS
-        motor1_bottom=((0.6,-0.8,0.1),(0.74142,-0.74142,0.1),(0.8,-0.6,0.1),(0.74142,-0.45858,0.1),(0.6,-0.4,0.1),(0.45858,-0.45858,0.1),(0.4,-0.6,0.1),(0.45858,-0.74142,0.1))
-        motor1_top=((0.6,-0.8,0.15),(0.74142,-0.74142,0.15),(0.8,-0.6,0.15),(0.74142,-0.45858,0.15),(0.6,-0.4,0.15),(0.45858,-0.45858,0.15),(0.4,-0.6,0.15),(0.45858,-0.74142,0.15))
-        motor2_bottom=((0.6,0.8,0.1),(0.74142,0.74142,0.1),(0.8,0.6,0.1),(0.74142,0.45858,0.1),(0.6,0.4,0.1),(0.45858,0.45858,0.1),(0.4,0.6,0.1),(0.45858,0.74142,0.1))
-        motor2_top=((0.6,0.8,0.15),(0.74142,0.74142,0.15),(0.8,0.6,0.15),(0.74142,0.45858,0.15),(0.6,0.4,0.15),(0.45858,0.45858,0.15),(0.4,0.6,0.15),(0.45858,0.74142,0.15))
-        motor3_bottom=((-0.6,0.8,0.1),(-0.74142,0.74142,0.1),(-0.8,0.6,0.1),(-0.74142,0.45858,0.1),(-0.6,0.4,0.1),(-0.45858,0.45858,0.1),(-0.4,0.6,0.1),(-0.45858,0.74142,0.1))
-        motor3_top=((-0.6,0.8,0.15),(-0.74142,0.74142,0.15),(-0.8,0.6,0.15),(-0.74142,0.45858,0.15),(-0.6,0.4,0.15),(-0.45858,0.45858,0.15),(-0.4,0.6,0.15),(-0.45858,0.74142,0.15))
-        motor4_bottom=((-0.6,-0.8,0.1),(-0.74142,-0.74142,0.1),(-0.8,-0.6,0.1),(-0.74142,-0.45858,0.1),(-0.6,-0.4,0.1),(-0.45858,-0.45858,0.1),(-0.4,-0.6,0.1),(-0.45858,-0.74142,0.1))
-        motor4_top=((-0.6,-0.8,0.15),(-0.74142,-0.74142,0.15),(-0.8,-0.6,0.15),(-0.74142,-0.45858,0.15),(-0.6,-0.4,0.15),(-0.45858,-0.45858,0.15),(-0.4,-0.6,0.15),(-0.45858,-0.74142,0.15))
-        # LOADCELL VALUES
-        loadcell1_bottom=((0.7,-0.7,0.15),(0.7,-0.5,0.15),(0.5,-0.5,0.15),(0.5,-0.7,0.15))
-        loadcell1_top=((0.7,-0.7,self.motor1_val+0.15),(0.7,-0.5,self.motor1_val+0.15),(0.5,-0.5,self.motor1_val+0.15),(0.5,-0.7,self.motor1_val+0.15))
-        loadcell2_bottom=((0.7,0.7,0.15),(0.7,0.5,0.15),(0.5,0.5,0.15),(0.5,0.7,0.15))
-        loadcell2_top=((0.7,0.7,self.motor2_val+0.15),(0.7,0.5,self.motor2_val+0.15),(0.5,0.5,self.motor2_val+0.15),(0.5,0.7,self.motor2_val+0.15))
-        loadcell3_bottom=((-0.7,0.7,0.15),(-0.7,0.5,0.15),(-0.5,0.5,0.15),(-0.5,0.7,0.15))
-        loadcell3_top=((-0.7,0.7,self.motor3_val+0.15),(-0.7,0.5,self.motor3_val+0.15),(-0.5,0.5,self.motor3_val+0.15),(-0.5,0.7,self.motor3_val+0.15))
-        loadcell4_bottom=((-0.7,-0.7,0.15),(-0.7,-0.5,0.15),(-0.5,-0.5,0.15),(-0.5,-0.7,0.15))
-        loadcell4_top=((-0.7,-0.7,self.motor4_val+0.15),(-0.7,-0.5,self.motor4_val+0.15),(-0.5,-0.5,self.motor4_val+0.15),(-0.5,-0.7,self.motor4_val+0.15))
-
-        # PLATE TOP FACE
-        glBegin(GL_POLYGON)
-        glColor(0.0,1.0,0.0)
-        for vertex in plate_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # PLATE BOTTOM FACE
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in plate_bottom:
-            glVertex3fv(vertex)
-        glEnd()
-        # PLATE SIDE FACES
-        glBegin(GL_POLYGON)
-        glColor(0.5,0.5,0.5)
-        glVertex3fv(plate_top[0])
-        glVertex3fv(plate_top[1])
-        glVertex3fv(plate_bottom[1])
-        glVertex3fv(plate_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.5,0.5,0.5)
-        glVertex3fv(plate_top[1])
-        glVertex3fv(plate_top[2])
-        glVertex3fv(plate_bottom[2])
-        glVertex3fv(plate_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.5,0.5,0.5)
-        glVertex3fv(plate_top[2])
-        glVertex3fv(plate_top[3])
-        glVertex3fv(plate_bottom[3])
-        glVertex3fv(plate_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.5,0.5,0.5)
-        glVertex3fv(plate_top[3])
-        glVertex3fv(plate_top[4])
-        glVertex3fv(plate_bottom[4])
-        glVertex3fv(plate_bottom[3])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.5,0.5,0.5)
-        glVertex3fv(plate_top[4])
-        glVertex3fv(plate_top[5])
-        glVertex3fv(plate_bottom[5])
-        glVertex3fv(plate_bottom[4])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.5,0.5,0.5)
-        glVertex3fv(plate_top[5])
-        glVertex3fv(plate_top[6])
-        glVertex3fv(plate_bottom[6])
-        glVertex3fv(plate_bottom[5])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.5,0.5,0.5)
-        glVertex3fv(plate_top[6])
-        glVertex3fv(plate_top[7])
-        glVertex3fv(plate_bottom[7])
-        glVertex3fv(plate_bottom[6])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.5,0.5,0.5)
-        glVertex3fv(plate_top[7])
-        glVertex3fv(plate_top[0])
-        glVertex3fv(plate_bottom[0])
-        glVertex3fv(plate_bottom[7])
-        glEnd()
-
-        # TOWER 1
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower1_bottom[0])
-        glVertex3fv(tower1_bottom[1])
-        glVertex3fv(tower1_top[1])
-        glVertex3fv(tower1_top[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower1_bottom[1])
-        glVertex3fv(tower1_bottom[2])
-        glVertex3fv(tower1_top[2])
-        glVertex3fv(tower1_top[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower1_bottom[2])
-        glVertex3fv(tower1_bottom[3])
-        glVertex3fv(tower1_top[3])
-        glVertex3fv(tower1_top[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower1_bottom[3])
-        glVertex3fv(tower1_bottom[0])
-        glVertex3fv(tower1_top[0])
-        glVertex3fv(tower1_top[3])
-        glEnd()
-
-        # TOWER 2
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower2_bottom[0])
-        glVertex3fv(tower2_bottom[1])
-        glVertex3fv(tower2_top[1])
-        glVertex3fv(tower2_top[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower2_bottom[1])
-        glVertex3fv(tower2_bottom[2])
-        glVertex3fv(tower2_top[2])
-        glVertex3fv(tower2_top[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower2_bottom[2])
-        glVertex3fv(tower2_bottom[3])
-        glVertex3fv(tower2_top[3])
-        glVertex3fv(tower2_top[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower2_bottom[3])
-        glVertex3fv(tower2_bottom[0])
-        glVertex3fv(tower2_top[0])
-        glVertex3fv(tower2_top[3])
-        glEnd()
-
-        # TOWER 3
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower3_bottom[0])
-        glVertex3fv(tower3_bottom[1])
-        glVertex3fv(tower3_top[1])
-        glVertex3fv(tower3_top[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower3_bottom[1])
-        glVertex3fv(tower3_bottom[2])
-        glVertex3fv(tower3_top[2])
-        glVertex3fv(tower3_top[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower3_bottom[2])
-        glVertex3fv(tower3_bottom[3])
-        glVertex3fv(tower3_top[3])
-        glVertex3fv(tower3_top[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower3_bottom[3])
-        glVertex3fv(tower3_bottom[0])
-        glVertex3fv(tower3_top[0])
-        glVertex3fv(tower3_top[3])
-        glEnd()
-
-        # TOWER 4
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower4_bottom[0])
-        glVertex3fv(tower4_bottom[1])
-        glVertex3fv(tower4_top[1])
-        glVertex3fv(tower4_top[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower4_bottom[1])
-        glVertex3fv(tower4_bottom[2])
-        glVertex3fv(tower4_top[2])
-        glVertex3fv(tower4_top[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower4_bottom[2])
-        glVertex3fv(tower4_bottom[3])
-        glVertex3fv(tower4_top[3])
-        glVertex3fv(tower4_top[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,1.0,0.0)
-        glVertex3fv(tower4_bottom[3])
-        glVertex3fv(tower4_bottom[0])
-        glVertex3fv(tower4_top[0])
-        glVertex3fv(tower4_top[3])
-        glEnd()
-
-        # MOTOR 1
-        # Motor 1 top face
-        glBegin(GL_POLYGON)
-        glColor(0.0,1.0,0.0)
-        for vertex in motor1_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # Motor 1 bottom face
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in motor1_bottom:
-            glVertex3fv(vertex)
-        glEnd()
-        # Motor 1 side faces
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor1_top[0])
-        glVertex3fv(motor1_top[1])
-        glVertex3fv(motor1_bottom[1])
-        glVertex3fv(motor1_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor1_top[1])
-        glVertex3fv(motor1_top[2])
-        glVertex3fv(motor1_bottom[2])
-        glVertex3fv(motor1_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor1_top[2])
-        glVertex3fv(motor1_top[3])
-        glVertex3fv(motor1_bottom[3])
-        glVertex3fv(motor1_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor1_top[3])
-        glVertex3fv(motor1_top[4])
-        glVertex3fv(motor1_bottom[4])
-        glVertex3fv(motor1_bottom[3])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor1_top[4])
-        glVertex3fv(motor1_top[5])
-        glVertex3fv(motor1_bottom[5])
-        glVertex3fv(motor1_bottom[4])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor1_top[5])
-        glVertex3fv(motor1_top[6])
-        glVertex3fv(motor1_bottom[6])
-        glVertex3fv(motor1_bottom[5])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor1_top[6])
-        glVertex3fv(motor1_top[7])
-        glVertex3fv(motor1_bottom[7])
-        glVertex3fv(motor1_bottom[6])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor1_top[7])
-        glVertex3fv(motor1_top[0])
-        glVertex3fv(motor1_bottom[0])
-        glVertex3fv(motor1_bottom[7])
-        glEnd()
-
-        # MOTOR 2
-        # Motor 2 top face
-        glBegin(GL_POLYGON)
-        glColor(0.0,1.0,0.0)
-        for vertex in motor2_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # Motor 2 bottom face
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in motor2_bottom:
-            glVertex3fv(vertex)
-        glEnd()
-        # Motor 2 side faces
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor2_top[0])
-        glVertex3fv(motor2_top[1])
-        glVertex3fv(motor2_bottom[1])
-        glVertex3fv(motor2_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor2_top[1])
-        glVertex3fv(motor2_top[2])
-        glVertex3fv(motor2_bottom[2])
-        glVertex3fv(motor2_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor2_top[2])
-        glVertex3fv(motor2_top[3])
-        glVertex3fv(motor2_bottom[3])
-        glVertex3fv(motor2_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor2_top[3])
-        glVertex3fv(motor2_top[4])
-        glVertex3fv(motor2_bottom[4])
-        glVertex3fv(motor2_bottom[3])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor2_top[4])
-        glVertex3fv(motor2_top[5])
-        glVertex3fv(motor2_bottom[5])
-        glVertex3fv(motor2_bottom[4])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor2_top[5])
-        glVertex3fv(motor2_top[6])
-        glVertex3fv(motor2_bottom[6])
-        glVertex3fv(motor2_bottom[5])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor2_top[6])
-        glVertex3fv(motor2_top[7])
-        glVertex3fv(motor2_bottom[7])
-        glVertex3fv(motor2_bottom[6])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor2_top[7])
-        glVertex3fv(motor2_top[0])
-        glVertex3fv(motor2_bottom[0])
-        glVertex3fv(motor2_bottom[7])
-        glEnd()
-
-        # MOTOR 3
-        # Motor 3 top face
-        glBegin(GL_POLYGON)
-        glColor(0.0,1.0,0.0)
-        for vertex in motor3_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # Motor 3 bottom face
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in motor3_bottom:
-            glVertex3fv(vertex)
-        glEnd()
-        # Motor 3 side faces
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor3_top[0])
-        glVertex3fv(motor3_top[1])
-        glVertex3fv(motor3_bottom[1])
-        glVertex3fv(motor3_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor3_top[1])
-        glVertex3fv(motor3_top[2])
-        glVertex3fv(motor3_bottom[2])
-        glVertex3fv(motor3_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor3_top[2])
-        glVertex3fv(motor3_top[3])
-        glVertex3fv(motor3_bottom[3])
-        glVertex3fv(motor3_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor3_top[3])
-        glVertex3fv(motor3_top[4])
-        glVertex3fv(motor3_bottom[4])
-        glVertex3fv(motor3_bottom[3])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor3_top[4])
-        glVertex3fv(motor3_top[5])
-        glVertex3fv(motor3_bottom[5])
-        glVertex3fv(motor3_bottom[4])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor3_top[5])
-        glVertex3fv(motor3_top[6])
-        glVertex3fv(motor3_bottom[6])
-        glVertex3fv(motor3_bottom[5])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor3_top[6])
-        glVertex3fv(motor3_top[7])
-        glVertex3fv(motor3_bottom[7])
-        glVertex3fv(motor3_bottom[6])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor3_top[7])
-        glVertex3fv(motor3_top[0])
-        glVertex3fv(motor3_bottom[0])
-        glVertex3fv(motor3_bottom[7])
-        glEnd()
-
-        # MOTOR 4
-        # Motor 4 top face
-        glBegin(GL_POLYGON)
-        glColor(0.0,1.0,0.0)
-        for vertex in motor4_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # Motor 4 bottom face
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in motor4_bottom:
-            glVertex3fv(vertex)
-        glEnd()
-        # Motor 4 side faces
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor4_top[0])
-        glVertex3fv(motor4_top[1])
-        glVertex3fv(motor4_bottom[1])
-        glVertex3fv(motor4_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor4_top[1])
-        glVertex3fv(motor4_top[2])
-        glVertex3fv(motor4_bottom[2])
-        glVertex3fv(motor4_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor4_top[2])
-        glVertex3fv(motor4_top[3])
-        glVertex3fv(motor4_bottom[3])
-        glVertex3fv(motor4_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor4_top[3])
-        glVertex3fv(motor4_top[4])
-        glVertex3fv(motor4_bottom[4])
-        glVertex3fv(motor4_bottom[3])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor4_top[4])
-        glVertex3fv(motor4_top[5])
-        glVertex3fv(motor4_bottom[5])
-        glVertex3fv(motor4_bottom[4])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor4_top[5])
-        glVertex3fv(motor4_top[6])
-        glVertex3fv(motor4_bottom[6])
-        glVertex3fv(motor4_bottom[5])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor4_top[6])
-        glVertex3fv(motor4_top[7])
-        glVertex3fv(motor4_bottom[7])
-        glVertex3fv(motor4_bottom[6])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(0.7,0.7,0.7)
-        glVertex3fv(motor4_top[7])
-        glVertex3fv(motor4_top[0])
-        glVertex3fv(motor4_bottom[0])
-        glVertex3fv(motor4_bottom[7])
-        glEnd()
-
-        # LOADCELL TOWERS
-        # Loadcell 1 top face
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in loadcell1_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # Loadcell 1 side faces
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell1_top[0])
-        glVertex3fv(loadcell1_top[1])
-        glVertex3fv(loadcell1_bottom[1])
-        glVertex3fv(loadcell1_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell1_top[1])
-        glVertex3fv(loadcell1_top[2])
-        glVertex3fv(loadcell1_bottom[2])
-        glVertex3fv(loadcell1_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell1_top[2])
-        glVertex3fv(loadcell1_top[3])
-        glVertex3fv(loadcell1_bottom[3])
-        glVertex3fv(loadcell1_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell1_top[3])
-        glVertex3fv(loadcell1_top[0])
-        glVertex3fv(loadcell1_bottom[0])
-        glVertex3fv(loadcell1_bottom[3])
-        glEnd()
-        # Loadcell 2 top face
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in loadcell2_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # Loadcell 2 side faces
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell2_top[0])
-        glVertex3fv(loadcell2_bottom[1])
-        glVertex3fv(loadcell2_bottom[1])
-        glVertex3fv(loadcell2_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell2_top[1])
-        glVertex3fv(loadcell2_top[2])
-        glVertex3fv(loadcell2_bottom[2])
-        glVertex3fv(loadcell2_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell2_top[2])
-        glVertex3fv(loadcell2_top[3])
-        glVertex3fv(loadcell2_bottom[3])
-        glVertex3fv(loadcell2_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell2_top[3])
-        glVertex3fv(loadcell2_top[0])
-        glVertex3fv(loadcell2_bottom[0])
-        glVertex3fv(loadcell2_bottom[3])
-        glEnd()
-        # Loadcell 3 top face
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in loadcell3_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # Loadcell 3 side faces
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell3_top[0])
-        glVertex3fv(loadcell3_top[1])
-        glVertex3fv(loadcell3_bottom[1])
-        glVertex3fv(loadcell3_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell3_top[1])
-        glVertex3fv(loadcell3_top[2])
-        glVertex3fv(loadcell3_bottom[2])
-        glVertex3fv(loadcell3_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell3_top[2])
-        glVertex3fv(loadcell3_top[3])
-        glVertex3fv(loadcell3_bottom[3])
-        glVertex3fv(loadcell3_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell3_top[3])
-        glVertex3fv(loadcell3_top[0])
-        glVertex3fv(loadcell3_bottom[0])
-        glVertex3fv(loadcell3_bottom[3])
-        glEnd()
-        # Loadcell 4 top face
-        glBegin(GL_POLYGON)
-        glColor(0.0,0.0,1.0)
-        for vertex in loadcell4_top:
-            glVertex3fv(vertex)
-        glEnd()
-        # Loadcell 4 side faces
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell4_top[0])
-        glVertex3fv(loadcell4_top[1])
-        glVertex3fv(loadcell4_bottom[1])
-        glVertex3fv(loadcell4_bottom[0])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell4_top[1])
-        glVertex3fv(loadcell4_top[2])
-        glVertex3fv(loadcell4_bottom[2])
-        glVertex3fv(loadcell4_bottom[1])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell4_top[2])
-        glVertex3fv(loadcell4_top[3])
-        glVertex3fv(loadcell4_bottom[3])
-        glVertex3fv(loadcell4_bottom[2])
-        glEnd()
-        glBegin(GL_POLYGON)
-        glColor(1.0,0.1,0.1)
-        glVertex3fv(loadcell4_top[3])
-        glVertex3fv(loadcell4_top[0])
-        glVertex3fv(loadcell4_bottom[0])
-        glVertex3fv(loadcell4_bottom[3])
-        glEnd()        
+        glUseProgram(self.program)
+        if self.vao is not None:
+            glBindVertexArray(self.vao)
+        else:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            self.setupAttributes()
+        mvp=self.projection@scene.modelview(self.phi_rotation, self.theta_rotation)
+        glUniformMatrix4fv(self.mvpLocation, 1, GL_TRUE, mvp.astype(np.float32))
+        glUniform1f(self.scaleLocation, 0.0)
+        first, count = self.ranges[0]
+        glDrawArrays(GL_TRIANGLES, first, count)
+        for (first, count), val in zip(self.ranges[1:], (self.motor1_val, self.motor2_val, self.motor3_val, self.motor4_val)):
+            glUniform1f(self.scaleLocation, val)
+            glDrawArrays(GL_TRIANGLES, first, count)
+        if self.vao is not None:
+            glBindVertexArray(0)
+        else:
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glUseProgram(0)
+        self.frameTimes.append(time.perf_counter()-start)
 
     def resizeGL(self,w,h):
         glViewport(0,0,w,h)
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluPerspective(45,1.0*960/540, 0.1,100.0)
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        self.projection=scene.perspective(45,1.0*w/max(h,1),0.1,100.0)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -1034,6 +895,17 @@ if __name__ == '__main__':
     parser.add_argument('--multisample', '-m', action='store_true',help='Use Multisampling')
     parser.add_argument('--coreprofile', '-c', action='store_true',help='Use Core Profile')
     parser.add_argument('--transparent', '-t', action='store_true',help='Transparent Windows')
+    parser.add_argument('--plotwindow', '-w', type=float, default=30, help='Seconds of history shown in the live plots')
+    parser.add_argument('--plotmethod', choices=('lttb','minmax'), default='lttb', help='Downsampling used by the live plots')
+    parser.add_argument('--labelrate', type=float, default=10, help='Maximum label updates per second')
+    parser.add_argument('--nohud', action='store_true', help='Hide the frame time and message rate overlay')
+    parser.add_argument('--synthetic', type=int, default=0, metavar='RATE', help='Feed synthetic telemetry at RATE msg/s instead of connecting')
+    parser.add_argument('--rig', action='append', type=parseRig, default=[], metavar='NAME@HOST[:PORT]', help='Watch a rig publishing under NAME/, repeat for a dashboard of several rigs')
+    parser.add_argument('--simulate', type=int, default=0, metavar='N', help='Dashboard of N simulated rigs on an in-process broker, at --synthetic msg/s each')
+    parser.add_argument('--columns', type=int, default=2, help='Dashboard panels per row')
+    parser.add_argument('--shm', action='store_true', help='Read loadcell and IMU samples from shared memory, for Rpi_mqtt.py -s on this host')
+    parser.add_argument('--udp', type=int, default=0, metavar='PORT', help='Also receive telemetry as UDP datagrams on PORT, for Rpi_mqtt.py -u (one port per rig from PORT up)')
+    parser.add_argument('--view', metavar='RUN', help='Browse a recorded run instead of connecting: logs/*.json, a downloaded .npz or a raw logs/*_loadcell.bin or *_imu.bin capture')
     options = parser.parse_args()
 
     fmt = QSurfaceFormat()
@@ -1044,6 +916,21 @@ if __name__ == '__main__':
         fmt.setVersion(3, 2)
         fmt.setProfile(QSurfaceFormat.CoreProfile)
     QSurfaceFormat.setDefaultFormat(fmt)
-    window = MainWindow(options.transparent)
+    feeds = []
+    if options.view:
+        window = ViewerWindow(options.view)
+    elif options.simulate:
+        broker = LoopbackBroker()
+        rigs = [('rig'+str(i+1), 'localhost', 1883) for i in range(options.simulate)]
+        window = Dashboard(rigs, options.transparent, options.columns, broker, plotwindow=options.plotwindow, plotmethod=options.plotmethod, labelrate=options.labelrate, hud=not options.nohud)
+        for rig, hostname, port in rigs:
+            feeds.append(simulatedRig(broker, rig, options.synthetic or 100))
+            feeds[-1].start()
+    elif len(options.rig)>1:
+        window = Dashboard(options.rig, options.transparent, options.columns, plotwindow=options.plotwindow, plotmethod=options.plotmethod, labelrate=options.labelrate, hud=not options.nohud, shm=options.shm, udp=options.udp)
+    else:
+        rig, hostname, port = options.rig[0] if options.rig else ('', '192.168.0.13', 1883)
+        window = MainWindow(options.transparent, options.plotwindow, options.plotmethod, options.labelrate, hud=not options.nohud, synthetic=options.synthetic,
+                            hostname=hostname, port=port, rig=rig, shm=options.shm, udp=options.udp)
     window.show()
     sys.exit(app.exec())
\ No newline at end of file
@@ -1,9 +1,25 @@
 import pandas as pd
-from loadcell import loadcell
+import numpy as np
+from loadcell import loadcell, records, LOADCELL_DTYPE
+from imucapture import ImuCapture
+from filters import FilterPipeline
+from ringbuffer import RingBuffer, BulkWriter
+from shmring import SharedRing, ringName
+from transport import MqttTransport, UdpTransport, UDP_PORT
+from acquisition import control, pin, AcquisitionProcess, SharedConfig, parseCores, TARE, WEIGH
+from aioruntime import AsyncRuntime, LoopPublisher
+from download import RunSender
+from campaign import Campaign, parseSweep
+from trigger import TriggerCapture
+from metrics import Metrics
+from rpc import RpcServer
+from status import StatusCache, OFFLINE
 import gpiozero as gpio
 import RPi.GPIO as GPIO
 import paho.mqtt.client as mqtt
 import threading
+import asyncio
+import signal
 from simple_pid import PID
 import json
 import sys, getopt
@@ -16,24 +32,79 @@ sys.path.append('/usr/local/lib/python3.10/dist-packages/RTIMULib-8.1.0-py3.10-l
 
 def weigh():
     global client
-    weight=lc.weigh()
-    client.publish('weight', weight)
+    try:
+        client.publish(namespace+'weight', measureWeight())
+    except RuntimeError as e:
+        refuse('weigh', e)
+def measureWeight():
+    # the rpc weigh replies with the weight instead of publishing it on 'weight'
+    weight=loadcellCommand(WEIGH) if processes else lc.weigh()
+    metrics.setWeight(weight)
+    status.update(weight=weight)
+    return weight
 def tare():
-    lc.tare()
+    if processes:
+        loadcellCommand(TARE)
+    else:
+        lc.tare()
+def loadcellCommand(command, timeout=10.0):
+    # -p: the loadcell process owns the HX711s and their zero, tare and weigh
+    # run there; RuntimeError when it does not get to it in time
+    with lcLock:
+        state.lcCommand=command
+        deadline=time.monotonic()+timeout
+        while state.lcCommand and time.monotonic()<deadline:
+            time.sleep(0.01)
+        if state.lcCommand:
+            state.lcCommand=0
+            raise RuntimeError('the loadcell process did not answer')
+        if math.isnan(state.lcResult):
+            raise RuntimeError('tare or weigh failed in the loadcell process')
+        return state.lcResult
+def serveLoadcellCommand():
+    # in the loadcell process, between reads
+    try:
+        if state.lcCommand==TARE:
+            lc.tare()
+            state.lcResult=0.0
+        elif state.lcCommand==WEIGH:
+            state.lcResult=lc.weigh()
+    except Exception as e:
+        print('loadcell command failed: '+repr(e))
+        state.lcResult=math.nan
+    finally:
+        state.lcCommand=0
+def refuse(command, error):
+    # a command with a bad payload is not run: printed, and the status tells the GUI
+    print(command+' refused: '+str(error))
+    status.update(error={'command':command, 'error':str(error), 'time':round(time.time(), 3)})
+def makeServos():
+    # set servo initial values
+    right=gpio.AngularServo(12,initial_angle=0.0, min_angle=-90, max_angle=90, min_pulse_width=0.00075,max_pulse_width=0.0022) # 0.75ms to 2.2ms with 20ms period
+    left=gpio.AngularServo(16,initial_angle=0.0, min_angle=-90, max_angle=90, min_pulse_width=0.00075,max_pulse_width=0.0022)
+    front=gpio.AngularServo(20,initial_angle=0.0, min_angle=-90, max_angle=90, min_pulse_width=0.00075,max_pulse_width=0.0022)
+    back=gpio.AngularServo(21,initial_angle=0.0, min_angle=-90, max_angle=90, min_pulse_width=0.00077,max_pulse_width=0.0022)
+    right.angle=0.0
+    left.angle=0.0
+    back.angle=0.0
+    front.angle=0.0
+    return right, left, front, back
 def startIMU():
+    # runs for the life of the service: the IMU is set up once and read
+    # between runs too, so the fusion has settled when a run starts; while
+    # state.imu is set it publishes, records and drives the servos
     global client
-    global IMUflag
+    global right
+    global left
+    global front
+    global back
     global phi
     global theta
-    global phi_slider_val
-    global theta_slider_val
-    global angleflag
-    global autolevelflag
     global file
-    global stopwatchFlag
     global timestamp
-    stopwatchFlag=True
-    IMUflag=True
+    global poll_interval
+    # -p: in the IMU process, RPi.GPIO's software PWM threads do not survive a fork
+    right, left, front, back = makeServos()
     SETTINGS_FILE = "RTIMULib"
     s = RTIMU.Settings(SETTINGS_FILE)
     imu = RTIMU.RTIMU(s)
@@ -48,198 +119,720 @@ def startIMU():
     imu.setAccelEnable(True)
     imu.setCompassEnable(False)
     poll_interval=imu.IMUGetPollInterval()
+    # -p: the main process sizes the trigger rings with it
+    state.pollInterval=poll_interval
 
-    while IMUflag:
-        if imu.IMURead():
-            fusiondata = imu.getFusionData()
-            phi= math.degrees(fusiondata[0])
-            theta = math.degrees(fusiondata[1])
+    while True:
+        state.imuIdle=True
+        while state.service and not state.imu:
+            if imu.IMURead():
+                imu.getFusionData()
             time.sleep(poll_interval*1.0/1000.0)
-            msg=(phi,theta)
-            msg=json.dumps(msg)
-            client.publish('IMU',msg)
-            if autolevelflag:
-                # angleroll=round(pidroll(theta),1)
-                # anglepitch=round(pidroll(phi),1)
-                # data=df.loc[(anglepitch,angleroll)]
-                data=df.loc[(round(phi),round(theta))]
-                rightpos=data.loc['right']
-                leftpos=-data.loc['left']
-                frontpos=data.loc['front']
-                backpos=data.loc['back']
-                right.angle=rightpos
-                left.angle=leftpos
-                front.angle=frontpos
-                back.angle=backpos
-            elif angleflag:
-                angleroll=round(pidroll(theta),1)
-                anglepitch=round(pidpitch(phi),1)
-                data=df.loc[(anglepitch,angleroll)]
-                rightpos=data.loc['right']
-                leftpos=data.loc['left']
-                frontpos=data.loc['front']
-                backpos=data.loc['back']
-                right.angle=rightpos
-                left.angle=leftpos
-                front.angle=frontpos
-                back.angle=backpos
-            file.append({'time':timestamp,'roll':theta,'pitch':phi,})        
+        if not state.service:
+            return
+        state.imuIdle=False
+        # a failed run ends that run only, the loop goes back to waiting
+        try:
+            while state.imu:
+                if imu.IMURead():
+                    samples['IMU']+=1
+                    if state.capture!=capture.active:
+                        if state.capture:
+                            capture.start(poll_interval)
+                        else:
+                            capture.stop()
+                    if capture.active:
+                        capture.add(imu.getIMUData())
+                        # drain the IMU FIFO so no raw sample is lost while the control loop runs
+                        while imu.IMURead():
+                            capture.add(imu.getIMUData())
+                    fusiondata = imu.getFusionData()
+                    phi= math.degrees(fusiondata[0])
+                    theta = math.degrees(fusiondata[1])
+                    time.sleep(poll_interval*1.0/1000.0)
+                    if shm is not None:
+                        shm['IMU'].write((time.monotonic(), phi, theta))
+                    else:
+                        msg=(phi,theta)
+                        msg=json.dumps(msg)
+                        telemetry.publish(namespace+'IMU',msg)
+                    if state.autolevel:
+                        # angleroll=round(pidroll(theta),1)
+                        # anglepitch=round(pidroll(phi),1)
+                        # data=df.loc[(anglepitch,angleroll)]
+                        data=df.loc[(round(phi),round(theta))]
+                        rightpos=data.loc['right']
+                        leftpos=-data.loc['left']
+                        frontpos=data.loc['front']
+                        backpos=data.loc['back']
+                        right.angle=rightpos
+                        left.angle=leftpos
+                        front.angle=frontpos
+                        back.angle=backpos
+                    elif state.angle:
+                        # the setpoints come from the GUI sliders, through state so a separate process sees them too
+                        pidroll.setpoint=state.theta
+                        pidpitch.setpoint=state.phi
+                        # the servo table has whole degrees, the PID outputs are limited to its range
+                        angleroll=round(pidroll(theta))
+                        anglepitch=round(pidpitch(phi))
+                        data=df.loc[(anglepitch,angleroll)]
+                        rightpos=data.loc['right']
+                        leftpos=data.loc['left']
+                        frontpos=data.loc['front']
+                        backpos=data.loc['back']
+                        right.angle=rightpos
+                        left.angle=leftpos
+                        front.angle=frontpos
+                        back.angle=backpos
+                    if not processes:
+                        file.append({'time':timestamp,'roll':theta,'pitch':phi,})
+                        trigger.addImu(time.time()-starttime, theta, phi)
+        except Exception as e:
+            state.imu=False
+            print('IMU run failed: '+repr(e))
+        finally:
+            capture.stop()
+            state.capture=False
 def startloadcell():
-    global loadcellflag
+    # runs for the life of the service, records while state.loadcell is set
     global file
     global client
     global timestamp
-    loadcellflag=True
-    while loadcellflag:
-        lc1, lc2, lc3, lc4 = lc.measure()
-        lct = round((lc1 + lc2 + lc3 + lc4),2)
-        msg=(lc1, lc2, lc3, lc4, lct)
-        msg = json.dumps(msg)
-        client.publish('loadcell',msg)     
-        file.append({'time': timestamp, 'thrust': lct, 'motor1': lc1, 'motor2': lc2, 'motor3': lc3, 'motor4': lc4})
+    global lcfilter
+    global lcconfig
+    global starttime
+    while True:
+        state.loadcellIdle=True
+        while state.service and not state.loadcell:
+            if state.lcCommand:
+                serveLoadcellCommand()
+            time.sleep(0.01)
+        if not state.service:
+            return
+        state.loadcellIdle=False
+        starttime=state.start
+        if processes:
+            # filter settings changed in the main process since the fork
+            version, config = lcshared.get()
+            if version!=lcversion[0]:
+                lcversion[0]=version
+                lcconfig=config
+                lcfilter=makeFilter(config)
+        lcfilter.reset()
+        state.rejected[:]=lcfilter.rejected()
+        recorder=None
+        # a failed run ends that run only, the loop goes back to waiting
+        try:
+            if lcconfig['record']:
+                # full rate samples go straight to disk, only the decimated stream is published
+                ring=RingBuffer(4096, LOADCELL_DTYPE)
+                recorder=BulkWriter(ring, 'logs/'+time.strftime('%Y_%m_%d-%H_%M_%S')+'_loadcell.bin')
+                recorder.start()
+            while state.loadcell:
+                if state.lcCommand:
+                    serveLoadcellCommand()
+                times, block = lc.read_block(lcconfig['block'], starttime)
+                if not processes:
+                    # full rate samples for triggered capture
+                    trigger.addLoadcell(times, block)
+                if recorder is not None:
+                    ring.extend(records(times, block))
+                rows=lcfilter.process(block).round(2)
+                # -p: the filter runs here, the metrics in the main process
+                state.rejected[:]=lcfilter.rejected()
+                samples['loadcell']+=len(rows)
+                if shm is not None and len(rows):
+                    # same samples as the MQTT path, as (time, m1..m4, total) rows
+                    now=time.monotonic()
+                    shm['loadcell'].write(np.column_stack((np.full(len(rows), now), rows, rows.sum(axis=1).round(2))))
+                for lc1, lc2, lc3, lc4 in rows.tolist():
+                    lct = round((lc1 + lc2 + lc3 + lc4),2)
+                    if shm is None:
+                        msg=(lc1, lc2, lc3, lc4, lct)
+                        msg = json.dumps(msg)
+                        telemetry.publish(namespace+'loadcell',msg)     
+                    if not processes:
+                        file.append({'time': timestamp, 'thrust': lct, 'motor1': lc1, 'motor2': lc2, 'motor3': lc3, 'motor4': lc4})
+                        metrics.add((lc1, lc2, lc3, lc4, lct))
+        except Exception as e:
+            state.loadcell=False
+            print('loadcell run failed: '+repr(e))
+        finally:
+            lc.idle()
+            if lcfilter.despike:
+                print('loadcell spikes rejected: '+str(lcfilter.rejected()))
+            if recorder is not None:
+                recorder.stop()
+                print('Full rate loadcell data saved as '+recorder.filename)
+def setLoadcellFilter(message):
+    # e.g. {"filter": "fir", "decimation": 8, "block": 8, "record": true},
+    # {"despike": 15, "threshold": 4} rejects single sample spikes first
+    global lcfilter
+    global lcconfig
+    # a bad payload keeps the filter as it is
+    try:
+        msg=json.loads(message.decode('utf-8'))
+        config=dict(lcconfig)
+        config.update(msg)
+        pipeline=makeFilter(config)
+        config['block']=int(msg.get('block', pipeline.decimation))
+        if config['block']<1:
+            raise ValueError('block must be at least 1')
+    except (ValueError, KeyError, TypeError) as e:
+        refuse('loadcellfilter', e)
+        return
+    lcfilter=pipeline
+    lcconfig=config
+    # -p: the loadcell process picks them up when the next run starts
+    lcshared.set(lcconfig)
+    status.update(filter=lcconfig)
+    print('loadcell filter: '+json.dumps(lcconfig))
+def makeFilter(config):
+    return FilterPipeline(config['filter'], config['decimation'], order=config['order'], taps=config['taps'],
+                          despike=config['despike'], threshold=config['threshold'])
 def updateSliders(message):
+    msg=message.decode('utf-8')
+    msg=json.loads(msg)
+    setAngles(msg[0], msg[1])
+def setAngles(phi, theta):
     global phi_slider_val
     global theta_slider_val
     global pidroll
     global pidpitch
-    msg=message.decode('utf-8')
-    msg=json.loads(msg)
-    phi_slider_val=msg[0]
-    theta_slider_val=msg[1] 
+    phi_slider_val=phi
+    theta_slider_val=theta
+    state.phi=phi_slider_val
+    state.theta=theta_slider_val
     pidroll.setpoint=theta_slider_val
     pidpitch.setpoint=phi_slider_val
+    status.update(setpoint=[phi, theta])
+def startCampaign(message):
+    # a sweep of angle setpoints run here on the Pi, see campaign.py; returns
+    # the campaign for the caller to run on a thread or an executor
+    global campaign
+    if not state.imu:
+        print('campaign needs a running IMU, send start first')
+        return None
+    if campaign is not None and campaign.active:
+        print('a campaign is already running, send campaign/stop first')
+        return None
+    try:
+        steps, settings = parseSweep(json.loads(message.decode('utf-8')))
+    except ValueError as e:
+        refuse('campaign', e)
+        return None
+    angle()
+    campaign=Campaign(steps, settings, setAngles, file, lambda records: records is file and state.imu,
+                      lambda topic, payload: client.publish(namespace+topic, payload), 'logs/'+runname+'_campaign.json')
+    print('campaign of '+str(len(steps))+' steps')
+    return campaign
+def stopCampaign():
+    if campaign is not None:
+        campaign.stop()
+def fireTrigger():
+    # manual trigger, saves the window around now, see trigger.py
+    if not trigger.fire():
+        print('trigger needs a running run and no window pending')
+def requestDownload(message):
+    try:
+        downloads.request(message)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        refuse('download', e)
+def ackDownload(message):
+    try:
+        downloads.ack(message)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        refuse('download/ack', e)
+def configureTrigger(message):
+    try:
+        trigger.configure(json.loads(message.decode('utf-8')))
+    except ValueError as e:
+        refuse('trigger/config', e)
+def startCapture(message):
+    # the IMU loop starts and stops the capture when it sees the flag
+    msg=message.decode('utf-8')
+    if msg=='off':
+        state.capture=False
+    elif state.imu:
+        state.capture=True
+    else:
+        print('capture needs a running IMU, send start first')
 def stop():
-    global IMUflag
     global stopwatchFlag
-    global loadcellflag
     global pidroll
     global pidpitch
     stopwatchFlag=False
-    loadcellflag=False
-    IMUflag=False
+    state.loadcell=False
+    state.imu=False
+    trigger.stop()
+    status.update(run=dict(status.get('run'), active=False))
 def autolevel():
-    global angleflag
-    global autolevelflag
     global pidroll
     global pidpitch
-    angleflag=False
-    autolevelflag=True
+    state.angle=False
+    state.autolevel=True
     pidroll.setpoint=0
     pidpitch.setpoint=0
+    status.update(mode='autolevel')
 def angle():
-    global angleflag
-    global autolevelflag
     global pidroll
     global pidpitch
-    autolevelflag=False 
-    angleflag=True
+    state.autolevel=False 
+    state.angle=True
     pidroll.setpoint=theta_slider_val
     pidpitch.setpoint=phi_slider_val
+    status.update(mode='angle')
 def stopwatch():
+    # runs for the life of the service, the clock is published while a run records
     global stopwatchFlag
-    global client
+    while state.service:
+        if stopwatchFlag:
+            publishTime()
+        else:
+            time.sleep(0.01)
+def publishTime():
     global timestamp
-    start=time.time()
-    while stopwatchFlag:
-        passed=time.time()-start
-        timestr=formatTime(passed)
-        timestamp=passed
-        client.publish('time',timestr)
+    timestamp=time.time()-starttime
+    telemetry.publish(namespace+'time',formatTime(timestamp))
+def publishStats(last):
+    # -a: achieved sample rates and the thread count, once a second on 'stats'
+    now=time.monotonic()
+    elapsed=max(now-last['time'], 1e-6)
+    stats={'threads':threading.active_count()}
+    for key in samples:
+        stats[key]=round((samples[key]-last[key])/elapsed,1)
+        last[key]=samples[key]
+    last['time']=now
+    client.publish(namespace+'stats', json.dumps(stats))
 def formatTime(time):
     secs=time % 60
     mins=time//60
     hours=mins//60
     return f'{int(hours):02d}:{int(mins):02d}:{int(secs):02d}:{int((time % 1)*100):02d}'
 def saveFile():
-    global file
+    # the records stay a list, the loops may still be appending to them
     timestr=time.strftime('%Y_%m_%d-%H_%M_%S')
     filename='logs/'+timestr+'.json'
+    saved[runname]=filename
     f=open(filename,'w')
-    file=json.dumps(file)
-    f.write(file)
+    f.write(json.dumps(file))
     print('File saved as '+timestr+'.json')
-def on_message(client, userdata, message):
-    global phi_slider_val
-    global theta_slider_val
-    global autolevelflag
-    global angleflag
+    return filename
+def runSource(run):
+    # records of a run for a download: the current one, followed live while it
+    # records, or a run saved in logs/
+    if run=='current':
+        if runname is None:
+            raise ValueError('no run recorded yet')
+        run=runname
+    if run==runname and isinstance(file, list):
+        records=file
+        return runname, records, lambda: records is file and (state.imu or state.loadcell)
+    with open(saved.get(run, 'logs/'+os.path.basename(run)+'.json')) as f:
+        return run, json.load(f), lambda: False
+def forward():
+    # -p: the acquisition processes only fill the rings, publishing and
+    # recording happen here in the networking process
     global file
-    topic=message.topic
+    readers={topic: SharedRing(ring.name) for topic, ring in shm.items()}
+    while state.service:
+        for view in readers['IMU'].readAll():
+            for t, phi, theta in view.tolist():
+                if not shmExport:
+                    telemetry.publish(namespace+'IMU', json.dumps((phi, theta)))
+                file.append({'time':t-startmono,'roll':theta,'pitch':phi,})
+                trigger.addImu(t-startmono, theta, phi)
+        for view in readers['loadcell'].readAll():
+            # only the filtered samples cross the processes, the trigger sees those
+            trigger.addLoadcell(view[:,0]-startmono, view[:,1:5])
+            for t, lc1, lc2, lc3, lc4, lct in view.tolist():
+                if not shmExport:
+                    telemetry.publish(namespace+'loadcell', json.dumps((lc1, lc2, lc3, lc4, lct)))
+                file.append({'time': t-startmono, 'thrust': lct, 'motor1': lc1, 'motor2': lc2, 'motor3': lc3, 'motor4': lc4})
+                metrics.add((lc1, lc2, lc3, lc4, lct))
+        time.sleep(0.002)
+    for reader in readers.values():
+        reader.close()
+def startService():
+    # the sensor loops and the stopwatch run from here until shutdown, start
+    # and stop only set the flags they record on
+    global acquisition
+    state.service=True
+    if processes:
+        # fork before any thread exists
+        acquisition=[AcquisitionProcess('imu', startIMU, cores[0], rtprio), AcquisitionProcess('loadcell', startloadcell, cores[1], rtprio)]
+        for process in acquisition:
+            process.start()
+        threading.Thread(target=forward, daemon=True).start()
+    else:
+        threading.Thread(target=startIMU, daemon=True).start()
+        threading.Thread(target=startloadcell, daemon=True).start()
+    threading.Thread(target=stopwatch, daemon=True).start()
+def checkIdle():
+    # a start while a run records, or before the loops are back waiting for one, is refused
+    if state.imu or state.loadcell:
+        raise RuntimeError('run '+str(runname)+' is recording, send stop first')
+    if not (state.imuIdle and state.loadcellIdle):
+        raise RuntimeError('the sensor loops are not ready for a run yet')
+def startRun():
+    # a new run on the running sensor loops: empty records, the flags and the
+    # stopwatch; returns its name, RuntimeError when a run is recording
+    global file
+    global starttime
+    global startmono
+    global stopwatchFlag
+    global runname
+    global timestamp
+    with runLock:
+        checkIdle()
+        file=[]
+        runname=time.strftime('%Y_%m_%d-%H_%M_%S')
+        starttime=time.time()
+        trigger.setRates(1000.0/max(state.pollInterval, 1), lc.rate)
+        trigger.start(runname)
+        metrics.reset()
+        startmono=time.monotonic()
+        timestamp=0
+        state.start=starttime
+        stopwatchFlag=True
+        state.imu=True
+        state.loadcell=True
+        status.update(run={'name':runname, 'active':True, 'start':starttime})
+    return runname
+def on_message(client, userdata, message):
+    topic=message.topic[len(namespace):]
     msg=message.payload
     if topic=='weigh':
         print('weigh received')
         weigh()
-    if message.topic=='tare':
+    if topic=='tare':
         print('tare received')
-        tare()
-    if message.topic=='start':
+        try:
+            tare()
+        except RuntimeError as e:
+            refuse('tare', e)
+    if topic=='start':
         print('start received')
-        file=[]
-        t1=threading.Thread(target=startIMU, daemon=True)
-        t1.start()
-        threading.Thread(target=stopwatch).start()
-        t2=threading.Thread(target=startloadcell,daemon=True)
-        t2.start()
-    if message.topic=='stop':
+        try:
+            startRun()
+        except RuntimeError as e:
+            print('start refused: '+str(e))
+    if topic=='stop':
         print('stop received')
         t3=threading.Thread(target=stop)
         t3.start()
-    if message.topic=='autolevel':
+    if topic=='autolevel':
         print('autolevel received')
         t4=threading.Thread(target=autolevel)
         t4.start()
-    if message.topic=='angle':
+    if topic=='angle':
         print('angle received')
         t5=threading.Thread(target=angle)
         t5.start()
-    if message.topic=='updateSliders':
+    if topic=='updateSliders':
         t6=threading.Thread(target=updateSliders(msg), daemon=True)
         t6.start()
-    if message.topic=='savetofile':
+    if topic=='loadcellfilter':
+        print('loadcell filter received')
+        setLoadcellFilter(msg)
+    if topic=='capture':
+        print('capture received')
+        startCapture(msg)
+    if topic=='savetofile':
         print('save to file received')
         t7=threading.Thread(target=saveFile)
         t7.start()
+    if topic=='download':
+        print('download received')
+        requestDownload(msg)
+    if topic=='download/ack':
+        ackDownload(msg)
+    if topic=='campaign':
+        print('campaign received')
+        sweep=startCampaign(msg)
+        if sweep is not None:
+            threading.Thread(target=sweep.run, daemon=True).start()
+    if topic=='campaign/stop':
+        print('campaign stop received')
+        stopCampaign()
+    if topic=='trigger':
+        print('trigger received')
+        fireTrigger()
+    if topic=='trigger/config':
+        print('trigger config received')
+        configureTrigger(msg)
+    if topic=='rpc':
+        rpcserver.request(msg)
     return topic, msg 
-try:
-    # Read data from database
-    df=pd.read_csv('database3.csv') # test data, must be recalculated once final measurements are known
-    df.set_index(['phi','theta'], inplace=True)
-    # Initialize phi and theta values
-    phi=0
-    theta=0
-    phi_slider_val=0
-    theta_slider_val=0
-
-    # set servo initial values
-    right=gpio.AngularServo(12,initial_angle=0.0, min_angle=-90, max_angle=90, min_pulse_width=0.00075,max_pulse_width=0.0022) # 0.75ms to 2.2ms with 20ms period
-    left=gpio.AngularServo(16,initial_angle=0.0, min_angle=-90, max_angle=90, min_pulse_width=0.00075,max_pulse_width=0.0022)
-    front=gpio.AngularServo(20,initial_angle=0.0, min_angle=-90, max_angle=90, min_pulse_width=0.00075,max_pulse_width=0.0022)
-    back=gpio.AngularServo(21,initial_angle=0.0, min_angle=-90, max_angle=90, min_pulse_width=0.00077,max_pulse_width=0.0022)
-    right.angle=0.0
-    left.angle=0.0
-    back.angle=0.0
-    front.angle=0.0
-    pidroll = PID(0.5,0.02,0.001, setpoint=0) # once everything is connected, check and tune pid values
-    pidpitch = PID(0.5, 0.02, 0.001, setpoint=0)
-    angleflag=False
-    autolevelflag=True
-    IMUflag=False     
-    lc=loadcell()   
-
-    broker_address ='localhost'
-    broker_port=1883
-    client=mqtt.Client('RPi')
-    client.on_message=on_message
+def on_message_async(client, userdata, message):
+    # -a: quick commands run right here on the event loop, the sensor loops and
+    # anything that waits for hardware or disk on their own executors
+    topic=message.topic[len(namespace):]
+    msg=message.payload
+    if topic in ('weigh','tare','savetofile'):
+        print(topic+' received')
+        runtime.run('command', {'weigh':weigh, 'tare':tare, 'savetofile':saveFile}[topic])
+    elif topic=='start':
+        print('start received')
+        try:
+            startRunAsync()
+        except RuntimeError as e:
+            print('start refused: '+str(e))
+    elif topic=='stop':
+        print('stop received')
+        stopRunAsync()
+    elif topic=='autolevel':
+        print('autolevel received')
+        autolevel()
+    elif topic=='angle':
+        print('angle received')
+        angle()
+    elif topic=='updateSliders':
+        updateSliders(msg)
+    elif topic=='loadcellfilter':
+        print('loadcell filter received')
+        setLoadcellFilter(msg)
+    elif topic=='capture':
+        print('capture received')
+        startCapture(msg)
+    elif topic=='download':
+        print('download received')
+        requestDownload(msg)
+    elif topic=='download/ack':
+        ackDownload(msg)
+    elif topic=='campaign':
+        print('campaign received')
+        sweep=startCampaign(msg)
+        if sweep is not None:
+            runtime.run('campaign', sweep.run)
+    elif topic=='campaign/stop':
+        print('campaign stop received')
+        stopCampaign()
+    elif topic=='trigger':
+        print('trigger received')
+        fireTrigger()
+    elif topic=='trigger/config':
+        print('trigger config received')
+        configureTrigger(msg)
+    elif topic=='rpc':
+        rpcserver.request(msg)
+def startRunAsync():
+    global file
+    global starttime
+    global runname
+    global timestamp
+    checkIdle()
+    file=[]
+    runname=time.strftime('%Y_%m_%d-%H_%M_%S')
+    starttime=time.time()
+    trigger.setRates(1000.0/max(state.pollInterval, 1), lc.rate)
+    trigger.start(runname)
+    metrics.reset()
+    timestamp=0
+    state.start=starttime
+    state.imu=True
+    state.loadcell=True
+    status.update(run={'name':runname, 'active':True, 'start':starttime})
+    # 100 Hz is plenty for the GUI clock and the record timestamps
+    runtime.every('time', 0.01, publishTime)
+    runtime.every('stats', 1.0, publishStats, dict(samples, time=time.monotonic()))
+    return runname
+def rpcAsync(command, call):
+    # -a: like the plain commands, what waits for hardware or disk on the
+    # command executor and the rest right here on the event loop
+    if command in ('weigh','tare','savetofile'):
+        runtime.run('command', call)
+    else:
+        call()
+def stopRunAsync():
+    asyncio.ensure_future(stopAsync())
+async def stopAsync(timeout=5.0):
+    stop()
+    await runtime.cancel(('time','stats','campaign'))
+    # the sensor loops finish the run and go back to waiting for the next one
+    deadline=time.monotonic()+timeout
+    while not (state.imuIdle and state.loadcellIdle) and time.monotonic()<deadline:
+        await asyncio.sleep(0.01)
+    print('run stopped')
+def runAsync():
+    # -a: one event loop instead of paho's network thread, the stopwatch and a
+    # thread per command, see aioruntime.py
+    global client
+    global telemetry
+    global runtime
+    loop=asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runtime=AsyncRuntime(loop, client)
+    client.on_message=on_message_async
+    rpcserver.handlers.update({'start':lambda args: startRunAsync(), 'stop':lambda args: stopRunAsync()})
+    rpcserver.run=rpcAsync
+    # the runtime reconnects by itself, subscribe again every time and make
+    # sure the broker has the status
+    def on_connect(c, userdata, flags, rc):
+        for command in COMMANDS:
+            c.subscribe(namespace+command)
+        status.refresh()
+    client.on_connect=on_connect
     client.connect(broker_address,broker_port)
-    client.subscribe('weigh')
-    client.subscribe('tare')
-    client.subscribe('start')
-    client.subscribe('stop')
-    client.subscribe('updateSliders')
-    client.subscribe('autolevel')
-    client.subscribe('angle')
-    client.subscribe('savetofile')
-    client.loop_forever()
-except KeyboardInterrupt:
+    client=LoopPublisher(loop, client)
+    if udp is None:
+        telemetry=MqttTransport(client)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, runtime.shutdown.set)
+    # the sensor loops run on their executors until shutdown
+    state.service=True
+    runtime.run('imu', startIMU)
+    runtime.run('loadcell', startloadcell)
+    async def main():
+        await runtime.shutdown.wait()
+        print('shutting down')
+        await stopAsync()
+        state.service=False
+        client.publish(namespace+'status', OFFLINE, 0, True)
+        await runtime.close()
+    loop.run_until_complete(main())
+    loop.close()
+def terminate(signum, frame):
+    # SIGTERM ends the service like Ctrl-C, so the acquisition processes stop too
+    raise KeyboardInterrupt
+def cleanup():
+    stop()
+    state.service=False
+    for process in acquisition:
+        process.join(2.0)
     GPIO.cleanup()
-    client.disconnect()
+    if shm is not None:
+        for ring in shm.values():
+            ring.close()
+COMMANDS=('weigh','tare','start','stop','updateSliders','autolevel','angle','savetofile','capture','loadcellfilter','download','download/ack','campaign','campaign/stop','trigger','trigger/config','rpc')
+# importing this module only defines the functions, e.g. for bench.py
+if __name__ == '__main__':
+    try:
+        # Read data from database
+        df=pd.read_csv('database3.csv') # test data, must be recalculated once final measurements are known
+        df.set_index(['phi','theta'], inplace=True)
+        # Initialize phi and theta values
+        phi=0
+        theta=0
+        phi_slider_val=0
+        theta_slider_val=0
+
+        # the servos are set up by startIMU, in the process that drives them
+        pidroll = PID(0.5,0.02,0.001, setpoint=0) # once everything is connected, check and tune pid values
+        pidpitch = PID(0.5, 0.02, 0.001, setpoint=0)
+        # in angle mode the PID outputs index the servo table
+        pidroll.output_limits=(df.index.get_level_values('theta').min(), df.index.get_level_values('theta').max())
+        pidpitch.output_limits=(df.index.get_level_values('phi').min(), df.index.get_level_values('phi').max())
+        # run flags and setpoints, in shared memory so forked acquisition processes see them
+        state=control()
+        state.autolevel=True
+        lc=loadcell()   
+        capture=ImuCapture()
+        poll_interval=None
+        samples={'IMU':0, 'loadcell':0}
+        # default matches the old measure(): mean of 2 conversions per published sample
+        lcconfig={'filter':'mean', 'decimation':2, 'order':3, 'taps':None, 'block':2, 'record':False, 'despike':0, 'threshold':4.0}
+        lcfilter=FilterPipeline(lcconfig['filter'], lcconfig['decimation'])
+        starttime=time.time()
+        stopwatchFlag=False
+        runLock=threading.Lock()
+        # -p: one tare or weigh at a time for the loadcell process
+        lcLock=threading.Lock()
+        # -p: lcconfig as the loadcell process last saw it
+        lcversion=[0]
+        # the records of the current run, its name and where saved runs went
+        file=[]
+        runname=None
+        saved={}
+        campaign=None
+
+        broker_address ='localhost'
+        broker_port=1883
+        # -n NAME puts every topic under NAME/ so several rigs can share one broker
+        # and one GUI dashboard, -b HOST[:PORT] points at a broker that is not local
+        # -s streams loadcell and IMU samples through shared memory instead of MQTT,
+        # for a GUI on the same host started with --shm; commands stay on MQTT
+        # -u HOST[:PORT] sends telemetry as UDP datagrams straight to the GUI, see transport.py
+        # -p runs IMU/control and loadcell acquisition in their own processes (see acquisition.py),
+        # --cores IMU,LOADCELL,MAIN pins them to cores and --rt PRIORITY gives the two
+        # acquisition processes SCHED_FIFO priority
+        # -a runs the service on an asyncio event loop, see runAsync()
+        # -i reads the HX711s when their DOUT edge signals data ready instead of polling, see loadcell.DataReady
+        namespace=''
+        shm=None
+        shmExport=False
+        udp=None
+        processes=False
+        cores=(None, None, None)
+        rtprio=0
+        acquisition=[]
+        asyncMode=False
+        opts, args = getopt.getopt(sys.argv[1:], 'n:b:su:pai', ['namespace=','broker=','shm','udp=','processes','cores=','rt=','asyncio','interrupts'])
+        for opt, arg in opts:
+            if opt in ('-n','--namespace'):
+                namespace=arg.strip('/')+'/'
+            elif opt in ('-b','--broker'):
+                broker_address, _, port = arg.partition(':')
+                broker_port=int(port or 1883)
+            elif opt in ('-s','--shm'):
+                shmExport=True
+            elif opt in ('-u','--udp'):
+                host, _, port = arg.partition(':')
+                udp=(host, int(port or UDP_PORT))
+            elif opt in ('-p','--processes'):
+                processes=True
+            elif opt=='--cores':
+                cores=parseCores(arg)
+            elif opt=='--rt':
+                rtprio=int(arg)
+            elif opt in ('-a','--asyncio'):
+                asyncMode=True
+            elif opt in ('-i','--interrupts'):
+                lc.enableInterrupts()
+        if asyncMode and processes:
+            sys.exit('-a and -p cannot be combined')
+        if shmExport or processes:
+            shm={}
+            shm['loadcell']=SharedRing(ringName('loadcell', namespace[:-1]), width=6, create=True)
+            shm['IMU']=SharedRing(ringName('imu', namespace[:-1]), width=3, create=True)
+        lcshared=SharedConfig(lcconfig)
+        lcversion[0]=lcshared.get()[0]
+        if processes and cores[2] is not None:
+            # the networking process is never real-time, the stopwatch loop does not sleep
+            pin(cores[2])
+        client=mqtt.Client('RPi'+('-'+namespace[:-1] if namespace else ''))
+        # the mode, setpoints, weight, run and filter, retained on 'status' for
+        # clients that connect later, see status.py; offline when the Pi drops
+        status=StatusCache(lambda topic, payload, retain: client.publish(namespace+topic, payload, 0, retain),
+                           mode='autolevel', setpoint=[phi_slider_val, theta_slider_val], weight=None,
+                           run={'name':None, 'active':False, 'start':None}, filter=lcconfig, error=None)
+        client.will_set(namespace+'status', OFFLINE, 0, True)
+        telemetry=MqttTransport(client) if udp is None else UdpTransport(*udp)
+        # runs are downloaded on MQTT whatever carries the telemetry, see download.py
+        downloads=RunSender(lambda topic, payload: client.publish(namespace+topic, payload), runSource)
+        # the last seconds of the run are always kept, a trigger saves them, see trigger.py
+        # the rings follow the IMU poll interval and the HX711 rate from the next run on
+        trigger=TriggerCapture(lambda topic, payload: client.publish(namespace+topic, payload), loadcellRate=lc.rate)
+        # rolling loadcell statistics and thrust-to-weight, a couple of times a second, see metrics.py
+        metrics=Metrics(lambda topic, payload: telemetry.publish(namespace+topic, payload), counters=lambda: {'rejected':list(state.rejected)})
+        # tare, weigh, start, stop and savetofile with replies and round trip times, see rpc.py
+        rpcserver=RpcServer(lambda topic, payload: client.publish(namespace+topic, payload),
+                            {'weigh':lambda args: measureWeight(), 'tare':lambda args: tare(), 'start':lambda args: startRun(),
+                             'stop':lambda args: stop(), 'savetofile':lambda args: saveFile(), 'state':lambda args: status.snapshot()})
+        if asyncMode:
+            runAsync()
+            cleanup()
+        else:
+            signal.signal(signal.SIGTERM, terminate)
+            startService()
+            client.on_message=on_message
+            client.connect(broker_address,broker_port)
+            for command in COMMANDS:
+                client.subscribe(namespace+command)
+            status.refresh()
+            client.loop_forever()
+    except KeyboardInterrupt:
+        client.publish(namespace+'status', OFFLINE, 0, True)
+        client.disconnect()
+        cleanup()
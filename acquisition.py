@@ -0,0 +1,245 @@
+import os
+import json
+import math
+import time
+import ctypes
+import signal
+import threading
+import multiprocessing
+from multiprocessing.sharedctypes import RawValue, RawArray
+from argparse import ArgumentParser
+import numpy as np
+from shmring import SharedRing, ringName
+
+# Process based acquisition for Rpi_mqtt.py -p. IMU and control, loadcell and
+# networking/recording run in separate interpreters instead of threads sharing
+# one GIL. The processes are forked once when the service starts, so they
+# inherit the sensors and settings, set their sensor up once and then record
+# whenever the run flags in a Control block in shared memory say so; settings
+# that change later reach them through a SharedConfig. They hand their samples
+# to the main process through shmring rings.
+
+class Control(ctypes.Structure):
+    # run flags and slider setpoints, shared by every acquisition process;
+    # service keeps the sensor loops alive, they set imuIdle and loadcellIdle
+    # while they wait for a run, start is the run's time.time(), pollInterval
+    # the IMU's in ms once it is set up; lcCommand is a TARE or WEIGH for the
+    # loadcell process, which sets lcResult and clears lcCommand when done;
+    # rejected the despike counts per channel of the loadcell filter
+    _fields_=[('imu', ctypes.c_bool), ('loadcell', ctypes.c_bool), ('autolevel', ctypes.c_bool),
+              ('angle', ctypes.c_bool), ('capture', ctypes.c_bool), ('phi', ctypes.c_double), ('theta', ctypes.c_double),
+              ('service', ctypes.c_bool), ('imuIdle', ctypes.c_bool), ('loadcellIdle', ctypes.c_bool), ('start', ctypes.c_double),
+              ('pollInterval', ctypes.c_double), ('lcCommand', ctypes.c_int), ('lcResult', ctypes.c_double),
+              ('rejected', ctypes.c_int64*4)]
+
+# lcCommand values
+TARE=1
+WEIGH=2
+
+def control():
+    # allocated in shared memory, so processes forked later see every change
+    return RawValue(Control)
+
+class SharedConfig():
+    # a JSON settings dict in shared memory: set() in the main process, get()
+    # in the acquisition processes, which returns (version, settings) so a
+    # reader sees when they changed
+    def __init__(self, settings, size=65536):
+        self.lock=multiprocessing.get_context('fork').Lock()
+        self.buffer=RawArray(ctypes.c_char, size)
+        self.version=RawValue(ctypes.c_uint)
+        self.set(settings)
+
+    def set(self, settings):
+        data=json.dumps(settings).encode()
+        if len(data)>=len(self.buffer):
+            raise ValueError('settings longer than the shared buffer')
+        with self.lock:
+            self.buffer.value=data
+            self.version.value+=1
+
+    def get(self):
+        with self.lock:
+            return self.version.value, json.loads(self.buffer.value)
+
+def pin(core=None, priority=0):
+    # pin the calling process (or thread) to a core, optionally with SCHED_FIFO priority
+    if core is not None:
+        try:
+            os.sched_setaffinity(0, {core})
+        except OSError:
+            print('cannot pin to core '+str(core)+', this machine has cores '+str(sorted(os.sched_getaffinity(0))))
+    if priority:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except PermissionError:
+            print('real-time priority needs root or CAP_SYS_NICE, running with normal priority')
+
+def parseCores(text):
+    # 'imu,loadcell,main' core numbers, blank for no pinning, e.g. '2,3,1' or '2,3,'
+    cores=[int(c) if c.strip() else None for c in text.split(',')]
+    return tuple(cores+[None]*(3-len(cores)))[:3]
+
+class AcquisitionProcess(multiprocessing.get_context('fork').Process):
+    def __init__(self, name, target, core=None, priority=0):
+        super(AcquisitionProcess, self).__init__(name=name, daemon=True)
+        self.target=target
+        self.core=core
+        self.priority=priority
+
+    def run(self):
+        # Ctrl-C is for the main process, which ends the service through the flags
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        pin(self.core, self.priority)
+        self.target()
+
+class AcquisitionThread(threading.Thread):
+    # same interface, for the threaded design
+    def __init__(self, name, target, core=None, priority=0):
+        super(AcquisitionThread, self).__init__(name=name, daemon=True)
+        self.target=target
+        self.core=core
+        self.priority=priority
+
+    def run(self):
+        pin(self.core, self.priority)
+        self.target()
+
+def timing(times):
+    # achieved rate and jitter (deviation of the sample interval) of a stamped stream
+    times=np.asarray(times)
+    if len(times)<3:
+        return {'samples':len(times), 'rate':0.0, 'interval_ms':None, 'jitter_ms':None, 'jitter_p99_ms':None, 'max_interval_ms':None}
+    dt=1000*np.diff(times)
+    return {'samples':len(times), 'rate':(len(times)-1)/(times[-1]-times[0]), 'interval_ms':float(dt.mean()),
+            'jitter_ms':float(dt.std()), 'jitter_p99_ms':float(np.percentile(np.abs(dt-dt.mean()), 99)),
+            'max_interval_ms':float(dt.max())}
+
+# Stand-ins for the Rpi_mqtt loops, with the same kind of work and waits, for
+# comparing the two designs on a machine without the sensors.
+
+def servoTable(filename='database3.csv'):
+    # Rpi_mqtt's servo table, or a made-up one of the same shape without the file
+    import pandas as pd
+    if os.path.exists(filename):
+        df=pd.read_csv(filename)
+    else:
+        phi, theta = np.meshgrid(np.arange(-30,31), np.arange(-30,31), indexing='ij')
+        phi=phi.ravel()
+        theta=theta.ravel()
+        df=pd.DataFrame({'phi':phi, 'theta':theta, 'right':theta*1.5, 'left':theta*1.5, 'front':phi*1.5, 'back':-phi*1.5})
+    df.set_index(['phi','theta'], inplace=True)
+    return df
+
+def simulatedImu(state, ring, poll_interval=4):
+    # RTIMU poll, fusion, the servo table lookup and the PID of startIMU
+    from simple_pid import PID
+    df=servoTable()
+    pid=PID(0.5, 0.02, 0.001, setpoint=0)
+    t0=time.monotonic()
+    while state.imu:
+        time.sleep(poll_interval/1000)
+        now=time.monotonic()
+        phi=20*math.sin(now-t0)
+        theta=20*math.cos(now-t0)
+        data=df.loc[(round(phi), round(theta))]
+        right, left, front, back = data.loc['right'], -data.loc['left'], data.loc['front'], data.loc['back']
+        pid(theta)
+        ring.write((now, phi, theta))
+
+def simulatedLoadcell(state, ring, sample_rate=80, pulses=25):
+    # HX711 sampling: wait for the conversion, then bit-bang 24 bits plus the
+    # gain pulses on the shared clock for all four channels in Python
+    period=1.0/sample_rate
+    line=[0]
+    def output(v):
+        line[0]=v
+    def read():
+        return line[0]
+    nxt=time.monotonic()
+    while state.loadcell:
+        nxt+=period
+        delay=nxt-time.monotonic()
+        if delay>0:
+            time.sleep(delay)
+        values=[]
+        for channel in range(4):
+            value=0
+            for i in range(pulses):
+                output(1)
+                output(0)
+                value=(value<<1)|read()
+            values.append(value)
+        ring.write((time.monotonic(), values[0], values[1], values[2], values[3], sum(values)))
+
+def simulatedNetwork(state, rings, transport):
+    # stopwatch plus the forwarding and JSON encoding of the samples
+    readers={topic: SharedRing(ring.name) for topic, ring in rings.items()}
+    start=time.time()
+    while state.imu or state.loadcell:
+        transport.publish('time', '{:.2f}'.format(time.time()-start))
+        for topic, reader in readers.items():
+            for view in reader.readAll():
+                for values in view.tolist():
+                    transport.publish(topic, json.dumps(values[1:]))
+    for reader in readers.values():
+        reader.close()
+
+def compare(duration, cores, priority, udp):
+    from transport import UdpTransport
+    results={}
+    for design in ('threads','processes'):
+        state=control()
+        rings={'IMU': SharedRing(ringName('imu','acqbench'), width=3, create=True),
+               'loadcell': SharedRing(ringName('loadcell','acqbench'), width=6, create=True)}
+        transport=UdpTransport('127.0.0.1', udp)
+        state.imu=True
+        state.loadcell=True
+        Worker=AcquisitionProcess if design=='processes' else AcquisitionThread
+        workers=[Worker('imu', lambda: simulatedImu(state, rings['IMU']), cores[0], priority),
+                 Worker('loadcell', lambda: simulatedLoadcell(state, rings['loadcell']), cores[1], priority)]
+        readers={topic: SharedRing(ring.name) for topic, ring in rings.items()}
+        for worker in workers:
+            worker.start()
+        network=AcquisitionThread('network', lambda: simulatedNetwork(state, rings, transport), cores[2])
+        network.start()
+        times={topic: [] for topic in rings}
+        cpu0=os.times()
+        end=time.monotonic()+duration
+        while time.monotonic()<end:
+            time.sleep(0.05)
+            for topic, reader in readers.items():
+                for view in reader.readAll():
+                    times[topic].append(view[:,0].copy())
+        state.imu=False
+        state.loadcell=False
+        for worker in workers:
+            worker.join()
+        network.join()
+        cpu1=os.times()
+        cpu=(cpu1.user-cpu0.user)+(cpu1.system-cpu0.system)+(cpu1.children_user-cpu0.children_user)+(cpu1.children_system-cpu0.children_system)
+        results[design]={topic: timing(np.concatenate(t) if t else []) for topic, t in times.items()}
+        results[design]['cpu_percent']=100*cpu/duration
+        for ring in list(readers.values())+list(rings.values()):
+            ring.close()
+        transport.stop()
+    return results
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Compare threaded and process based acquisition with simulated sensors')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per design')
+    parser.add_argument('--cores', type=parseCores, default=(None,None,None), help='imu,loadcell,main cores, e.g. 2,3,1')
+    parser.add_argument('--rt', type=int, default=0, metavar='PRIORITY', help='SCHED_FIFO priority for the acquisition loops')
+    parser.add_argument('--udp', type=int, default=5099, help='port the simulated telemetry is sent to')
+    parser.add_argument('--output', '-o', help='save the results as JSON')
+    options=parser.parse_args()
+    results=compare(options.duration, options.cores, options.rt, options.udp)
+    print(f'{"design":>10}  {"loop":>9}  {"rate Hz":>8}  {"jitter ms":>9}  {"p99 ms":>7}  {"max ms":>7}  {"cpu %":>6}')
+    for design, result in results.items():
+        for topic in ('IMU','loadcell'):
+            r=result[topic]
+            print(f'{design:>10}  {topic:>9}  {r["rate"]:8.1f}  {r["jitter_ms"] or 0:9.3f}  {r["jitter_p99_ms"] or 0:7.3f}  {r["max_interval_ms"] or 0:7.2f}  {result["cpu_percent"]:6.0f}')
+    if options.output:
+        with open(options.output,'w') as f:
+            json.dump(results, f, indent=2)
+        print('results saved as '+options.output)
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# asyncio runtime for Rpi_mqtt.py -a. The event loop drives paho through its
+# socket callbacks (no network thread), runs the periodic tasks and dispatches
+# the commands; blocking sensor loops run on dedicated single thread executors.
+# Stopping cancels the tasks and waits for the executors, so a run always ends
+# in the same order.
+
+class LoopPublisher():
+    # Without its network thread paho must only be used from the event loop;
+    # publish() from any other thread is handed to the loop.
+    def __init__(self, loop, target):
+        self.loop=loop
+        self.target=target
+        self.thread=threading.get_ident()
+
+    def publish(self, topic, payload=None, *args):
+        if threading.get_ident()==self.thread:
+            return self.target.publish(topic, payload, *args)
+        self.loop.call_soon_threadsafe(self.target.publish, topic, payload, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+async def periodic(interval, fn, *args):
+    # fn every interval seconds on a fixed schedule, missed ticks are skipped
+    loop=asyncio.get_running_loop()
+    due=loop.time()
+    while True:
+        fn(*args)
+        due+=interval
+        now=loop.time()
+        if due<now:
+            due=now+interval-(now-due) % interval
+        await asyncio.sleep(due-now)
+
+class AsyncRuntime():
+    def __init__(self, loop, client, reconnect=1.0):
+        self.loop=loop
+        self.client=client
+        self.reconnectDelay=reconnect
+        self.executors={}
+        self.futures={}
+        self.tasks={}
+        self.misc=None
+        self.closing=False
+        self.closed=None
+        self.shutdown=asyncio.Event()
+        client.on_socket_open=self.on_socket_open
+        client.on_socket_close=self.on_socket_close
+        client.on_socket_register_write=self.on_socket_register_write
+        client.on_socket_unregister_write=self.on_socket_unregister_write
+
+    # paho socket callbacks, all on the event loop thread
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc=self.loop.create_task(periodic(1.0, client.loop_misc))
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self.misc is not None:
+            self.misc.cancel()
+            self.misc=None
+        if self.closing:
+            if self.closed is not None and not self.closed.done():
+                self.closed.set_result(None)
+        else:
+            self.loop.call_later(self.reconnectDelay, self.reconnect)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def reconnect(self):
+        try:
+            self.client.reconnect()
+        except OSError as e:
+            print('reconnect failed: '+str(e))
+            self.loop.call_later(self.reconnectDelay, self.reconnect)
+
+    def run(self, name, fn, *args):
+        # fn on the executor dedicated to name, created on first use
+        if name not in self.executors:
+            self.executors[name]=ThreadPoolExecutor(1, thread_name_prefix=name)
+        future=self.loop.run_in_executor(self.executors[name], fn, *args)
+        future.add_done_callback(self.report)
+        self.futures[name]=future
+        return future
+
+    def every(self, name, interval, fn, *args):
+        self.tasks[name]=self.loop.create_task(periodic(interval, fn, *args))
+
+    def report(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            e=future.exception()
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    async def cancel(self, names, timeout=5.0):
+        # cancel the periodic tasks and wait for the executor work of names;
+        # blocking loops must have been told to stop through their flags
+        tasks=[self.tasks.pop(name) for name in names if name in self.tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        futures=[self.futures.pop(name) for name in names if name in self.futures]
+        if futures:
+            done, pending = await asyncio.wait(futures, timeout=timeout)
+            if pending:
+                print(str(len(pending))+' sensor loop(s) did not stop within '+str(timeout)+' s')
+
+    async def close(self, timeout=2.0):
+        # stop everything, then disconnect and wait until paho has written the
+        # DISCONNECT and closed the socket
+        self.closing=True
+        await self.cancel(list(self.tasks)+list(self.futures))
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+        self.executors={}
+        if self.client.socket() is not None:
+            self.closed=self.loop.create_future()
+            self.client.disconnect()
+            await asyncio.wait([self.closed], timeout=timeout)
+        if self.misc is not None:
+            self.misc.cancel()
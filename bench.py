@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import math
+import random
+import platform
+import tempfile
+import statistics
+import contextlib
+import numpy as np
+import pandas as pd
+from argparse import ArgumentParser
+import simulators
+
+# Microbenchmarks of the bench's hot paths, with stored baselines.
+#   bench.py run -o baseline.json             time every benchmark, save them
+#   bench.py compare baseline.json now.json   flag what got slower
+# Each benchmark calls one code path the way Rpi_mqtt or the GUI does, calls
+# it often enough that a repeat takes --min-time seconds and keeps the fastest
+# and median repeat per call, and the process CPU time per call. Off the Pi the
+# loadcells, servos and IMU are the simulated ones from simulators.py; the
+# loadcell calls wait for conversions, so their CPU time is what they compare
+# on (with the simulated chips' own share in it off the Pi), everything else
+# compares on the fastest repeat.
+
+def hardware():
+    # the real GPIO on the Pi, simulated hardware where it is not installed;
+    # True when simulated
+    simulated=False
+    try:
+        import RPi.GPIO, hx711
+    except ImportError:
+        simulators.install(simulators.simulatedLoadcells())
+        simulated=True
+    try:
+        import gpiozero, RTIMU
+    except ImportError:
+        simulators.installPlatform()
+        simulated=True
+    return simulated
+
+def servoTable(path):
+    # the servo table of startIMU, database3.csv, or one of the same layout
+    # over -30..30 degrees when it is not there
+    if os.path.exists(path):
+        df=pd.read_csv(path)
+    else:
+        phi, theta = np.meshgrid(np.arange(-30, 31), np.arange(-30, 31), indexing='ij')
+        df=pd.DataFrame({'phi':phi.ravel(), 'theta':theta.ravel()})
+        for name, k in (('right',1.5), ('left',-1.5), ('front',1.5), ('back',-1.5)):
+            df[name]=np.round(k*(df['phi'] if name in ('front','back') else df['theta']), 1)
+    df.set_index(['phi','theta'], inplace=True)
+    return df
+
+def cycle(values):
+    # endless supply of test inputs, so no call sees the same one twice in a row
+    i=0
+    n=len(values)
+    while True:
+        yield values[i % n]
+        i+=1
+
+def loadcellCells(interrupts):
+    import loadcell
+    lc=loadcell.loadcell()
+    if interrupts:
+        lc.enableInterrupts()
+    return lc
+
+def benchMeasure(options):
+    lc=loadcellCells(False)
+    return lambda: lc.measure()
+
+def benchWeigh(interrupts):
+    def setup(options):
+        lc=loadcellCells(interrupts)
+        return lambda: lc.weigh()
+    return setup
+
+def benchReadBlock(interrupts):
+    def setup(options):
+        lc=loadcellCells(interrupts)
+        call=lambda: lc.read_block(options.block)
+        # streaming keeps the interrupt reads going until idle
+        call.close=lc.idle
+        return call
+    return setup
+
+def benchServoTable(options):
+    # startIMU autolevel: the attitude rounded to whole degrees, the table row, four positions
+    df=servoTable(options.table)
+    rng=random.Random(0)
+    phi=df.index.get_level_values('phi')
+    theta=df.index.get_level_values('theta')
+    angles=cycle([(rng.uniform(phi.min(), phi.max()), rng.uniform(theta.min(), theta.max())) for i in range(1000)])
+    def call():
+        p, t = next(angles)
+        data=df.loc[(round(p),round(t))]
+        return data.loc['right'], -data.loc['left'], data.loc['front'], data.loc['back']
+    return call
+
+def benchEncodeImu(options):
+    rng=random.Random(0)
+    values=cycle([(rng.uniform(-30, 30), rng.uniform(-30, 30)) for i in range(1000)])
+    return lambda: json.dumps(next(values))
+
+def loadcellRows(n):
+    rng=random.Random(0)
+    rows=[]
+    for i in range(n):
+        v=[rng.uniform(0, 20) for k in range(4)]
+        rows.append(tuple(v)+(sum(v),))
+    return rows
+
+def benchEncodeLoadcell(options):
+    values=cycle(loadcellRows(1000))
+    return lambda: json.dumps(next(values))
+
+def benchDecode(options):
+    import telemetry
+    payloads=cycle([json.dumps(row).encode() for row in loadcellRows(1000)])
+    return lambda: telemetry.decode('loadcell', next(payloads))
+
+def benchDecodeBatch(options):
+    import telemetry
+    payloads=[json.dumps(row).encode() for row in loadcellRows(options.batch)]
+    return lambda: telemetry.decodeBatch('loadcell', payloads)
+
+def benchFormatTime(options):
+    import Rpi_mqtt
+    rng=random.Random(0)
+    times=cycle([rng.uniform(0, 36000) for i in range(1000)])
+    return lambda: Rpi_mqtt.formatTime(next(times))
+
+def benchSaveFile(options):
+    # savetofile of a run of --records loadcell and IMU records, into a
+    # temporary logs/; saveFile turns the record list into the JSON text
+    import Rpi_mqtt
+    rng=random.Random(0)
+    records=[]
+    for i, row in enumerate(loadcellRows(options.records//2)):
+        records.append({'time':i*0.0125, 'thrust':row[4], 'motor1':row[0], 'motor2':row[1], 'motor3':row[2], 'motor4':row[3]})
+        records.append({'time':i*0.0125, 'roll':rng.uniform(-30, 30), 'pitch':rng.uniform(-30, 30)})
+    directory=tempfile.TemporaryDirectory()
+    os.mkdir(os.path.join(directory.name, 'logs'))
+    Rpi_mqtt.runname='bench'
+    Rpi_mqtt.saved={}
+    def call():
+        cwd=os.getcwd()
+        os.chdir(directory.name)
+        try:
+            Rpi_mqtt.file=records
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                Rpi_mqtt.saveFile()
+        finally:
+            os.chdir(cwd)
+    call.close=directory.cleanup
+    return call
+
+def benchFilter(despike):
+    def setup(options):
+        from filters import FilterPipeline
+        pipeline=FilterPipeline('mean', 2, despike=despike)
+        blocks=cycle([np.array(loadcellRows(options.block*100))[i*options.block:(i+1)*options.block,:4] for i in range(100)])
+        return lambda: pipeline.process(next(blocks))
+    return setup
+
+def benchGuiFlush(options):
+    # one TelemetryWorker batch of --batch loadcell and IMU messages as the
+    # GUI gets them: decode and aggregate, then the model and plot history
+    from GUI_mqtt import TelemetryWorker
+    from telemetry import TelemetryModel
+    from plots import TelemetryHistory
+    worker=TelemetryWorker()
+    model=TelemetryModel()
+    history=TelemetryHistory()
+    now=time.monotonic()
+    messages=[]
+    for i, row in enumerate(loadcellRows(options.batch)):
+        topic, payload = ('IMU', json.dumps(row[:2]).encode()) if i % 3==2 else ('loadcell', json.dumps(row).encode())
+        messages.append((now+i*0.001, '', topic, payload))
+    snapshots=[]
+    worker.snapshotReady.connect(snapshots.append)
+    def call():
+        worker.queue.extend(messages)
+        worker.flush()
+        snapshot=snapshots.pop()['']
+        model.apply(snapshot)
+        history.extendLoadcell(snapshot.loadcellTimes, snapshot.loadcell)
+        history.extendImu(snapshot.imuTimes, snapshot.imu)
+    return call
+
+# name: (setup(options) returning the call to time, what it compares on); a
+# close() attribute of the call runs once it is timed
+BENCHMARKS={
+    'loadcell.measure':(benchMeasure, 'cpu'),
+    'loadcell.weigh':(benchWeigh(False), 'cpu'),
+    'loadcell.weigh.interrupts':(benchWeigh(True), 'cpu'),
+    'loadcell.read_block':(benchReadBlock(False), 'cpu'),
+    'loadcell.read_block.interrupts':(benchReadBlock(True), 'cpu'),
+    'servo.table':(benchServoTable, 'min'),
+    'telemetry.encode.imu':(benchEncodeImu, 'min'),
+    'telemetry.encode.loadcell':(benchEncodeLoadcell, 'min'),
+    'telemetry.decode':(benchDecode, 'min'),
+    'telemetry.decodeBatch':(benchDecodeBatch, 'min'),
+    'formatTime':(benchFormatTime, 'min'),
+    'saveFile':(benchSaveFile, 'min'),
+    'filter.block':(benchFilter(0), 'min'),
+    'filter.block.despike':(benchFilter(15), 'min'),
+    'gui.flush':(benchGuiFlush, 'min'),
+}
+
+def timeCall(call, repeat, minTime):
+    # seconds per call: fastest and median repeat, and CPU time, after
+    # growing the calls per repeat until one takes at least minTime
+    number=1
+    while True:
+        start=time.perf_counter()
+        for i in range(number):
+            call()
+        elapsed=time.perf_counter()-start
+        if elapsed>=minTime or number>=1<<24:
+            break
+        number*=max(2, min(10, int(minTime/max(elapsed, 1e-9))+1))
+    walls=[]
+    cpu0=time.process_time()
+    for r in range(repeat):
+        start=time.perf_counter()
+        for i in range(number):
+            call()
+        walls.append((time.perf_counter()-start)/number)
+    cpu=(time.process_time()-cpu0)/(repeat*number)
+    return {'min':min(walls), 'median':statistics.median(walls), 'cpu':cpu, 'calls':number, 'repeat':repeat}
+
+def run(options):
+    simulated=hardware()
+    names=[name for name in BENCHMARKS if not options.only or any(name.startswith(prefix) for prefix in options.only)]
+    report={'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'platform':platform.platform(), 'python':platform.python_version(),
+            'simulated':simulated, 'settings':{key: getattr(options, key) for key in ('repeat','min_time','block','batch','records','table')}, 'results':{}}
+    print(f'{"benchmark":<32}  {"min us":>10}  {"median us":>10}  {"cpu us":>10}  {"calls":>7}')
+    for name in names:
+        setup, metric = BENCHMARKS[name]
+        try:
+            call=setup(options)
+        except ImportError as e:
+            print(f'{name:<32}  skipped, {e}')
+            continue
+        result=timeCall(call, options.repeat, options.min_time)
+        if hasattr(call, 'close'):
+            call.close()
+        result['metric']=metric
+        report['results'][name]=result
+        print(f'{name:<32}  {result["min"]*1e6:10.2f}  {result["median"]*1e6:10.2f}  {result["cpu"]*1e6:10.2f}  {result["calls"]:7d}', flush=True)
+    with open(options.output,'w') as f:
+        json.dump(report, f, indent=2)
+    print('report saved as '+options.output)
+
+def compare(options):
+    # 1 when anything got slower than threshold percent
+    with open(options.baseline) as f:
+        baseline=json.load(f)
+    with open(options.current) as f:
+        current=json.load(f)
+    for key in ('platform','python','simulated'):
+        if baseline.get(key)!=current.get(key):
+            print('note: {} differs, {} against {}'.format(key, baseline.get(key), current.get(key)))
+    regressions=[]
+    print(f'{"benchmark":<32}  {"on":>6}  {"baseline us":>11}  {"current us":>11}  {"change %":>9}')
+    for name, old in baseline['results'].items():
+        new=current['results'].get(name)
+        if new is None:
+            print(f'{name:<32}  not in {options.current}')
+            continue
+        metric=options.metric or old.get('metric', 'min')
+        change=100*(new[metric]/old[metric]-1) if old[metric]>0 else math.inf
+        flag=''
+        if change>options.threshold:
+            flag='  REGRESSION'
+            regressions.append(name)
+        elif change<-options.threshold:
+            flag='  faster'
+        print(f'{name:<32}  {metric:>6}  {old[metric]*1e6:11.2f}  {new[metric]*1e6:11.2f}  {change:9.1f}{flag}')
+    for name in current['results']:
+        if name not in baseline['results']:
+            print(f'{name:<32}  new, no baseline')
+    if regressions:
+        print('{} slower than {:g}%: {}'.format(len(regressions), options.threshold, ', '.join(regressions)))
+        return 1
+    print('no regressions over {:g}%'.format(options.threshold))
+    return 0
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Microbenchmarks of the bench hot paths with stored baselines')
+    commands=parser.add_subparsers(dest='command', required=True)
+    runner=commands.add_parser('run', help='time the benchmarks and save the results')
+    runner.add_argument('--only', nargs='+', help='benchmarks whose names start with these')
+    runner.add_argument('--repeat', type=int, default=5, help='timed repeats per benchmark')
+    runner.add_argument('--min-time', type=float, default=0.2, help='seconds one repeat takes at least')
+    runner.add_argument('--block', type=int, default=2, help='loadcell rows per block, lcconfig block')
+    runner.add_argument('--batch', type=int, default=100, help='messages per decodeBatch and GUI flush')
+    runner.add_argument('--records', type=int, default=20000, help='records of the run saveFile writes')
+    runner.add_argument('--table', default='database3.csv', help='servo table, a synthetic one when not there')
+    runner.add_argument('--output', '-o', default='bench.json', help='results file')
+    checker=commands.add_parser('compare', help='compare results with a baseline, exit 1 on regressions')
+    checker.add_argument('baseline', help='results saved by run')
+    checker.add_argument('current', help='results saved by run')
+    checker.add_argument('--threshold', type=float, default=10, help='percent slower that counts as a regression')
+    checker.add_argument('--metric', choices=('min','median','cpu'), help='compare on this instead of each benchmark\'s own')
+    options=parser.parse_args()
+    if options.command=='run':
+        run(options)
+    else:
+        sys.exit(compare(options))
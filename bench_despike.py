@@ -0,0 +1,101 @@
+import json
+import time
+import platform
+import numpy as np
+from argparse import ArgumentParser
+from filters import FilterPipeline, Hampel
+
+# Spike rejection on recorded runs: single sample spikes are injected at known
+# places into the loadcell samples of a run, which then go through the loadcell
+# filter pipeline with and without the Hampel stage (lcconfig despike, see
+# filters.Hampel). Reports the injected spikes caught, samples rejected that
+# had no spike, how far the filtered thrust moved from that of the clean run,
+# how many samples of a real step it holds back and the cost of the Hampel
+# stage per sample of all four channels.
+
+def loadRun(path):
+    # (n, 4) motor1..motor4 of a run saved by savetofile (logs/*.json) or of
+    # an .npz with loadcell_motor columns (downloaded runs, trigger windows)
+    if path.endswith('.npz'):
+        with np.load(path) as f:
+            return np.column_stack([f['loadcell_motor'+str(i+1)] for i in range(4)]).astype(np.float64)
+    with open(path) as f:
+        records=json.load(f)
+    return np.array([[r['motor'+str(i+1)] for i in range(4)] for r in records if 'thrust' in r], dtype=np.float64)
+
+def inject(values, fraction, amplitude, rng):
+    # +-amplitude N on a random fraction of the samples, returns (spiked, where)
+    where=rng.random(values.shape)<fraction
+    return values+where*rng.choice((-1.0, 1.0), values.shape)*amplitude, where
+
+def stream(stage, values, block):
+    # values through stage.process in blocks of the size startloadcell reads
+    out=[stage.process(values[i:i+block]) for i in range(0, len(values), block)]
+    return np.concatenate(out) if out else values[:0]
+
+def run_step(values, amplitude, options, rng):
+    spiked, where = inject(values, options.fraction, amplitude, rng)
+    pipeline=lambda despike: FilterPipeline(options.filter, options.decimation, despike=despike, threshold=options.threshold)
+    clean=stream(pipeline(0), values, options.block).sum(axis=1)
+    plain=stream(pipeline(0), spiked, options.block).sum(axis=1)
+    despiked=stream(pipeline(options.length), spiked, options.block).sum(axis=1)
+    # which samples the Hampel stage replaced, on the clean and the spiked run
+    baseline=Hampel(options.length, 4, options.threshold)
+    stream(baseline, values, options.block)
+    hampel=Hampel(options.length, 4, options.threshold)
+    start=time.perf_counter()
+    rejected=stream(hampel, spiked, options.block)!=spiked
+    seconds=time.perf_counter()-start
+    # a real step of the same height halfway through: samples replaced before it gets through
+    step=values.copy()
+    half=len(values)//2
+    step[half:]+=amplitude
+    held=(stream(Hampel(options.length, 4, options.threshold), step, options.block)!=step)[half:,0]
+    injected=int(where.sum())
+    return {
+        'amplitude':amplitude,
+        'injected':injected,
+        'caught_percent':100*float((rejected & where).sum())/max(injected, 1),
+        'false':int((rejected & ~where).sum()),
+        'clean_rejected':int(baseline.rejected.sum()),
+        'error_max':float(np.abs(plain-clean).max()),
+        'error_max_despiked':float(np.abs(despiked-clean).max()),
+        'error_rms':float(np.sqrt(np.mean((plain-clean)**2))),
+        'error_rms_despiked':float(np.sqrt(np.mean((despiked-clean)**2))),
+        'step_delay':int(np.argmin(held)) if not held.all() else len(held),
+        'us_per_sample':1e6*seconds/len(values),
+    }
+
+COLUMNS=(('amplitude','spike N',2),('injected','injected',0),('caught_percent','caught %',1),('false','false',0),('clean_rejected','clean rej',0),
+         ('error_max','max err',3),('error_max_despiked','despiked',3),('error_rms','rms err',4),('error_rms_despiked','despiked',4),('step_delay','step held',0),('us_per_sample','us/sample',1))
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Inject single sample spikes into recorded runs and measure the Hampel spike rejection')
+    parser.add_argument('runs', nargs='+', help='logs/*.json saved runs or .npz files with loadcell_motor columns')
+    parser.add_argument('--amplitudes', type=float, nargs='+', default=[0.1, 0.5, 2, 10], help='spike heights in N to step through')
+    parser.add_argument('--fraction', type=float, default=0.01, help='fraction of the samples that get a spike')
+    parser.add_argument('--length', type=int, default=15, help='Hampel window, lcconfig despike')
+    parser.add_argument('--threshold', type=float, default=4.0, help='Hampel threshold in standard deviations')
+    parser.add_argument('--filter', default='mean', help='loadcell filter behind the Hampel stage')
+    parser.add_argument('--decimation', type=int, default=2, help='loadcell filter decimation')
+    parser.add_argument('--block', type=int, default=2, help='samples per block, lcconfig block')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the spike positions')
+    parser.add_argument('--output', '-o', default='bench_despike.json', help='report file')
+    options=parser.parse_args()
+    rng=np.random.default_rng(options.seed)
+    report={'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'platform':platform.platform(), 'python':platform.python_version(),
+            'settings':{key: getattr(options, key) for key in ('fraction','length','threshold','filter','decimation','block','seed')}, 'runs':{}}
+    for path in options.runs:
+        values=loadRun(path)
+        print('{}: {} loadcell samples'.format(path, len(values)))
+        if len(values)<options.length:
+            continue
+        print('  '.join(f'{title:>9}' for key, title, digits in COLUMNS))
+        results=[]
+        for amplitude in options.amplitudes:
+            results.append(run_step(values, amplitude, options, rng))
+            print('  '.join(f'{round(results[-1][key], digits) if digits else int(round(results[-1][key])):>9}' for key, title, digits in COLUMNS), flush=True)
+        report['runs'][path]=results
+    with open(options.output,'w') as f:
+        json.dump(report, f, indent=2)
+    print('report saved as '+options.output)
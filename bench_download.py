@@ -0,0 +1,119 @@
+import os
+import json
+import math
+import time
+import shutil
+import platform
+import tempfile
+import paho.mqtt.client as mqtt
+from argparse import ArgumentParser
+from download import RunSender, RunReceiver
+from runstore import RunStore
+
+# Run download throughput and sender CPU through a broker: a synthetic run
+# shaped like Rpi_mqtt's records (IMU at about 220 Hz, loadcell at about 37 Hz)
+# is sent by a RunSender and stored by a RunReceiver, for a few chunk sizes and
+# zlib levels. Sender cpu is the thread that encodes and compresses the chunks,
+# the part a download adds to the Pi's load; process cpu includes the receiver
+# and both network threads. Needs a broker, --broker HOST[:PORT].
+
+PREFIX='benchdl/'
+
+def syntheticRun(n):
+    records=[]
+    for i in range(n):
+        t=i/257
+        if i % 7==6:
+            lc=[round(10+5*math.sin(t*(k+1)),2) for k in range(4)]
+            records.append({'time':round(t,2), 'thrust':round(sum(lc),2), 'motor1':lc[0], 'motor2':lc[1], 'motor3':lc[2], 'motor4':lc[3]})
+        else:
+            records.append({'time':round(t,2), 'roll':10*math.sin(t), 'pitch':10*math.cos(0.7*t)})
+    return records
+
+def connect(broker, on_message, topics):
+    client=mqtt.Client()
+    client.on_message=on_message
+    subscribed=[]
+    client.on_subscribe=lambda *args: subscribed.append(True)
+    client.connect(broker[0], broker[1])
+    client.loop_start()
+    for topic in topics:
+        client.subscribe(PREFIX+topic)
+    while len(subscribed)<len(topics):
+        time.sleep(0.01)
+    return client
+
+def run_step(records, chunk, level, window, broker):
+    directory=tempfile.mkdtemp(prefix='bench_download')
+    store=RunStore(directory)
+    done=[]
+    sender=None
+    receiver=None
+    def pi(client, userdata, msg):
+        if msg.topic==PREFIX+'download':
+            sender.request(msg.payload)
+        else:
+            sender.ack(msg.payload)
+    piclient=connect(broker, pi, ('download','download/ack'))
+    sender=RunSender(lambda topic, payload: piclient.publish(PREFIX+topic, payload), lambda run: ('bench', records, lambda: False),
+                     chunk, window, level=level)
+    guiclient=connect(broker, lambda client, userdata, msg: receiver.receive(msg.payload), ('download/chunk',))
+    receiver=RunReceiver(store, lambda topic, payload: guiclient.publish(PREFIX+topic, payload), done.append)
+    cpu0=os.times()
+    wall0=time.perf_counter()
+    receiver.request('bench')
+    while receiver.active and time.perf_counter()-wall0<120:
+        receiver.check()
+        time.sleep(0.01)
+    wall=time.perf_counter()-wall0
+    cpu1=os.times()
+    # the sender reports once it has sent the last chunk
+    while sender.stats is None and time.perf_counter()-wall0<125:
+        time.sleep(0.01)
+    for client in (piclient, guiclient):
+        client.loop_stop()
+        client.disconnect()
+    stored=store.load('bench') if store.finished('bench') else {}
+    shutil.rmtree(directory)
+    stats=sender.stats or {'bytes':0, 'cpu_seconds':0.0}
+    return {
+        'chunk':chunk,
+        'level':level,
+        'records':len(records),
+        'stored':len(stored.get('imu_time', []))+len(stored.get('loadcell_time', [])),
+        'kb':stats['bytes']/1000,
+        'seconds':wall,
+        'records_per_s':len(records)/wall,
+        'kb_per_s':stats['bytes']/1000/wall,
+        'sender_cpu_percent':100*stats['cpu_seconds']/wall,
+        'process_cpu_percent':100*((cpu1.user-cpu0.user)+(cpu1.system-cpu0.system))/wall,
+    }
+
+COLUMNS=(('chunk','chunk',0),('level','level',0),('stored','stored',0),('kb','kB',0),('seconds','s',2),('records_per_s','rec/s',0),
+         ('kb_per_s','kB/s',0),('sender_cpu_percent','sender %',0),('process_cpu_percent','process %',0))
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Run download benchmark: chunked, compressed transfer through the broker')
+    parser.add_argument('--records', type=int, default=150000, help='records in the run, 150000 is about 10 minutes')
+    parser.add_argument('--chunks', type=int, nargs='+', default=[250,1000,4000], help='records per chunk to step through')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1,6], help='zlib levels to step through')
+    parser.add_argument('--window', type=int, default=8, help='unacknowledged chunks in flight')
+    parser.add_argument('--broker', default='localhost:1883', help='MQTT broker HOST[:PORT]')
+    parser.add_argument('--output', '-o', default='bench_download.json', help='report file')
+    options=parser.parse_args()
+    host, _, port = options.broker.partition(':')
+    broker=(host, int(port or 1883))
+    records=syntheticRun(options.records)
+    raw=len(json.dumps(records))/1000
+    print('run of {} records, {:.0f} kB as JSON'.format(len(records), raw))
+    results=[]
+    print('  '.join(f'{title:>9}' for key, title, digits in COLUMNS))
+    for chunk in options.chunks:
+        for level in options.levels:
+            results.append(run_step(records, chunk, level, options.window, broker))
+            print('  '.join(f'{round(results[-1][key], digits) if digits else int(round(results[-1][key])):>9}' for key, title, digits in COLUMNS), flush=True)
+    report={'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'platform':platform.platform(), 'python':platform.python_version(),
+            'broker':options.broker, 'window':options.window, 'raw_kb':raw, 'results':results}
+    with open(options.output,'w') as f:
+        json.dump(report, f, indent=2)
+    print('report saved as '+options.output)
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from argparse import ArgumentParser
+
+# Headless benchmark of GUI_mqtt.MainWindow: a synthetic in-process feed is
+# stepped through increasing message rates and for every step we record event
+# loop lag, frame times, dropped updates, CPU and memory. The JSON report can be
+# compared against one from another version with --compare. With --rigs the
+# steps are dashboards of N simulated rigs talking through the in-process
+# broker stand-in, each at the first of --rates.
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def memory_mb():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss/2**20
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values=sorted(values)
+    return values[min(int(p/100*len(values)), len(values)-1)]
+
+def version():
+    try:
+        return subprocess.run(['git','describe','--always','--dirty'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+class OffscreenGL():
+    # Renders OpenGLWidget.paintGL into a framebuffer object on an offscreen
+    # surface, for platforms where the widget itself gets no context (offscreen QPA)
+    def __init__(self, glwidget, width=480, height=540):
+        from PySide6.QtGui import QOpenGLContext, QOffscreenSurface, QSurfaceFormat
+        from PySide6.QtOpenGL import QOpenGLFramebufferObject
+        from PySide6.QtCore import QSize
+        self.glwidget=glwidget
+        self.valid=False
+        self.context=QOpenGLContext()
+        self.context.setFormat(QSurfaceFormat.defaultFormat())
+        if not self.context.create():
+            return
+        self.surface=QOffscreenSurface()
+        self.surface.setFormat(self.context.format())
+        self.surface.create()
+        if not self.context.makeCurrent(self.surface):
+            return
+        self.fbo=QOpenGLFramebufferObject(QSize(width, height), QOpenGLFramebufferObject.CombinedDepthStencil)
+        self.fbo.bind()
+        glwidget.initializeGL()
+        glwidget.resizeGL(width, height)
+        self.valid=True
+
+    def render(self):
+        self.context.makeCurrent(self.surface)
+        self.fbo.bind()
+        self.glwidget.paintGL()
+
+def run_step(app, GUI_mqtt, rate, duration, warmup, rigs=0):
+    from PySide6.QtCore import QEventLoop, QTimer
+    from telemetry import LoopbackBroker, simulatedRig
+    if rigs:
+        broker=LoopbackBroker()
+        names=['rig'+str(i+1) for i in range(rigs)]
+        window=GUI_mqtt.Dashboard([(name, 'localhost', 1883) for name in names], broker=broker)
+        panels=window.panels
+        feeds=[simulatedRig(broker, name, rate) for name in names]
+        for feed in feeds:
+            feed.start()
+    else:
+        window=GUI_mqtt.MainWindow(False, synthetic=rate)
+        panels=[window]
+        feeds=[window.feed]
+    window.show()
+    lag=GUI_mqtt.LagMonitor(seconds=duration+warmup+1, parent=window)
+    # one offscreen renderer per panel, each repainted when its panel drew a new frame
+    offscreen=[]
+    for panel in panels:
+        if not panel.glwidget.isValid():
+            gl=OffscreenGL(panel.glwidget)
+            if gl.valid:
+                offscreen.append((panel, gl, [panel.frameCount]))
+    def paintOffscreen():
+        for panel, gl, rendered in offscreen:
+            if panel.frameCount!=rendered[0]:
+                rendered[0]=panel.frameCount
+                gl.render()
+    if offscreen:
+        painter=QTimer(window)
+        painter.timeout.connect(paintOffscreen)
+        painter.start(1)
+
+    loop=QEventLoop()
+    QTimer.singleShot(int(warmup*1000), loop.quit)
+    loop.exec()
+
+    # measured part
+    lag.lags.clear()
+    for panel in panels:
+        panel.glwidget.frameTimes.clear()
+    worker=panels[0].worker
+    sent0=sum(feed.sent for feed in feeds)
+    handled0=sum(panel.model.messages for panel in panels)
+    backlog0=len(worker.queue)
+    frames0=sum(panel.frameCount for panel in panels)
+    cpu0=time.process_time()
+    wall0=time.perf_counter()
+    QTimer.singleShot(int(duration*1000), loop.quit)
+    loop.exec()
+    wall=time.perf_counter()-wall0
+    cpu=time.process_time()-cpu0
+    sent=sum(feed.sent for feed in feeds)-sent0
+    handled=sum(panel.model.messages for panel in panels)-handled0
+    frames=(sum(panel.frameCount for panel in panels)-frames0)/len(panels)
+    backlog=len(worker.queue)
+    lags=[1000*v for v in lag.lags]
+    frameTimes=[1000*v for panel in panels for v in panel.glwidget.frameTimes]
+    result={
+        'rigs':len(panels),
+        'rate':rate,
+        'sent_per_s':sent/wall,
+        'handled_per_s':handled/wall,
+        'dropped':max(sent-handled-(backlog-backlog0),0),
+        'backlog':backlog,
+        'errors':worker.errors,
+        'fps':frames/wall,
+        'frame_ms_mean':sum(frameTimes)/len(frameTimes) if frameTimes else None,
+        'frame_ms_p99':percentile(frameTimes, 99) if frameTimes else None,
+        'lag_ms_mean':sum(lags)/len(lags) if lags else 0.0,
+        'lag_ms_p99':percentile(lags, 99),
+        'lag_ms_max':max(lags) if lags else 0.0,
+        'cpu_percent':100*cpu/wall,
+        'memory_mb':memory_mb(),
+    }
+    for feed in feeds:
+        feed.stop()
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+    return result
+
+COLUMNS=(('rigs','rigs',0),('rate','rate',0),('handled_per_s','handled/s',0),('dropped','dropped',0),('backlog','backlog',0),('fps','fps',1),
+         ('frame_ms_mean','frame ms',2),('lag_ms_mean','lag ms',1),('lag_ms_p99','lag p99',1),('lag_ms_max','lag max',1),
+         ('cpu_percent','cpu %',0),('memory_mb','mem MB',0))
+
+def fmt(value, digits):
+    if value is None:
+        return '-'
+    return str(round(value, digits) if digits else int(round(value)))
+
+def print_header():
+    print('  '.join(f'{title:>10}' for key, title, digits in COLUMNS))
+
+def print_row(row):
+    print('  '.join(f'{fmt(row.get(key), digits):>10}' for key, title, digits in COLUMNS), flush=True)
+
+def compare(old, new):
+    # relative change per metric for every rig count and rate present in both reports
+    print('comparing '+old.get('version','?')+' -> '+new.get('version','?'))
+    previous={(row.get('rigs',1), row['rate']):row for row in old['results']}
+    print('  '.join(f'{title:>16}' for key, title, digits in COLUMNS))
+    for row in new['results']:
+        base=previous.get((row.get('rigs',1), row['rate']))
+        if base is None:
+            continue
+        cells=[]
+        for key, title, digits in COLUMNS:
+            a, b = base.get(key), row.get(key)
+            if key in ('rigs','rate') or a is None or b is None:
+                cells.append(fmt(b, digits))
+            elif a:
+                cells.append(fmt(b, digits)+f' ({100*(b-a)/abs(a):+.0f}%)')
+            else:
+                cells.append(fmt(b, digits)+f' ({b-a:+g})')
+        print('  '.join(f'{cell:>16}' for cell in cells))
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Headless GUI benchmark with a synthetic telemetry feed')
+    parser.add_argument('--rates', type=int, nargs='+', default=[100,1000,5000,10000,20000,50000], help='message rates to step through (msg/s)')
+    parser.add_argument('--rigs', type=int, nargs='+', default=[], help='dashboard sizes to step through, each rig at the first rate')
+    parser.add_argument('--duration', type=float, default=5, help='measured seconds per rate')
+    parser.add_argument('--warmup', type=float, default=1, help='seconds before measuring each rate')
+    parser.add_argument('--output', '-o', default='bench_gui.json', help='report file')
+    parser.add_argument('--compare', '-c', metavar='REPORT', help='compare against an earlier report')
+    parser.add_argument('--visible', action='store_true', help='use the normal platform instead of offscreen')
+    options=parser.parse_args()
+
+    if not options.visible:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtWidgets import QApplication
+    app=QApplication(sys.argv)
+    import GUI_mqtt
+
+    results=[]
+    print_header()
+    if options.rigs:
+        steps=[(options.rates[0], rigs) for rigs in options.rigs]
+    else:
+        steps=[(rate, 0) for rate in options.rates]
+    for rate, rigs in steps:
+        results.append(run_step(app, GUI_mqtt, rate, options.duration, options.warmup, rigs))
+        print_row(results[-1])
+    report={'version':version(), 'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'platform':platform.platform(),
+            'python':platform.python_version(), 'qpa':os.environ.get('QT_QPA_PLATFORM',''), 'results':results}
+    with open(options.output,'w') as f:
+        json.dump(report, f, indent=2)
+    print('report saved as '+options.output)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import math
+import time
+import platform
+import subprocess
+import numpy as np
+from argparse import ArgumentParser, SUPPRESS
+from shmring import SharedRing, ringName
+from transport import MqttTransport, UdpTransport, UDP_PORT
+
+# Latency and throughput of the telemetry path between two processes on the
+# same host: the MQTT broker path (JSON over TCP loopback), brokerless UDP
+# datagrams (the same JSON) and the shared memory ring. A writer subprocess
+# sends loadcell rows (time.monotonic(), m1..m4, total) at each rate, this
+# process receives them and records how late every row arrives. The MQTT path
+# needs a broker, --broker HOST[:PORT].
+
+TOPIC='bench/loadcell'
+
+def percentile(values, p):
+    if len(values)==0:
+        return 0.0
+    return float(np.percentile(values, p))
+
+def row(i, now):
+    v=[round(10+5*math.sin(now*(k+1)),2) for k in range(4)]
+    return [now]+v+[round(sum(v),2)]
+
+def writer(transport, rate, duration, broker):
+    # runs in the subprocess: set up, say ready, wait for go, send, report
+    if transport=='shm':
+        ring=SharedRing(ringName('loadcell','bench'), width=6, create=True)
+    elif transport=='udp':
+        out=UdpTransport('127.0.0.1', UDP_PORT)
+    else:
+        import paho.mqtt.client as mqtt
+        client=mqtt.Client()
+        client.connect(broker[0], broker[1])
+        client.loop_start()
+        out=MqttTransport(client)
+    print('ready', flush=True)
+    sys.stdin.readline()
+    sent=0
+    start=time.perf_counter()
+    cpu0=time.process_time()
+    while True:
+        elapsed=time.perf_counter()-start
+        if elapsed>=duration:
+            break
+        due=int(elapsed*rate)
+        if due>sent:
+            now=time.monotonic()
+            if transport=='shm':
+                ring.write([row(i, now) for i in range(sent, due)])
+            else:
+                for i in range(sent, due):
+                    out.publish(TOPIC, json.dumps(row(i, time.monotonic())))
+            sent=due
+        time.sleep(0.001)
+    cpu=time.process_time()-cpu0
+    if transport=='shm':
+        print(json.dumps({'sent':sent, 'cpu':cpu}), flush=True)
+        # keep the ring until the reader has drained it
+        sys.stdin.readline()
+        ring.close()
+    elif transport=='udp':
+        out.stop()
+        print(json.dumps({'sent':sent, 'cpu':cpu}), flush=True)
+    else:
+        client.loop_stop()
+        client.disconnect()
+        print(json.dumps({'sent':sent, 'cpu':cpu}), flush=True)
+
+def run_step(transport, rate, duration, broker, poll):
+    proc=subprocess.Popen([sys.executable, os.path.abspath(__file__), '--writer', transport, '--rate', str(rate),
+                           '--duration', str(duration), '--broker', '{}:{}'.format(*broker)],
+                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    if proc.stdout.readline().strip()!='ready':
+        proc.wait()
+        raise RuntimeError(transport+' writer failed to start')
+    latencies=[]
+    received=[0]
+    if transport=='shm':
+        ring=SharedRing(ringName('loadcell','bench'))
+        def receive():
+            for view in ring.readAll():
+                latencies.append(time.monotonic()-view[:,0])
+                received[0]+=len(view)
+    else:
+        def sink(topic, payload):
+            stamp=json.loads(payload)[0]
+            latencies.append(time.monotonic()-stamp)
+            received[0]+=1
+        if transport=='udp':
+            inp=UdpTransport(port=UDP_PORT)
+            inp.start(sink)
+        else:
+            import paho.mqtt.client as mqtt
+            client=mqtt.Client()
+            inp=MqttTransport(client)
+            inp.start(sink)
+            subscribed=[]
+            client.on_subscribe=lambda *args: subscribed.append(True)
+            client.connect(broker[0], broker[1])
+            client.loop_start()
+            client.subscribe(TOPIC)
+            while not subscribed:
+                time.sleep(0.01)
+        receive=lambda: None
+    cpu0=time.process_time()
+    wall0=time.perf_counter()
+    proc.stdin.write('go\n')
+    proc.stdin.flush()
+    # the MQTT and UDP readers run on their own thread, the shm reader polls like the GUI would
+    end=wall0+duration+0.5
+    while time.perf_counter()<end:
+        receive()
+        time.sleep(poll/1000)
+    receive()
+    wall=time.perf_counter()-wall0
+    cpu=time.process_time()-cpu0
+    report=json.loads(proc.stdout.readline())
+    if transport=='shm':
+        proc.stdin.write('done\n')
+        proc.stdin.flush()
+        lost=ring.lost
+        ring.close()
+    else:
+        if transport=='mqtt':
+            client.loop_stop()
+            client.disconnect()
+        inp.stop()
+        lost=report['sent']-received[0]
+    proc.wait()
+    lat=1000*np.concatenate([np.atleast_1d(v) for v in latencies]) if latencies else np.zeros(0)
+    return {
+        'transport':transport,
+        'rate':rate,
+        'sent':report['sent'],
+        'received_per_s':received[0]/duration,
+        'lost':lost,
+        'latency_ms_mean':float(lat.mean()) if len(lat) else None,
+        'latency_ms_p50':percentile(lat, 50),
+        'latency_ms_p99':percentile(lat, 99),
+        'latency_ms_max':float(lat.max()) if len(lat) else None,
+        'reader_cpu_percent':100*cpu/wall,
+        'writer_cpu_percent':100*report['cpu']/duration,
+    }
+
+COLUMNS=(('transport','transport',None),('rate','rate',0),('received_per_s','recv/s',0),('lost','lost',0),('latency_ms_mean','lat ms',3),
+         ('latency_ms_p50','lat p50',3),('latency_ms_p99','lat p99',3),('latency_ms_max','lat max',2),
+         ('reader_cpu_percent','reader %',0),('writer_cpu_percent','writer %',0))
+
+def fmt(value, digits):
+    if value is None:
+        return '-'
+    if digits is None:
+        return str(value)
+    return str(round(value, digits) if digits else int(round(value)))
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Telemetry transport benchmark: MQTT broker, UDP and shared memory')
+    parser.add_argument('--transports', nargs='+', choices=('mqtt','udp','shm'), default=['mqtt','udp','shm'])
+    parser.add_argument('--rates', type=int, nargs='+', default=[50,1000,10000,50000], help='rows per second to step through')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per step')
+    parser.add_argument('--broker', default='localhost:1883', help='MQTT broker HOST[:PORT]')
+    parser.add_argument('--poll', type=float, default=1, help='shared memory poll interval in ms')
+    parser.add_argument('--output', '-o', default='bench_transport.json', help='report file')
+    parser.add_argument('--writer', choices=('mqtt','udp','shm'), help=SUPPRESS)
+    parser.add_argument('--rate', type=int, default=1000, help=SUPPRESS)
+    options=parser.parse_args()
+    host, _, port = options.broker.partition(':')
+    broker=(host, int(port or 1883))
+
+    if options.writer:
+        writer(options.writer, options.rate, options.duration, broker)
+        sys.exit()
+
+    results=[]
+    print('  '.join(f'{title:>10}' for key, title, digits in COLUMNS))
+    for transport in options.transports:
+        for rate in options.rates:
+            try:
+                results.append(run_step(transport, rate, options.duration, broker, options.poll))
+            except (OSError, RuntimeError) as e:
+                print(transport+' skipped: '+str(e))
+                break
+            print('  '.join(f'{fmt(results[-1].get(key), digits):>10}' for key, title, digits in COLUMNS), flush=True)
+    report={'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'platform':platform.platform(), 'python':platform.python_version(),
+            'broker':options.broker, 'poll_ms':options.poll, 'results':results}
+    with open(options.output,'w') as f:
+        json.dump(report, f, indent=2)
+    print('report saved as '+options.output)
@@ -0,0 +1,210 @@
+import json
+import time
+import numpy as np
+from argparse import ArgumentParser
+
+# Scripted angle sweeps run on the Pi (Rpi_mqtt 'campaign'). Every step sets
+# the phi/theta setpoints of pidpitch/pidroll directly, waits until the IMU
+# attitude has settled on them, then records for the dwell time and publishes
+# a summary of the step on 'campaign/step'. A step moves on as soon as the rig
+# has settled, so a sweep runs as fast as the hardware allows. The samples
+# come from the run's records, the same list savetofile writes, so this works
+# with threads, processes (-p) and the asyncio runtime (-a) alike.
+
+SETTINGS={'dwell':2.0, 'tolerance':0.5, 'hold':0.3, 'timeout':5.0}
+
+def span(start, stop, step):
+    # inclusive range, [START, STOP, STEP] or a single value
+    if float(step)==0:
+        raise ValueError('a grid step cannot be 0')
+    return [round(float(v), 6) for v in np.arange(start, stop+step/2, step)]
+
+def parseSweep(definition):
+    # {"grid": {"phi": [START, STOP, STEP], "theta": [START, STOP, STEP]}} or
+    # {"steps": [[phi, theta], [phi, theta, dwell], ...]}, plus the optional
+    # SETTINGS: dwell seconds recorded per step, tolerance in degrees, hold
+    # seconds inside the tolerance before a step counts as settled and timeout
+    # seconds to wait for that. Returns ([(phi, theta, dwell)], settings),
+    # anything else raises ValueError.
+    if not isinstance(definition, dict):
+        raise ValueError('a sweep is a JSON object')
+    try:
+        settings=dict(SETTINGS)
+        settings.update({key: float(definition[key]) for key in SETTINGS if key in definition})
+        if 'grid' in definition:
+            grid=definition['grid']
+            phis=span(*grid['phi']) if isinstance(grid['phi'], list) else [float(grid['phi'])]
+            thetas=span(*grid['theta']) if isinstance(grid['theta'], list) else [float(grid['theta'])]
+            steps=[]
+            for i, phi in enumerate(phis):
+                # serpentine order, the rig never swings back across the whole theta range
+                for theta in (thetas if i % 2==0 else thetas[::-1]):
+                    steps.append((phi, theta, settings['dwell']))
+        elif 'steps' in definition:
+            steps=[(float(s[0]), float(s[1]), float(s[2]) if len(s)>2 else settings['dwell']) for s in definition['steps']]
+        else:
+            raise ValueError('a sweep needs "grid" or "steps"')
+    except (KeyError, IndexError, TypeError) as e:
+        raise ValueError('bad sweep: '+str(e))
+    if not steps:
+        raise ValueError('the sweep has no steps')
+    if any(value<0 for value in settings.values()) or any(step[2]<0 for step in steps):
+        raise ValueError('dwell, tolerance, hold and timeout cannot be negative')
+    return steps, settings
+
+def stats(values):
+    if len(values)==0:
+        return None, None
+    values=np.asarray(values)
+    return round(float(values.mean()), 3), round(float(values.std()), 3)
+
+class Campaign():
+    # setpoint(phi, theta) moves the PID setpoints, records is the run's record
+    # list, running(records) tells whether that run is still recording and
+    # publish(topic, payload) reports. run() blocks until the sweep is done,
+    # stopped or the run ends.
+    def __init__(self, steps, settings, setpoint, records, running, publish, filename=None, poll=0.02):
+        self.steps=steps
+        self.settings=settings
+        self.setpoint=setpoint
+        self.records=records
+        self.running=running
+        self.publish=publish
+        self.filename=filename
+        self.poll=poll
+        self.results=[]
+        # busy from creation until run() returns
+        self.active=True
+        self.stopped=False
+        self.pos=0
+
+    def stop(self):
+        self.stopped=True
+
+    def fresh(self):
+        # records appended since the previous call
+        n=len(self.records)
+        rows=self.records[self.pos:n]
+        self.pos=n
+        return rows
+
+    def cancelled(self):
+        return self.stopped or not self.running(self.records)
+
+    def settle(self, phi, theta):
+        # seconds until the attitude stayed within tolerance for hold seconds, None on timeout
+        tolerance=self.settings['tolerance']
+        start=time.monotonic()
+        inside=None
+        self.fresh()
+        while time.monotonic()-start<self.settings['timeout'] and not self.cancelled():
+            time.sleep(self.poll)
+            now=time.monotonic()
+            for r in self.fresh():
+                if 'roll' in r:
+                    if abs(r['pitch']-phi)<=tolerance and abs(r['roll']-theta)<=tolerance:
+                        if inside is None:
+                            inside=now
+                    else:
+                        inside=None
+            if inside is not None and now-inside>=self.settings['hold']:
+                return now-start
+        return None
+
+    def record(self, dwell):
+        rows=[]
+        end=time.monotonic()+dwell
+        self.fresh()
+        while time.monotonic()<end and not self.cancelled():
+            time.sleep(self.poll)
+            rows+=self.fresh()
+        return rows
+
+    def step(self, i, phi, theta, dwell):
+        self.setpoint(phi, theta)
+        settle=self.settle(phi, theta)
+        rows=self.record(dwell)
+        imu=[r for r in rows if 'roll' in r]
+        lc=[r for r in rows if 'thrust' in r]
+        pitch=np.array([r['pitch'] for r in imu])
+        roll=np.array([r['roll'] for r in imu])
+        summary={'step':i, 'phi':phi, 'theta':theta, 'settled':settle is not None,
+                 'settle_s':round(settle, 3) if settle is not None else None, 'imu_samples':len(imu), 'loadcell_samples':len(lc)}
+        summary['phi_mean'], summary['phi_std'] = stats(pitch)
+        summary['theta_mean'], summary['theta_std'] = stats(roll)
+        summary['error_rms']=round(float(np.sqrt(np.mean((pitch-phi)**2+(roll-theta)**2))), 3) if len(imu) else None
+        for key in ('thrust','motor1','motor2','motor3','motor4'):
+            summary[key+'_mean'], summary[key+'_std'] = stats([r[key] for r in lc])
+        return summary
+
+    def run(self):
+        start=time.monotonic()
+        try:
+            for i, (phi, theta, dwell) in enumerate(self.steps):
+                if self.cancelled():
+                    break
+                summary=self.step(i, phi, theta, dwell)
+                if self.cancelled():
+                    # cut short, not a full step
+                    break
+                self.results.append(summary)
+                self.publish('campaign/step', json.dumps(summary))
+        finally:
+            self.setpoint(0, 0)
+            self.active=False
+        settled=[r['settle_s'] for r in self.results if r['settled']]
+        report={'steps':len(self.results), 'planned':len(self.steps), 'aborted':len(self.results)<len(self.steps),
+                'seconds':round(time.monotonic()-start, 2), 'unsettled':len(self.results)-len(settled),
+                'settle_s_mean':round(sum(settled)/len(settled), 3) if settled else None, 'file':self.filename}
+        if self.filename:
+            with open(self.filename, 'w') as f:
+                json.dump({'settings':self.settings, 'report':report, 'steps':self.results}, f, indent=2)
+            print('Campaign saved as '+self.filename)
+        self.publish('campaign/done', json.dumps(report))
+        return report
+
+if __name__ == '__main__':
+    # send a sweep to a rig and follow it, e.g.
+    # python campaign.py sweep.json --broker 192.168.0.13 --rig rig1
+    import paho.mqtt.client as mqtt
+    parser=ArgumentParser(description='Run a sweep campaign on the test bench Pi and print the step summaries')
+    parser.add_argument('sweep', help='sweep definition JSON file, see parseSweep()')
+    parser.add_argument('--broker', default='localhost', help='MQTT broker HOST[:PORT]')
+    parser.add_argument('--rig', default='', help='topic namespace of the rig, Rpi_mqtt -n')
+    parser.add_argument('--start', action='store_true', help='send start first and stop when the campaign is done')
+    options=parser.parse_args()
+    with open(options.sweep) as f:
+        definition=json.load(f)
+    steps, settings = parseSweep(definition)
+    print('{} steps, at least {:.0f} s'.format(len(steps), sum(dwell for phi, theta, dwell in steps)))
+    prefix=options.rig.strip('/')+'/' if options.rig else ''
+    host, _, port = options.broker.partition(':')
+    done=[]
+    def on_message(client, userdata, msg):
+        result=json.loads(msg.payload)
+        if msg.topic.endswith('campaign/done'):
+            print(json.dumps(result))
+            done.append(result)
+        else:
+            print('step {step}: phi {phi} theta {theta}  settled {settled} in {settle_s} s  error rms {error_rms}  thrust {thrust_mean}'.format(**result))
+    client=mqtt.Client()
+    client.on_message=on_message
+    client.connect(host, int(port or 1883))
+    client.subscribe(prefix+'campaign/step')
+    client.subscribe(prefix+'campaign/done')
+    client.loop_start()
+    if options.start:
+        client.publish(prefix+'start')
+        time.sleep(1)
+    client.publish(prefix+'campaign', json.dumps(definition))
+    try:
+        while not done:
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        client.publish(prefix+'campaign/stop')
+        time.sleep(0.5)
+    if options.start:
+        client.publish(prefix+'stop')
+        time.sleep(0.5)
+    client.loop_stop()
+    client.disconnect()
@@ -0,0 +1,221 @@
+import json
+import time
+import zlib
+import threading
+
+# Run download from the Pi to the GUI host over MQTT. The GUI asks with
+# 'download' {"run": NAME or "current", "from": CHUNK}; the Pi answers with
+# 'download/chunk' messages, each a JSON header line followed by a zlib
+# compressed JSON list of records (the same records savetofile writes). The
+# header carries the run name, the chunk index, the record count, the crc32 of
+# the compressed data and whether this is the last chunk. The GUI acks with
+# 'download/ack' {"run", "chunk": next chunk it expects}; the Pi keeps at most
+# `window` chunks unacknowledged. A run that is still recording is followed
+# live, only full chunks are sent until it stops.
+
+def encodeChunk(run, index, records, last, level=6):
+    data=zlib.compress(json.dumps(records).encode(), level)
+    header={'run':run, 'chunk':index, 'records':len(records), 'crc':zlib.crc32(data), 'last':last}
+    return json.dumps(header).encode()+b'\n'+data
+
+def isIndex(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value>=0
+
+def decodeChunk(payload):
+    # (header, compressed data), raises ValueError on a malformed header
+    head, _, data = payload.partition(b'\n')
+    header=json.loads(head)
+    try:
+        if not isinstance(header['run'], str) or not isIndex(header['chunk']) or not isIndex(header['crc']):
+            raise ValueError('bad chunk header')
+        header['last']=bool(header['last'])
+    except (KeyError, TypeError) as e:
+        raise ValueError('bad chunk header: '+str(e))
+    return header, data
+
+def parseRequest(payload):
+    # (run, first chunk or None), raises ValueError on anything but
+    # {"run": NAME, "from": CHUNK} with both optional
+    msg=json.loads(payload.decode('utf-8')) if payload else {}
+    if not isinstance(msg, dict):
+        raise ValueError('a download request is a JSON object')
+    run=msg.get('run') or 'current'
+    start=msg.get('from')
+    if not isinstance(run, str) or not (start is None or isIndex(start)):
+        raise ValueError('a download request needs a run name and a chunk index')
+    return run, start
+
+def parseAck(payload):
+    # (run, next chunk), raises ValueError on anything but {"run", "chunk"}
+    msg=json.loads(payload.decode('utf-8'))
+    if not isinstance(msg, dict) or not isinstance(msg.get('run'), str) or not isIndex(msg.get('chunk')):
+        raise ValueError('an ack needs a run name and a chunk index')
+    return msg['run'], msg['chunk']
+
+class RunSender():
+    # Pi side. source(run) returns (name, records, live): the run's record
+    # list, which may still grow while live() is true. One transfer at a time,
+    # a new request replaces the one in progress.
+    def __init__(self, publish, source, chunk=1000, window=8, timeout=5.0, level=6):
+        self.publish=publish
+        self.source=source
+        self.chunk=chunk
+        self.window=window
+        self.timeout=timeout
+        self.level=level
+        self.acked={}
+        self.generation=0
+        self.condition=threading.Condition()
+        self.stats=None
+
+    def request(self, payload):
+        # a malformed request raises ValueError and leaves the transfer in progress
+        run, start = parseRequest(payload)
+        with self.condition:
+            self.generation+=1
+            self.condition.notify_all()
+            generation=self.generation
+        threading.Thread(target=self.send, args=(generation, run, start), daemon=True).start()
+
+    def ack(self, payload):
+        run, chunk = parseAck(payload)
+        with self.condition:
+            if chunk>self.acked.get(run, 0):
+                self.acked[run]=chunk
+                self.condition.notify_all()
+
+    def send(self, generation, run, start):
+        try:
+            name, records, live = self.source(run)
+        except (OSError, ValueError) as e:
+            print('download of '+run+' failed: '+str(e))
+            return
+        with self.condition:
+            # without a start chunk resume after the last acknowledged one
+            index=self.acked.get(name, 0) if start is None else start
+            self.acked[name]=index
+        wall0=time.monotonic()
+        cpu0=time.thread_time()
+        chunks=0
+        size=0
+        settled=not live()
+        while True:
+            running=live()
+            if not running and not settled:
+                # the sensor loops may still append their last records
+                time.sleep(0.5)
+                settled=True
+                continue
+            n=len(records)
+            lo=index*self.chunk
+            hi=min(lo+self.chunk, n)
+            last=not running and hi==n
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.generation!=generation or index-self.acked[name]<self.window, self.timeout):
+                    print('download of '+name+' stalled at chunk '+str(index))
+                    return
+                if self.generation!=generation:
+                    return
+            if hi-lo==self.chunk or last:
+                payload=encodeChunk(name, index, records[lo:hi], last, self.level)
+                self.publish('download/chunk', payload)
+                chunks+=1
+                size+=len(payload)
+                index+=1
+                if last:
+                    break
+            else:
+                time.sleep(0.2)
+        wall=time.monotonic()-wall0
+        cpu=time.thread_time()-cpu0
+        self.stats={'run':name, 'chunks':chunks, 'records':len(records), 'bytes':size, 'seconds':wall, 'cpu_seconds':cpu}
+        print('download of {}: {} chunks, {:.0f} kB in {:.1f} s, {:.0f} kB/s, sender cpu {:.0f}%'.format(
+              name, chunks, size/1000, wall, size/1000/max(wall, 1e-6), 100*cpu/max(wall, 1e-6)))
+
+class RunReceiver():
+    # GUI side. Journals every verified chunk in a runstore.RunStore and acks
+    # it; on a gap, a bad checksum or when chunks stop coming it asks again
+    # from the first missing chunk. progress(text) reports on the receiving thread.
+    def __init__(self, store, publish, progress=None, timeout=10.0, retry=1.0):
+        self.store=store
+        self.publish=publish
+        self.progress=progress or (lambda text: None)
+        self.timeout=timeout
+        self.retry=retry
+        self.run=None
+        self.active=False
+        self.expected=0
+        self.received=0
+        self.bytes=0
+        self.started=0.0
+        self.lastChunk=0.0
+        self.lastRequest=0.0
+        self.lock=threading.Lock()
+
+    def request(self, run='current'):
+        # the Pi names the run in its first chunk; for a run with chunks in the
+        # journal the receiver then asks again from where it stopped
+        with self.lock:
+            self.run=None if run=='current' else run
+            self.active=True
+            self.received=0
+            self.bytes=0
+            self.started=self.lastChunk=self.lastRequest=time.monotonic()
+            msg={'run':run}
+            if self.run is not None:
+                self.expected=self.store.chunks(run)
+                msg['from']=self.expected
+        self.publish('download', json.dumps(msg))
+        self.progress('requested '+run)
+
+    def resend(self, now):
+        if now-self.lastRequest>=self.retry:
+            self.lastRequest=now
+            self.publish('download', json.dumps({'run':self.run, 'from':self.expected}))
+
+    def receive(self, payload):
+        now=time.monotonic()
+        try:
+            header, data = decodeChunk(payload)
+        except ValueError:
+            return
+        with self.lock:
+            if not self.active:
+                return
+            if self.run is None:
+                self.run=header['run']
+                if self.store.finished(self.run):
+                    self.active=False
+                    self.progress(self.run+' already downloaded')
+                    return
+                self.expected=self.store.chunks(self.run)
+            if header['run']!=self.run:
+                return
+            self.lastChunk=now
+            if header['chunk']!=self.expected or zlib.crc32(data)!=header['crc']:
+                self.resend(now)
+                return
+            self.store.append(self.run, self.expected, data)
+            self.expected+=1
+            self.received+=1
+            self.bytes+=len(payload)
+            self.publish('download/ack', json.dumps({'run':self.run, 'chunk':self.expected}))
+            rate=self.bytes/1000/max(now-self.started, 1e-6)
+            if header['last']:
+                self.active=False
+                path=self.store.finish(self.run)
+                self.progress('{} saved as {} ({:.0f} kB/s)'.format(self.run, path, rate))
+            else:
+                self.progress('{}: chunk {} ({:.0f} kB/s)'.format(self.run, self.expected, rate))
+
+    def check(self):
+        # call now and then, asks again when an active download has stalled
+        now=time.monotonic()
+        with self.lock:
+            if self.active and now-self.lastChunk>self.timeout:
+                self.lastChunk=now
+                if self.run is None:
+                    self.publish('download', json.dumps({'run':'current'}))
+                    self.lastRequest=now
+                else:
+                    self.resend(now)
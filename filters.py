@@ -0,0 +1,182 @@
+import numpy as np
+from bisect import insort, bisect_left
+from collections import deque
+
+# Streaming block filters for multichannel data. Every stage takes a block of
+# shape (samples, channels), keeps whatever history it needs between calls and
+# returns the filtered block, so data can be pushed through in any chunk size.
+# History starts out as copies of the first sample to avoid a startup transient.
+
+def _history(history, block, length):
+    if history is None:
+        return np.repeat(block[:1], length, axis=0)
+    return history
+
+class MovingAverage():
+    def __init__(self, length, channels):
+        self.length=length
+        self.history=None
+
+    def process(self, block):
+        if len(block)==0:
+            return block
+        x=np.concatenate((_history(self.history, block, self.length-1), block))
+        c=np.cumsum(x, axis=0)
+        c=np.concatenate((np.zeros((1, x.shape[1])), c))
+        self.history=x[len(x)-(self.length-1):] if self.length>1 else x[:0]
+        return (c[self.length:]-c[:-self.length])/self.length
+
+class Decimator():
+    def __init__(self, factor, phase=0):
+        self.factor=factor
+        self.phase=phase # samples to skip before the next kept one
+
+    def process(self, block):
+        out=block[self.phase::self.factor]
+        self.phase=(self.phase-len(block)) % self.factor
+        return out
+
+class CIC():
+    # CIC decimator in its non-recursive form (order cascaded boxcars of length
+    # decimation, then downsampling). Same response as integrator/comb stages
+    # but no integrator growth, so it is safe on float data of any run length.
+    def __init__(self, decimation, order, channels):
+        self.stages=[MovingAverage(decimation, channels) for i in range(order)]
+        self.decimator=Decimator(decimation, decimation-1)
+
+    def process(self, block):
+        for stage in self.stages:
+            block=stage.process(block)
+        return self.decimator.process(block)
+
+class FIR():
+    # FIR filter that only evaluates the outputs that survive decimation
+    def __init__(self, taps, channels, decimation=1):
+        self.taps=np.asarray(taps, dtype=float)[::-1]
+        self.history=None
+        self.decimator=Decimator(decimation, decimation-1)
+
+    def process(self, block):
+        if len(block)==0:
+            return block
+        x=np.concatenate((_history(self.history, block, len(self.taps)-1), block))
+        self.history=x[len(x)-(len(self.taps)-1):] if len(self.taps)>1 else x[:0]
+        windows=np.lib.stride_tricks.sliding_window_view(x, len(self.taps), axis=0)
+        windows=self.decimator.process(windows)
+        return windows@self.taps
+
+def _median(s):
+    n=len(s)
+    return s[n//2] if n % 2 else (s[n//2-1]+s[n//2])/2
+
+def _kth(s, p, m, k):
+    # k-th smallest (from 0) of |x-m| over the sorted list s, s[:p] below m.
+    # The distances on either side of m are two ascending runs, so this is the
+    # k-th of two sorted arrays: a binary search over how many come from the left
+    left=lambda i: m-s[p-1-i]
+    right=lambda i: s[p+i]-m
+    lo=max(0, k+1-(len(s)-p))
+    hi=min(k+1, p)
+    while lo<hi:
+        a=(lo+hi)//2
+        if left(a)<right(k-a):
+            lo=a+1
+        else:
+            hi=a
+    b=k+1-lo
+    return max(left(lo-1) if lo else -np.inf, right(b-1) if b else -np.inf)
+
+def _mad(s, m):
+    # median absolute deviation from m, O(log n) on the sorted window
+    n=len(s)
+    p=bisect_left(s, m)
+    if n % 2:
+        return _kth(s, p, m, n//2)
+    return (_kth(s, p, m, n//2-1)+_kth(s, p, m, n//2))/2
+
+class Hampel():
+    # Streaming spike rejection: a sample further than threshold MADs (scaled
+    # to a standard deviation, at least floor) from the median of the previous
+    # length samples is replaced by that median and counted in rejected. Every
+    # channel keeps its window sorted, so median and MAD are O(log n) lookups.
+    # Rejected samples still enter the window, a real step gets through after
+    # about length/2 samples. The test sample is not part of the window, so
+    # short windows replace clean samples too: about 1% of Gaussian noise
+    # with 15 samples and threshold 4, 9% with 7 and threshold 3.
+    def __init__(self, length, channels, threshold=4.0, floor=0.02):
+        self.length=length
+        self.threshold=threshold
+        self.floor=floor
+        self.windows=[deque() for i in range(channels)]
+        self.sorted=[[] for i in range(channels)]
+        self.rejected=np.zeros(channels, dtype=np.int64)
+
+    def process(self, block):
+        out=np.array(block, dtype=float)
+        for c in range(out.shape[1]):
+            window=self.windows[c]
+            s=self.sorted[c]
+            column=out[:,c]
+            for i, x in enumerate(column.tolist()):
+                if len(s)>=3:
+                    m=_median(s)
+                    if abs(x-m)>self.threshold*max(1.4826*_mad(s, m), self.floor):
+                        column[i]=m
+                        self.rejected[c]+=1
+                insort(s, x)
+                window.append(x)
+                if len(window)>self.length:
+                    del s[bisect_left(s, window.popleft())]
+        return out
+
+def lowpass(cutoff, numtaps):
+    # windowed-sinc low-pass design, cutoff as a fraction of the sample rate (0 to 0.5)
+    n=np.arange(numtaps)-(numtaps-1)/2
+    h=2*cutoff*np.sinc(2*cutoff*n)*np.hamming(numtaps)
+    return h/h.sum()
+
+class FilterPipeline():
+    # filter  'mean' : moving average of length decimation (old get_weight_mean behaviour)
+    #         'cic'  : CIC decimator of the given order
+    #         'fir'  : windowed-sinc low-pass at 0.8*Nyquist of the output rate
+    #         'none' : plain decimation
+    # despike N puts a Hampel stage over N samples in front of the filter, 0 is off
+    def __init__(self, filter='mean', decimation=2, channels=4, order=3, taps=None, despike=0, threshold=4.0):
+        self.filter=filter
+        self.decimation=max(int(decimation),1)
+        self.channels=channels
+        self.order=order
+        self.taps=taps
+        self.despike=int(despike or 0)
+        self.threshold=threshold
+        self.reset()
+
+    def reset(self):
+        R=self.decimation
+        if self.filter=='mean':
+            self.stages=[MovingAverage(R, self.channels), Decimator(R, R-1)]
+        elif self.filter=='cic':
+            self.stages=[CIC(R, self.order, self.channels)]
+        elif self.filter=='fir':
+            numtaps=self.taps or 8*R+1
+            self.stages=[FIR(lowpass(0.4/R, numtaps), self.channels, R)]
+        elif self.filter=='none':
+            self.stages=[Decimator(R, R-1)]
+        else:
+            raise ValueError('unknown filter '+str(self.filter))
+        if self.despike:
+            self.stages.insert(0, Hampel(self.despike, self.channels, self.threshold))
+
+    def process(self, block):
+        block=np.asarray(block, dtype=float).reshape(-1, self.channels)
+        for stage in self.stages:
+            block=stage.process(block)
+        return block
+
+    def rejected(self):
+        # spikes replaced per channel since the last reset
+        return self.stages[0].rejected.tolist() if self.despike else [0]*self.channels
+
+    def config(self):
+        return {'filter':self.filter, 'decimation':self.decimation, 'order':self.order, 'taps':self.taps,
+                'despike':self.despike, 'threshold':self.threshold}
@@ -0,0 +1,102 @@
+import time
+import math
+import numpy as np
+from argparse import ArgumentParser
+from ringbuffer import RingBuffer, BulkWriter
+
+# raw IMU sample as stored on disk: time in seconds, gyro in rad/s, accel in g
+IMU_DTYPE=np.dtype([('time','f8'),('gx','f4'),('gy','f4'),('gz','f4'),('ax','f4'),('ay','f4'),('az','f4')])
+
+class ImuCapture():
+    def __init__(self, seconds=10):
+        self.seconds=seconds # ring buffer length at the configured sample rate
+        self.active=False
+        self.ring=None
+        self.writer=None
+        self.filename=None
+
+    def start(self, poll_interval, filename=None):
+        # poll_interval comes from imu.IMUGetPollInterval() and follows the sample rate in RTIMULib.ini
+        if self.active:
+            return
+        rate=1000.0/max(poll_interval,1)
+        self.ring=RingBuffer(max(int(self.seconds*rate),1024), IMU_DTYPE)
+        if filename is None:
+            filename='logs/'+time.strftime('%Y_%m_%d-%H_%M_%S')+'_imu.bin'
+        self.filename=filename
+        self.writer=BulkWriter(self.ring, filename, chunk=max(int(rate),256))
+        self.writer.start()
+        self.active=True
+        print('IMU capture started at '+str(round(rate))+' Hz')
+
+    def add(self, data):
+        # data is the dict returned by imu.getIMUData(), timestamp in microseconds
+        gx, gy, gz = data['gyro']
+        ax, ay, az = data['accel']
+        self.ring.append((data['timestamp']*1e-6, gx, gy, gz, ax, ay, az))
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active=False
+        self.writer.stop()
+        print('IMU capture saved as '+self.filename+' ('+str(self.writer.written)+' samples, '+str(self.ring.dropped)+' dropped)')
+
+def load(filename):
+    return np.fromfile(filename, dtype=IMU_DTYPE)
+
+def _iir(u, a, y0, block):
+    # y[k] = a*y[k-1] + u[k], evaluated one block at a time with cumulative sums.
+    # The block length keeps a**-block small enough for float64.
+    y=np.empty(len(u))
+    if a<=0:
+        y[:]=u
+        return y
+    if a<1:
+        block=max(1, min(block, int(12*math.log(10)/-math.log(a))))
+    powers=a**np.arange(1, block+1)
+    prev=y0
+    for start in range(0, len(u), block):
+        seg=u[start:start+block]
+        p=powers[:len(seg)]
+        y[start:start+len(seg)]=p*(prev+np.cumsum(seg/p))
+        prev=y[start+len(seg)-1]
+    return y
+
+def fuse(samples, alpha=0.98, gyro_bias=(0.0,0.0,0.0), block=256):
+    # offline complementary filter over raw samples, returns phi (roll) and theta (pitch) in degrees
+    # like the live fusion in Rpi_mqtt.startIMU
+    t=samples['time'].astype(np.float64)
+    dt=np.diff(t, prepend=t[0] if len(t) else 0.0)
+    gx=samples['gx']-gyro_bias[0]
+    gy=samples['gy']-gyro_bias[1]
+    ax=samples['ax'].astype(np.float64)
+    ay=samples['ay'].astype(np.float64)
+    az=samples['az'].astype(np.float64)
+    acc_roll=np.arctan2(ay, az)
+    acc_pitch=np.arctan2(-ax, np.hypot(ay, az))
+    out=np.zeros(len(t), dtype=[('time','f8'),('phi','f8'),('theta','f8')])
+    out['time']=t
+    if len(t)==0:
+        return out
+    roll=_iir(alpha*gx*dt+(1-alpha)*acc_roll, alpha, acc_roll[0], block)
+    pitch=_iir(alpha*gy*dt+(1-alpha)*acc_pitch, alpha, acc_pitch[0], block)
+    out['phi']=np.degrees(roll)
+    out['theta']=np.degrees(pitch)
+    return out
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Recompute attitude from a raw IMU capture')
+    parser.add_argument('capture', help='raw capture file written in capture mode (logs/*_imu.bin)')
+    parser.add_argument('--alpha', '-a', type=float, default=0.98, help='complementary filter gyro weight')
+    parser.add_argument('--bias', '-b', type=float, nargs=3, default=(0.0,0.0,0.0), help='gyro bias x y z in rad/s')
+    parser.add_argument('--output', '-o', help='csv output, defaults to the capture name with .csv')
+    options=parser.parse_args()
+
+    samples=load(options.capture)
+    start=time.perf_counter()
+    fused=fuse(samples, options.alpha, options.bias)
+    elapsed=time.perf_counter()-start
+    output=options.output or options.capture.rsplit('.',1)[0]+'.csv'
+    np.savetxt(output, np.column_stack((fused['time'], fused['phi'], fused['theta'])), delimiter=',', header='time,phi,theta', comments='')
+    print(str(len(samples))+' samples fused in '+str(round(elapsed*1000,1))+' ms, saved as '+output)
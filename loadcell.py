@@ -1,7 +1,114 @@
 import RPi.GPIO as GPIO  # import GPIO
 from hx711 import HX711  # import the class HX711
 
+import os
 import time
+import threading
+import numpy as np
+from collections import deque
+
+# full rate loadcell sample as stored on disk, forces in N
+LOADCELL_DTYPE=np.dtype([('time','f8'),('motor1','f4'),('motor2','f4'),('motor3','f4'),('motor4','f4')])
+
+# the four HX711 data outputs and their shared clock
+DOUT_PINS=(6, 13, 19, 26)
+SCK_PIN=5
+# conversions per second the boards are wired for, RATE high is 80, low 10
+HX711_RATE=80
+
+def records(times, values):
+    rows=np.empty(len(times), dtype=LOADCELL_DTYPE)
+    rows['time']=times
+    for i in range(4):
+        rows['motor'+str(i+1)]=values[:,i]
+    return rows
+
+class DataReady():
+    # Interrupt driven HX711 reading. DOUT goes low when a conversion is ready;
+    # a falling edge marks that channel ready and nothing polls in between. The
+    # chips share the clock pin, so clocking one out clocks out all of them:
+    # once every channel is ready the 24 bits of all four are read in one pass,
+    # on the GPIO event thread, into one buffer per channel. While idle the
+    # edges are ignored and the chips just keep converting.
+    def __init__(self, gpio, douts=DOUT_PINS, sck=SCK_PIN, size=1024, gainPulses=1):
+        self.gpio=gpio
+        self.douts=douts
+        self.sck=sck
+        # 1 extra pulse selects channel A, gain 128 for the next conversion
+        self.gainPulses=gainPulses
+        self.index={pin: i for i, pin in enumerate(douts)}
+        self.ready=[False]*len(douts)
+        self.buffers=[deque(maxlen=size) for pin in douts]
+        self.condition=threading.Condition()
+        self.active=False
+        self.edges=0
+        self.reads=0
+        gpio.setup(sck, gpio.OUT)
+        gpio.output(sck, 0)
+        for pin in douts:
+            gpio.setup(pin, gpio.IN)
+            # a forked process inherits the parent's registration
+            gpio.remove_event_detect(pin)
+            gpio.add_event_detect(pin, gpio.FALLING, callback=self.edge)
+
+    def edge(self, pin):
+        self.edges+=1
+        with self.condition:
+            # DOUT also falls while data bits are clocked out, only a line that
+            # is still low after the read is a new conversion
+            if not self.active or self.gpio.input(pin):
+                return
+            self.ready[self.index[pin]]=True
+            if all(self.ready):
+                self.read()
+
+    def read(self):
+        gpio=self.gpio
+        douts=self.douts
+        sck=self.sck
+        values=[0]*len(douts)
+        for bit in range(24):
+            gpio.output(sck, 1)
+            gpio.output(sck, 0)
+            for i, pin in enumerate(douts):
+                values[i]=(values[i]<<1) | gpio.input(pin)
+        for pulse in range(self.gainPulses):
+            gpio.output(sck, 1)
+            gpio.output(sck, 0)
+        now=time.time()
+        for i, value in enumerate(values):
+            # 24 bit two's complement
+            self.buffers[i].append((now, value-(1<<24) if value & 0x800000 else value))
+        self.ready=[False]*len(douts)
+        self.reads+=1
+        self.condition.notify_all()
+
+    def start(self):
+        with self.condition:
+            if self.active:
+                return
+            self.active=True
+            # a channel that became ready while idle has no edge left to send
+            self.ready=[not self.gpio.input(pin) for pin in self.douts]
+            if all(self.ready):
+                self.read()
+
+    def stop(self):
+        with self.condition:
+            self.active=False
+            for buffer in self.buffers:
+                buffer.clear()
+
+    def take(self, n, timeout=1.0):
+        # n samples of every channel as (times, (n, channels) raw counts),
+        # fewer if a channel stays silent for timeout seconds
+        with self.condition:
+            self.condition.wait_for(lambda: min(len(b) for b in self.buffers)>=n, timeout)
+            n=min(n, min(len(b) for b in self.buffers))
+            rows=[[b.popleft() for i in range(n)] for b in self.buffers]
+        times=np.array([t for t, v in rows[0]], dtype=np.float64)
+        raw=np.array([[v for t, v in row] for row in rows], dtype=np.float64).T.reshape(n, len(self.douts))
+        return times, raw
 
 class loadcell():
     def __init__(self):
@@ -23,35 +130,94 @@ class loadcell():
         self.hx4.set_scale_ratio(self.ratio4)
 
         self.g= 9.81
+        self.rate=HX711_RATE
+        # -i: DOUT edge interrupts instead of the library's polling reads,
+        # with offsets and ratios applied here
+        self.interrupts=False
+        self.sampler=None
+        self.samplerPid=None
+        self.ratios=np.array([self.ratio1, self.ratio2, self.ratio3, self.ratio4], dtype=np.float64)
+        self.offsets=np.zeros(4)
         print('loadcell init complete')
 
+    def enableInterrupts(self):
+        self.interrupts=True
+
+    def dataReady(self):
+        # started in the process that reads, edge detection does not survive a fork
+        if self.samplerPid!=os.getpid():
+            self.sampler=DataReady(GPIO)
+            self.samplerPid=os.getpid()
+        return self.sampler
+
+    def idle(self):
+        # streaming stopped, stop reading conversions
+        if self.sampler is not None and self.samplerPid==os.getpid():
+            self.sampler.stop()
+
+    def sample(self, n):
+        # n raw readings per channel for tare and weigh, (n, 4)
+        sampler=self.dataReady()
+        streaming=sampler.active
+        sampler.start()
+        times, raw = sampler.take(n)
+        if not streaming:
+            sampler.stop()
+        return raw
+
     def tare(self):
+        if self.interrupts:
+            self.offsets=self.sample(30).mean(axis=0)
+            print('tare complete')
+            return
         self.err1 = self.hx1.zero()
         self.err2 = self.hx2.zero()
         self.err3 = self.hx3.zero()
         self.err4 = self.hx4.zero()
         print('tare complete')
 
-    def weigh(self):
+    def weigh(self, readings=5, rounds=5):
+        if self.interrupts:
+            raw=self.sample(readings*rounds)
+            self.weight=round(float(((raw-self.offsets)/self.ratios).mean(axis=0).sum())*self.g,2)
+            return self.weight
         lc1=[]
         lc2=[]
         lc3=[]
         lc4=[]
-        for i in range(5):
-            loadcell1=self.hx1.get_weight_mean(5)
+        for i in range(rounds):
+            loadcell1=self.hx1.get_weight_mean(readings)
             lc1.append(loadcell1)
-            loadcell2=self.hx2.get_weight_mean(5)
+            loadcell2=self.hx2.get_weight_mean(readings)
             lc2.append(loadcell2)
-            loadcell3=self.hx3.get_weight_mean(5)
+            loadcell3=self.hx3.get_weight_mean(readings)
             lc3.append(loadcell3)
-            loadcell4=self.hx4.get_weight_mean(5)
+            loadcell4=self.hx4.get_weight_mean(readings)
             lc4.append(loadcell4)
         self.weight= round(((sum(lc1)/len(lc1)) +(sum(lc2)/len(lc2)) + (sum(lc3)/len(lc3)) + (sum(lc4)/len(lc4)))*self.g,2)
         return self.weight
 
-    def measure(self):
-        self.loadcell1=self.hx1.get_weight_mean(2)*self.g
-        self.loadcell2=self.hx2.get_weight_mean(2)*self.g
-        self.loadcell3=self.hx3.get_weight_mean(2)*self.g
-        self.loadcell4=self.hx4.get_weight_mean(2)*self.g
-        return round(self.loadcell1,2), round(self.loadcell2,2),round(self.loadcell3,2), round(self.loadcell4,2)
\ No newline at end of file
+    def measure(self, readings=2):
+        self.loadcell1=self.hx1.get_weight_mean(readings)*self.g
+        self.loadcell2=self.hx2.get_weight_mean(readings)*self.g
+        self.loadcell3=self.hx3.get_weight_mean(readings)*self.g
+        self.loadcell4=self.hx4.get_weight_mean(readings)*self.g
+        return round(self.loadcell1,2), round(self.loadcell2,2),round(self.loadcell3,2), round(self.loadcell4,2)
+
+    def read_block(self, n, t0=0.0):
+        # n single conversions per channel at full rate, unrounded, in N
+        # returns the sample times (seconds since t0) and an (n, 4) array
+        if self.interrupts:
+            sampler=self.dataReady()
+            sampler.start()
+            times, raw = sampler.take(n)
+            return times-t0, (raw-self.offsets)/self.ratios*self.g
+        times=np.empty(n)
+        values=np.empty((n,4))
+        for i in range(n):
+            values[i,0]=self.hx1.get_weight_mean(1)
+            values[i,1]=self.hx2.get_weight_mean(1)
+            values[i,2]=self.hx3.get_weight_mean(1)
+            values[i,3]=self.hx4.get_weight_mean(1)
+            times[i]=time.time()-t0
+        return times, values*self.g
\ No newline at end of file
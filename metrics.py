@@ -0,0 +1,105 @@
+import json
+import time
+import math
+from collections import deque
+
+# Rolling bench metrics computed on the Pi (Rpi_mqtt 'metrics'). Every
+# loadcell sample updates a window per motor and one for the total thrust in
+# constant time: mean and variance with Welford's update for a sliding window,
+# min and max with monotonic queues. A few times a second the statistics and
+# the thrust-to-weight ratio against the last weigh() are published as one
+# JSON message, so the GUI shows them without keeping any history.
+
+CHANNELS=('motor1','motor2','motor3','motor4','thrust')
+
+class RollingWindow():
+    # statistics of the last `length` values of one channel
+    def __init__(self, length):
+        self.length=length
+        self.values=deque()
+        self.count=0
+        self.mean=0.0
+        self.m2=0.0
+        # (sample number, value), values decreasing in maxima, increasing in minima
+        self.maxima=deque()
+        self.minima=deque()
+
+    def add(self, x):
+        self.values.append(x)
+        n=len(self.values)
+        if n>self.length:
+            old=self.values.popleft()
+            n-=1
+            mean=self.mean
+            self.mean+=(x-old)/n
+            self.m2+=(x-old)*(x-self.mean+old-mean)
+        else:
+            delta=x-self.mean
+            self.mean+=delta/n
+            self.m2+=delta*(x-self.mean)
+        i=self.count
+        self.count+=1
+        while self.maxima and self.maxima[-1][1]<=x:
+            self.maxima.pop()
+        self.maxima.append((i, x))
+        if self.maxima[0][0]<=i-self.length:
+            self.maxima.popleft()
+        while self.minima and self.minima[-1][1]>=x:
+            self.minima.pop()
+        self.minima.append((i, x))
+        if self.minima[0][0]<=i-self.length:
+            self.minima.popleft()
+
+    def variance(self):
+        n=len(self.values)
+        return max(self.m2, 0.0)/n if n else 0.0
+
+    def stats(self):
+        if not self.values:
+            return None
+        return {'mean':round(self.mean, 3), 'std':round(math.sqrt(self.variance()), 3),
+                'min':round(self.minima[0][1], 3), 'max':round(self.maxima[0][1], 3)}
+
+class Metrics():
+    # publish(topic, payload) sends the metrics; window is in loadcell samples
+    # as published, interval the seconds between two messages and counters()
+    # adds its dict to every message
+    def __init__(self, publish, window=200, interval=0.5, counters=None):
+        self.publish=publish
+        self.window=window
+        self.interval=interval
+        self.counters=counters
+        self.weight=None
+        self.reset()
+
+    def reset(self):
+        # a new run starts from empty windows, the weight stays
+        self.windows={channel: RollingWindow(self.window) for channel in CHANNELS}
+        self.samples=0
+        self.last=0.0
+
+    def setWeight(self, weight):
+        # weigh() result in N, the reference for the thrust-to-weight ratio
+        try:
+            self.weight=float(weight)
+        except (TypeError, ValueError):
+            self.weight=None
+
+    def add(self, row):
+        # one loadcell sample (motor1..motor4, thrust)
+        for window, x in zip(self.windows.values(), row):
+            window.add(x)
+        self.samples+=1
+        now=time.monotonic()
+        if now-self.last>=self.interval:
+            self.last=now
+            self.publish('metrics', json.dumps(self.snapshot()))
+
+    def snapshot(self):
+        out={channel: window.stats() for channel, window in self.windows.items()}
+        out['samples']=self.samples
+        thrust=self.windows['thrust']
+        out['ratio']=round(thrust.mean/self.weight, 3) if self.weight and thrust.values else None
+        if self.counters is not None:
+            out.update(self.counters())
+        return out
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import platform
+import numpy as np
+import pandas as pd
+from argparse import ArgumentParser
+from campaign import SETTINGS, span
+
+# Faster than real time tuning of pidroll/pidpitch (Rpi_mqtt angle mode) on a
+# model of the tilting platform. In angle mode the IMU loop calls the PID every
+# iteration, the PID updates once sample_time has passed, its output is
+# rounded to a whole degree, clipped to the servo table and looked up there, so
+# the servos drive the platform to that attitude. The model: servos that move
+# at a limited rate, a platform that follows them as a damped second order
+# system and an IMU fusion estimate that lags behind. Thousands of gain
+# combinations are simulated at once as arrays, scored on overshoot, settling
+# time and steady state error, and the best ones rerun through simple_pid
+# itself to check the array version. The plant parameters are guesses until
+# they are measured on the bench, e.g. from a campaign step's settle time.
+
+PLANT={'rate':220.0, 'slew':300.0, 'frequency':3.0, 'damping':0.3, 'lag':0.02}
+
+def tableLimits(path):
+    # PID output limits Rpi_mqtt sets from the servo table: (phi range, theta range)
+    df=pd.read_csv(path)
+    return (float(df['phi'].min()), float(df['phi'].max())), (float(df['theta'].min()), float(df['theta'].max()))
+
+def gainGrid(kp, ki, kd):
+    # every combination of the [START, STOP, STEP] ranges, as flat arrays
+    grid=np.meshgrid(span(*kp), span(*ki), span(*kd), indexing='ij')
+    return [g.ravel() for g in grid]
+
+class Platform():
+    # n independent platforms, all starting level and at rest
+    def __init__(self, n, plant, substeps=4):
+        self.plant=plant
+        self.substeps=substeps
+        self.servo=np.zeros(n)
+        self.attitude=np.zeros(n)
+        self.velocity=np.zeros(n)
+        self.measured=np.zeros(n)
+
+    def advance(self, command, dt):
+        w=2*np.pi*self.plant['frequency']
+        h=dt/self.substeps
+        for i in range(self.substeps):
+            self.servo+=np.clip(command-self.servo, -self.plant['slew']*h, self.plant['slew']*h)
+            self.velocity+=(w*w*(self.servo-self.attitude)-2*self.plant['damping']*w*self.velocity)*h
+            self.attitude+=self.velocity*h
+        self.measured+=(self.attitude-self.measured)*min(dt/self.plant['lag'], 1.0)
+        return self.measured
+
+class ArrayPID():
+    # simple_pid.PID with arrays of gains: proportional on error, derivative on
+    # measurement, integral and output clamped to the output limits
+    def __init__(self, kp, ki, kd, setpoint, limits):
+        self.kp=kp
+        self.ki=ki
+        self.kd=kd
+        self.setpoint=setpoint
+        self.limits=limits
+        self.integral=np.zeros(len(kp))
+        self.lastInput=None
+
+    def __call__(self, measured, dt):
+        error=self.setpoint-measured
+        dinput=measured-self.lastInput if self.lastInput is not None else 0.0
+        self.integral=np.clip(self.integral+self.ki*error*dt, *self.limits)
+        self.lastInput=measured.copy()
+        return np.clip(self.kp*error+self.integral-self.kd*dinput/dt, *self.limits)
+
+def simulate(controller, n, step, limits, plant, duration, sample_time=0.01):
+    # step response from level to `step` degrees; controller(measured, dt)
+    # returns the PID outputs. Returns (times, measured attitude (n, samples))
+    dt=1.0/plant['rate']
+    samples=int(round(duration*plant['rate']))
+    platform=Platform(n, plant)
+    out=np.empty((n, samples))
+    command=np.zeros(n)
+    elapsed=None
+    for k in range(samples):
+        measured=platform.measured
+        # like simple_pid in real time: the first call and then once sample_time has passed
+        if elapsed is None or elapsed>=sample_time:
+            command=np.clip(np.round(controller(measured, elapsed or sample_time)), *limits)
+            elapsed=0.0
+        out[:,k]=measured
+        platform.advance(command, dt)
+        elapsed+=dt
+    return np.arange(samples)*dt, out
+
+def score(t, y, step, tolerance, hold):
+    # overshoot %, settling time (inside tolerance from then on, and for at
+    # least hold seconds; inf if not), steady state error over the last hold
+    # seconds and integral of the absolute error
+    dt=t[1]-t[0]
+    error=step-y
+    overshoot=np.maximum(0.0, y*np.sign(step)/abs(step)-1).max(axis=1)*100
+    outside=np.abs(error)>tolerance
+    last=outside.shape[1]-1-np.argmax(outside[:,::-1], axis=1)
+    tail=max(1, int(round(hold/dt)))
+    settled=~outside[:,-tail:].any(axis=1)
+    settling=np.where(settled, t[np.minimum(last+1, len(t)-1)], np.inf)
+    steady=np.abs(error[:,-tail:].mean(axis=1))
+    iae=np.abs(error).sum(axis=1)*dt
+    return {'overshoot':overshoot, 'settling':settling, 'steady':steady, 'iae':iae}
+
+def rank(scores, max_overshoot):
+    # settled within the overshoot limit first, fastest settling, then least
+    # integrated error; the rest after them by integrated error
+    ok=np.isfinite(scores['settling']) & (scores['overshoot']<=max_overshoot)
+    return np.lexsort((scores['iae'], np.where(ok, scores['settling'], np.inf), ~ok)), int(ok.sum())
+
+def verify(gains, step, limits, plant, duration, sample_time):
+    # the same step responses with simple_pid.PID, as Rpi_mqtt runs it
+    from simple_pid import PID
+    pids=[PID(kp, ki, kd, setpoint=step, sample_time=sample_time, output_limits=limits) for kp, ki, kd in gains]
+    controller=lambda measured, dt: np.array([pid(m, dt=dt) for pid, m in zip(pids, measured)])
+    return simulate(controller, len(pids), step, limits, plant, duration, sample_time)
+
+def tune(kp, ki, kd, limits, options, plant):
+    wall0=time.perf_counter()
+    t, y = simulate(ArrayPID(kp, ki, kd, options.step, limits), len(kp), options.step, limits, plant, options.duration, options.sample_time)
+    scores=score(t, y, options.step, options.tolerance, options.hold)
+    wall=time.perf_counter()-wall0
+    order, good = rank(scores, options.overshoot)
+    best=order[:options.top]
+    rows=[{'kp':round(float(kp[i]), 6), 'ki':round(float(ki[i]), 6), 'kd':round(float(kd[i]), 6),
+           'overshoot':round(float(scores['overshoot'][i]), 2), 'settling':round(float(scores['settling'][i]), 3) if np.isfinite(scores['settling'][i]) else None,
+           'steady':round(float(scores['steady'][i]), 3), 'iae':round(float(scores['iae'][i]), 3)} for i in best]
+    # the gains Rpi_mqtt runs now, for comparison
+    t1, y1 = simulate(ArrayPID(*[np.array([g]) for g in options.compare], options.step, limits), 1, options.step, limits, plant, options.duration, options.sample_time)
+    current={key: float(value[0]) if np.isfinite(value[0]) else None for key, value in score(t1, y1, options.step, options.tolerance, options.hold).items()}
+    check=None
+    if options.verify:
+        n=min(options.verify, len(best))
+        gains=[(kp[i], ki[i], kd[i]) for i in best[:n]]
+        t2, y2 = verify(gains, options.step, limits, plant, options.duration, options.sample_time)
+        check=float(np.abs(y2-y[best[:n]]).max())
+    return {'limits':limits, 'candidates':len(kp), 'acceptable':good, 'seconds':wall, 'simple_pid_max_difference':check,
+            'current':current, 'best':rows}
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Grid search pidroll/pidpitch gains on a simulated platform, faster than real time')
+    parser.add_argument('--kp', type=float, nargs=3, default=[0, 2, 0.1], metavar=('START','STOP','STEP'), help='proportional gains')
+    parser.add_argument('--ki', type=float, nargs=3, default=[0, 20, 1], metavar=('START','STOP','STEP'), help='integral gains')
+    parser.add_argument('--kd', type=float, nargs=3, default=[0, 0.05, 0.005], metavar=('START','STOP','STEP'), help='derivative gains')
+    parser.add_argument('--step', type=float, default=10, help='setpoint step in degrees')
+    parser.add_argument('--duration', type=float, default=5, help='simulated seconds per step response')
+    parser.add_argument('--tolerance', type=float, default=SETTINGS['tolerance'], help='settled band in degrees, as campaign.py')
+    parser.add_argument('--hold', type=float, default=SETTINGS['hold'], help='seconds inside the band that count as settled, as campaign.py')
+    parser.add_argument('--overshoot', type=float, default=10, help='largest acceptable overshoot in percent')
+    parser.add_argument('--sample-time', type=float, default=0.01, help='PID sample_time, simple_pid default')
+    parser.add_argument('--compare', type=float, nargs=3, default=[0.5, 0.02, 0.001], metavar=('KP','KI','KD'), help='gains to compare with, Rpi_mqtt\'s')
+    parser.add_argument('--table', default='database3.csv', help='servo table, gives the PID output limits')
+    parser.add_argument('--limits', type=float, nargs=2, default=[-30, 30], help='output limits when the servo table is not there')
+    for key, value in PLANT.items():
+        parser.add_argument('--'+key, type=float, default=value, help='plant: '+{'rate':'IMU loop rate in Hz', 'slew':'servo rate in degrees per second',
+                            'frequency':'platform natural frequency in Hz', 'damping':'platform damping ratio', 'lag':'IMU fusion time constant in seconds'}[key])
+    parser.add_argument('--top', type=int, default=10, help='candidates to list')
+    parser.add_argument('--verify', type=int, default=3, help='best candidates to rerun through simple_pid, 0 to skip')
+    parser.add_argument('--output', '-o', default='pidtune.json', help='report file')
+    options=parser.parse_args()
+    plant={key: getattr(options, key) for key in PLANT}
+    if os.path.exists(options.table):
+        axes=dict(zip(('pidpitch','pidroll'), tableLimits(options.table)))
+    else:
+        print(options.table+' not found, output limits '+str(options.limits))
+        axes={'pidpitch':tuple(options.limits), 'pidroll':tuple(options.limits)}
+    kp, ki, kd = gainGrid(options.kp, options.ki, options.kd)
+    report={'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'platform':platform.platform(), 'python':platform.python_version(),
+            'plant':plant, 'settings':{key: getattr(options, key) for key in ('step','duration','tolerance','hold','overshoot','sample_time')}}
+    for name, limits in axes.items():
+        result=tune(kp, ki, kd, limits, options, plant)
+        report[name]=result
+        print('{}: {} gain combinations, {:.0f} simulated seconds in {:.2f} s, {} settled with at most {:g}% overshoot'.format(
+              name, result['candidates'], result['candidates']*options.duration, result['seconds'], result['acceptable'], options.overshoot))
+        print(f'{"kp":>7}  {"ki":>7}  {"kd":>7}  {"overshoot %":>11}  {"settling s":>10}  {"steady":>7}  {"iae":>7}')
+        for row in result['best']:
+            print(f'{row["kp"]:7g}  {row["ki"]:7g}  {row["kd"]:7g}  {row["overshoot"]:11.2f}  {str(row["settling"]):>10}  {row["steady"]:7.3f}  {row["iae"]:7.3f}')
+        current=result['current']
+        print('{:g}, {:g}, {:g} now: overshoot {:.2f}%, settling {} s, steady state error {:.3f}, iae {:.3f}'.format(*options.compare,
+              current['overshoot'], round(current['settling'], 3) if current['settling'] is not None else None, current['steady'], current['iae']))
+        if result['simple_pid_max_difference'] is not None:
+            print('simple_pid rerun of the best {}: largest difference {:.2g} degrees'.format(min(options.verify, len(result['best'])), result['simple_pid_max_difference']))
+        if result['best']:
+            best=result['best'][0]
+            print('recommended: {} = PID({:g}, {:g}, {:g}, setpoint=0)'.format(name, best['kp'], best['ki'], best['kd']))
+    with open(options.output,'w') as f:
+        json.dump(report, f, indent=2)
+    print('report saved as '+options.output)
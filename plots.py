@@ -0,0 +1,137 @@
+import time
+import numpy as np
+from PySide6.QtWidgets import QWidget
+from PySide6.QtCore import Qt, QPointF, QRectF
+from PySide6.QtGui import QPainter, QPen, QColor, QPolygonF
+from ringbuffer import RingBuffer
+
+# Downsampling to screen width. Both work on whole arrays at once, so the cost
+# per frame only depends on the number of samples in view, never on run length.
+
+def minmax(x, y, n):
+    # min and max of every bucket, drawn as a vertical stroke per pixel column
+    if len(x)<=2*n:
+        return x, y
+    edges=np.linspace(0, len(x), n+1).astype(int)[:-1]
+    lo=np.minimum.reduceat(y, edges)
+    hi=np.maximum.reduceat(y, edges)
+    xc=x[edges]
+    return np.repeat(xc, 2), np.column_stack((lo, hi)).ravel()
+
+def lttb(x, y, n):
+    # Largest-triangle-three-buckets. The anchor in the previous bucket is that
+    # bucket's centroid instead of its selected point, which makes buckets
+    # independent so the whole pass runs in numpy. The bucket edges are
+    # fractional so every sample between the first and last is in a bucket.
+    if len(x)<=n or n<3:
+        return x, y
+    edges=np.linspace(1, len(x)-1, n-1).astype(int)
+    starts=edges[:-1]
+    counts=np.diff(edges)
+    cx=np.add.reduceat(x[:-1], starts)/counts
+    cy=np.add.reduceat(y[:-1], starts)/counts
+    # anchors: previous bucket centroid (first point for the first bucket), next bucket centroid (last point for the last)
+    ax=np.concatenate(([x[0]], cx[:-1]))
+    ay=np.concatenate(([y[0]], cy[:-1]))
+    nx=np.concatenate((cx[1:], [x[-1]]))
+    ny=np.concatenate((cy[1:], [y[-1]]))
+    # triangle area of every sample in x[1:-1] with its bucket's anchors,
+    # written as |p*y+q*x-r| with p, q and r constant per bucket
+    p=np.repeat(ax-nx, counts)
+    q=np.repeat(ny-ay, counts)
+    r=np.repeat((ax-nx)*ay+ax*(ny-ay), counts)
+    bx=x[1:-1]
+    by=y[1:-1]
+    area=np.abs(p*by+q*bx-r)
+    # first sample with the largest area in each bucket
+    best=np.repeat(np.maximum.reduceat(area, starts-1), counts)
+    hits=np.flatnonzero(area==best)
+    bucket=np.searchsorted(starts-1, hits, side='right')
+    pick=hits[np.flatnonzero(np.diff(bucket, prepend=-1))]
+    return np.concatenate(([x[0]], bx[pick], [x[-1]])), np.concatenate(([y[0]], by[pick], [y[-1]]))
+
+class TelemetryHistory():
+    # receive-time stamped history of loadcell (m1..m4, total) and IMU (phi, theta) samples
+    def __init__(self, capacity=200000):
+        self.loadcell=RingBuffer(capacity, np.float64, (6,))
+        self.imu=RingBuffer(capacity, np.float64, (3,))
+        self.start=time.monotonic()
+
+    def addLoadcell(self, val):
+        self.loadcell.append((time.monotonic()-self.start, val[0], val[1], val[2], val[3], val[4]))
+
+    def addImu(self, val):
+        self.imu.append((time.monotonic()-self.start, val[0], val[1]))
+
+    # batches stamped with time.monotonic() on arrival
+    def extendLoadcell(self, times, vals):
+        if len(times):
+            self.loadcell.extend(np.column_stack((np.asarray(times)-self.start, np.asarray(vals, dtype=float)[:,:5])))
+
+    def extendImu(self, times, vals):
+        if len(times):
+            self.imu.extend(np.column_stack((np.asarray(times)-self.start, np.asarray(vals, dtype=float)[:,:2])))
+
+    def window(self, ring, seconds):
+        # samples of the last `seconds`; grows the copied tail until it covers the
+        # window, so the work follows what is on screen rather than the ring size
+        n=1024
+        while True:
+            data=ring.latest(n)
+            if len(data)<n or len(data)==0 or data[-1,0]-data[0,0]>=seconds:
+                break
+            n*=4
+        if len(data)==0:
+            return data
+        first=np.searchsorted(data[:,0], data[-1,0]-seconds)
+        return data[first:]
+
+class PlotWidget(QWidget):
+    thrustSeries=(('M1',QColor(255,80,80)),('M2',QColor(80,200,80)),('M3',QColor(80,140,255)),('M4',QColor(230,200,40)),('Total',QColor(255,255,255)))
+    attitudeSeries=(('Roll',QColor(255,120,220)),('Pitch',QColor(80,220,220)))
+
+    # repainted by the owner's frame timer, see MainWindow.renderFrame
+    def __init__(self, history, seconds=30, method='lttb', parent=None):
+        super(PlotWidget, self).__init__(parent)
+        self.history=history
+        self.seconds=seconds
+        self.method=lttb if method=='lttb' else minmax
+        self.setMinimumWidth(200)
+
+    def paintEvent(self, event):
+        painter=QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        h=self.height()/2
+        self.drawPanel(painter, QRectF(0, 0, self.width(), h), self.history.loadcell, self.thrustSeries, 'Thrust [N]')
+        self.drawPanel(painter, QRectF(0, h, self.width(), h), self.history.imu, self.attitudeSeries, 'Attitude [deg]')
+        painter.end()
+
+    def drawPanel(self, painter, rect, ring, series, title):
+        rect=rect.adjusted(40, 16, -8, -16)
+        painter.setPen(QPen(QColor(90,90,90)))
+        painter.drawRect(rect)
+        painter.drawText(QPointF(rect.left(), rect.top()-4), title)
+        data=self.history.window(ring, self.seconds)
+        if len(data)<2:
+            return
+        t=data[:,0]
+        t1=t[-1]
+        t0=t1-self.seconds
+        values=data[:,1:]
+        lo=values.min()
+        hi=values.max()
+        if hi-lo<1e-6:
+            hi+=0.5
+            lo-=0.5
+        painter.drawText(QPointF(2, rect.top()+10), str(round(hi,1)))
+        painter.drawText(QPointF(2, rect.bottom()), str(round(lo,1)))
+        width=max(int(rect.width()),2)
+        sx=rect.width()/self.seconds
+        sy=rect.height()/(hi-lo)
+        for i, (name, color) in enumerate(series):
+            x, y = self.method(t, values[:,i], width)
+            px=rect.left()+(x-t0)*sx
+            py=rect.bottom()-(y-lo)*sy
+            painter.setPen(QPen(color, 1))
+            painter.drawPolyline(QPolygonF([QPointF(a, b) for a, b in zip(px.tolist(), py.tolist())]))
+            painter.drawText(QPointF(rect.left()+6+i*48, rect.top()+12), name)
@@ -0,0 +1,102 @@
+import threading
+import numpy as np
+
+# Fixed size numpy ring buffer. Writers never block: once the buffer is full the
+# oldest unread samples are overwritten and counted in self.dropped.
+class RingBuffer():
+    def __init__(self, capacity, dtype, shape=()):
+        self.capacity=int(capacity)
+        self.data=np.zeros((self.capacity,)+tuple(shape), dtype=dtype)
+        self.head=0 # total samples written
+        self.tail=0 # total samples consumed by read()
+        self.dropped=0
+        self.lock=threading.Lock()
+
+    def __len__(self):
+        return self.head-self.tail
+
+    def _overrun(self):
+        if self.head-self.tail>self.capacity:
+            self.dropped+=self.head-self.tail-self.capacity
+            self.tail=self.head-self.capacity
+
+    def append(self, sample):
+        with self.lock:
+            self.data[self.head % self.capacity]=sample
+            self.head+=1
+            self._overrun()
+
+    def extend(self, samples):
+        n=len(samples)
+        if n==0:
+            return
+        with self.lock:
+            if n>self.capacity:
+                # only the newest samples fit, the rest count as written and dropped
+                self.head+=n-self.capacity
+                samples=samples[n-self.capacity:]
+                n=self.capacity
+            start=self.head % self.capacity
+            first=min(n, self.capacity-start)
+            self.data[start:start+first]=samples[:first]
+            self.data[:n-first]=samples[first:]
+            self.head+=n
+            self._overrun()
+
+    def _slice(self, start, stop):
+        # copy of samples [start, stop) in absolute sample numbers
+        i=start % self.capacity
+        n=stop-start
+        if i+n<=self.capacity:
+            return self.data[i:i+n].copy()
+        return np.concatenate((self.data[i:], self.data[:i+n-self.capacity]))
+
+    def read(self, max_samples=None):
+        # consume and return the oldest unread samples
+        with self.lock:
+            n=self.head-self.tail
+            if max_samples is not None:
+                n=min(n, max_samples)
+            out=self._slice(self.tail, self.tail+n)
+            self.tail+=n
+            return out
+
+    def latest(self, n=None):
+        # newest n samples in chronological order, without consuming them
+        with self.lock:
+            available=min(self.head, self.capacity)
+            n=available if n is None else min(n, available)
+            return self._slice(self.head-n, self.head)
+
+    def clear(self):
+        with self.lock:
+            self.tail=self.head
+
+# Drains a RingBuffer to a raw binary file in large chunks from a background
+# thread, so the acquisition loop only ever touches memory.
+class BulkWriter(threading.Thread):
+    def __init__(self, ring, filename, chunk=4096, interval=0.5):
+        super(BulkWriter, self).__init__(daemon=True)
+        self.ring=ring
+        self.filename=filename
+        self.chunk=chunk
+        self.interval=interval
+        self.written=0
+        self.stopEvent=threading.Event()
+        self.f=open(filename,'wb')
+
+    def run(self):
+        while not self.stopEvent.wait(self.interval):
+            while len(self.ring)>=self.chunk:
+                self.write(self.ring.read(self.chunk))
+
+    def write(self, data):
+        data.tofile(self.f)
+        self.written+=len(data)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.join()
+        while len(self.ring):
+            self.write(self.ring.read(self.chunk))
+        self.f.close()
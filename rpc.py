@@ -0,0 +1,112 @@
+import json
+import time
+import threading
+from collections import deque
+
+# Commands with replies over MQTT. The GUI sends 'rpc' {"id": N, "reply":
+# TOPIC, "command": NAME, "args": ...}, every GUI on a reply topic of its own
+# (rpc/reply/CLIENT); the Pi runs the command and answers on that topic with
+# {"id": N, "ok": true, "result": ..., "seconds": time the command took} or
+# {"id": N, "ok": false, "error": TEXT}. Any number of requests may be
+# outstanding, the id pairs every reply with its request, and a request
+# without a reply within the timeout is reported as failed, so a lost command
+# no longer goes unnoticed. The plain command topics ('weigh', 'start', ...)
+# keep working for scripts that do not need replies.
+
+class RpcServer():
+    # Pi side. handlers: command -> fn(args) returning the JSON result, an
+    # exception is the error reply; run(command, call) runs a request, by
+    # default on a thread of its own like the plain commands
+    def __init__(self, publish, handlers, run=None):
+        self.publish=publish
+        self.handlers=handlers
+        self.run=run or (lambda command, call: threading.Thread(target=call, daemon=True).start())
+        self.requests=0
+
+    def request(self, payload):
+        try:
+            msg=json.loads(payload.decode('utf-8'))
+            reply=msg['reply']
+            requestId=msg['id']
+        except (ValueError, KeyError, TypeError) as e:
+            print('bad rpc request: '+str(e))
+            return
+        self.requests+=1
+        handler=self.handlers.get(msg.get('command'))
+        if handler is None:
+            self.answer(reply, {'id':requestId, 'ok':False, 'error':'unknown command '+str(msg.get('command'))})
+            return
+        def call():
+            start=time.monotonic()
+            try:
+                result=handler(msg.get('args'))
+            except Exception as e:
+                self.answer(reply, {'id':requestId, 'ok':False, 'error':str(e) or type(e).__name__})
+                return
+            self.answer(reply, {'id':requestId, 'ok':True, 'result':result, 'seconds':round(time.monotonic()-start, 6)})
+        self.run(msg['command'], call)
+
+    def answer(self, reply, msg):
+        self.publish(reply, json.dumps(msg))
+
+class RpcClient():
+    # GUI side. call() sends a request and returns its id; done(reply, rtt)
+    # runs on the receiving thread when the reply comes, or from check() on a
+    # timeout with {"ok": false, "error": "timeout"} and rtt None. The round
+    # trip times of the last `keep` replies give the latency statistics.
+    def __init__(self, publish, client, timeout=5.0, keep=100):
+        self.publish=publish
+        self.reply='rpc/reply/'+client
+        self.timeout=timeout
+        self.pending={}
+        self.rtts=deque(maxlen=keep)
+        self.next=0
+        self.timeouts=0
+        self.lock=threading.Lock()
+
+    def call(self, command, args=None, done=None):
+        with self.lock:
+            self.next+=1
+            requestId=self.next
+            self.pending[requestId]=(command, time.monotonic(), done)
+        self.publish('rpc', json.dumps({'id':requestId, 'reply':self.reply, 'command':command, 'args':args}))
+        return requestId
+
+    def receive(self, payload):
+        now=time.monotonic()
+        try:
+            reply=json.loads(payload.decode('utf-8'))
+            requestId=reply['id']
+        except (ValueError, KeyError, TypeError):
+            return
+        with self.lock:
+            request=self.pending.pop(requestId, None)
+            if request is None:
+                # late, after its timeout
+                return
+            rtt=now-request[1]
+            self.rtts.append(rtt)
+        reply['command']=request[0]
+        if request[2] is not None:
+            request[2](reply, rtt)
+
+    def check(self):
+        # fail the requests that waited longer than the timeout
+        now=time.monotonic()
+        with self.lock:
+            expired=[(requestId, request) for requestId, request in self.pending.items() if now-request[1]>self.timeout]
+            for requestId, request in expired:
+                del self.pending[requestId]
+            self.timeouts+=len(expired)
+        for requestId, (command, sent, done) in expired:
+            if done is not None:
+                done({'id':requestId, 'command':command, 'ok':False, 'error':'timeout'}, None)
+
+    def stats(self):
+        # round trip mean and max in ms over the last replies, requests still pending
+        with self.lock:
+            rtts=list(self.rtts)
+            pending=len(self.pending)
+        if not rtts:
+            return {'mean':None, 'max':None, 'pending':pending, 'timeouts':self.timeouts}
+        return {'mean':round(1000*sum(rtts)/len(rtts), 1), 'max':round(1000*max(rtts), 1), 'pending':pending, 'timeouts':self.timeouts}
@@ -0,0 +1,109 @@
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+# Columnar store for runs downloaded from the Pi, see download.py. While a
+# download is in progress every verified chunk is appended to NAME.part, a
+# journal of the compressed chunks as received, so an interrupted download
+# resumes from the first chunk that is missing. Once the last chunk is in, the
+# records are split into one array per column and saved as NAME.npz.
+
+# length and crc32 in front of every journal entry
+ENTRY=struct.Struct('!II')
+IMU_COLUMNS=('time','roll','pitch')
+LOADCELL_COLUMNS=('time','thrust','motor1','motor2','motor3','motor4')
+
+def columns(records):
+    # Rpi_mqtt records are IMU rows {time, roll, pitch} and loadcell rows
+    # {time, thrust, motor1..motor4}, interleaved; e.g. imu_roll, loadcell_thrust
+    imu=[r for r in records if 'roll' in r]
+    lc=[r for r in records if 'thrust' in r]
+    out={}
+    for table, rows, names in (('imu', imu, IMU_COLUMNS), ('loadcell', lc, LOADCELL_COLUMNS)):
+        for name in names:
+            out[table+'_'+name]=np.array([r[name] for r in rows], dtype=np.float64)
+    return out
+
+class RunStore():
+    def __init__(self, directory='runs'):
+        self.directory=directory
+        self.counts={}
+
+    def path(self, run, ext):
+        return os.path.join(self.directory, run+ext)
+
+    def finished(self, run):
+        return os.path.exists(self.path(run, '.npz'))
+
+    def runs(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith('.npz'))
+
+    def chunks(self, run):
+        # number of chunks in the journal, the next one to download
+        if run not in self.counts:
+            self.counts[run]=self.scan(run)
+        return self.counts[run]
+
+    def scan(self, run):
+        # count the good entries, an entry torn by a crash is cut off
+        path=self.path(run, '.part')
+        if not os.path.exists(path):
+            return 0
+        n=0
+        good=0
+        with open(path, 'rb') as f:
+            while True:
+                head=f.read(ENTRY.size)
+                if len(head)<ENTRY.size:
+                    break
+                size, crc = ENTRY.unpack(head)
+                data=f.read(size)
+                if len(data)<size or zlib.crc32(data)!=crc:
+                    break
+                n+=1
+                good=f.tell()
+        if os.path.getsize(path)>good:
+            os.truncate(path, good)
+        return n
+
+    def append(self, run, index, data):
+        # data is a verified compressed chunk, chunks must come in order
+        if index!=self.chunks(run):
+            raise ValueError('chunk {} of {} out of order, expected {}'.format(index, run, self.chunks(run)))
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(run, '.part'), 'ab') as f:
+            f.write(ENTRY.pack(len(data), zlib.crc32(data))+data)
+        self.counts[run]+=1
+
+    def records(self, run):
+        records=[]
+        path=self.path(run, '.part')
+        if not os.path.exists(path):
+            return records
+        with open(path, 'rb') as f:
+            for i in range(self.chunks(run)):
+                size, crc = ENTRY.unpack(f.read(ENTRY.size))
+                records+=json.loads(zlib.decompress(f.read(size)))
+        return records
+
+    def finish(self, run):
+        # journal -> NAME.npz, written under a temporary name so a crash never
+        # leaves a truncated run behind
+        path=self.path(run, '.npz')
+        with open(path+'.tmp', 'wb') as f:
+            np.savez(f, **columns(self.records(run)))
+        os.replace(path+'.tmp', path)
+        os.remove(self.path(run, '.part'))
+        self.counts.pop(run, None)
+        return path
+
+    def load(self, run):
+        # {column: array}, also for a download that is still in progress
+        if self.finished(run):
+            with np.load(self.path(run, '.npz')) as f:
+                return dict(f)
+        return columns(self.records(run))
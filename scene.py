@@ -0,0 +1,95 @@
+import math
+import numpy as np
+
+# Geometry and matrices for the 3D view of the bench, built once with numpy.
+# Vertices are x, y, z, r, g, b, lift. The shader moves a vertex up by
+# lift*scale, so a loadcell bar is a unit prism whose top follows the scale uniform.
+
+VERTEX_SIZE=7
+
+PLATE=((0.5,-1.0),(1.0,-0.5),(1.0,0.5),(0.5,1.0),(-0.5,1.0),(-1.0,0.5),(-1.0,-0.5),(-0.5,-1.0))
+# motor 1 to 4 positions on the plate
+MOTORS=((0.6,-0.6),(0.6,0.6),(-0.6,0.6),(-0.6,-0.6))
+
+GREEN=(0.0,1.0,0.0)
+BLUE=(0.0,0.0,1.0)
+PLATE_SIDE=(0.5,0.5,0.5)
+TOWER=(1.0,1.0,0.0)
+MOTOR_SIDE=(0.7,0.7,0.7)
+BAR_SIDE=(1.0,0.1,0.1)
+
+def square(cx, cy, half):
+    return ((cx+half,cy-half),(cx+half,cy+half),(cx-half,cy+half),(cx-half,cy-half))
+
+def octagon(cx, cy, r):
+    return tuple((cx+r*math.cos(math.radians(a)), cy+r*math.sin(math.radians(a))) for a in range(-90,270,45))
+
+def face(points, color, lift=0.0):
+    # triangle fan of a convex polygon given as (x, y, z) points
+    out=[]
+    for i in range(1, len(points)-1):
+        for p in (points[0], points[i], points[i+1]):
+            out.append(tuple(p)+tuple(color)+(lift if len(p)==3 else p[3],))
+    return out
+
+def prism(outline, z0, z1, side, top=None, bottom=None, lift=False):
+    # lift marks the top vertices so they follow the scale uniform
+    l=1.0 if lift else 0.0
+    low=[(x,y,z0,0.0) for x, y in outline]
+    high=[(x,y,z1,l) for x, y in outline]
+    out=[]
+    if top is not None:
+        out+=face([p[:3] for p in high], top, l)
+    if bottom is not None:
+        out+=face([p[:3] for p in low], bottom)
+    n=len(outline)
+    for i in range(n):
+        j=(i+1) % n
+        for p in (high[i], high[j], low[j], high[i], low[j], low[i]):
+            out.append(p[:3]+tuple(side)+(p[3],))
+    return out
+
+def build():
+    # returns the vertex array and the (first, count) range of the static part and of each bar
+    static=prism(PLATE, -0.05, 0.0, PLATE_SIDE, GREEN, BLUE)
+    for cx, cy in MOTORS:
+        static+=prism(square(cx, cy, 0.05), 0.0, 0.1, TOWER)
+        static+=prism(octagon(cx, cy, 0.2), 0.1, 0.15, MOTOR_SIDE, GREEN, BLUE)
+    vertices=list(static)
+    ranges=[(0, len(static))]
+    for cx, cy in MOTORS:
+        bar=prism(square(cx, cy, 0.1), 0.15, 0.15, BAR_SIDE, BLUE, lift=True)
+        ranges.append((len(vertices), len(bar)))
+        vertices+=bar
+    return np.array(vertices, dtype=np.float32), ranges
+
+def perspective(fovy, aspect, near, far):
+    f=1.0/math.tan(math.radians(fovy)/2)
+    m=np.zeros((4,4))
+    m[0,0]=f/aspect
+    m[1,1]=f
+    m[2,2]=(far+near)/(near-far)
+    m[2,3]=2*far*near/(near-far)
+    m[3,2]=-1.0
+    return m
+
+def translate(x, y, z):
+    m=np.identity(4)
+    m[:3,3]=(x,y,z)
+    return m
+
+def rotate(angle, x, y, z):
+    # same convention as glRotate: angle in degrees around the (x, y, z) axis
+    axis=np.array((x,y,z), dtype=float)
+    x, y, z = axis/np.linalg.norm(axis)
+    c=math.cos(math.radians(angle))
+    s=math.sin(math.radians(angle))
+    m=np.identity(4)
+    m[:3,:3]=((x*x*(1-c)+c, x*y*(1-c)-z*s, x*z*(1-c)+y*s),
+              (y*x*(1-c)+z*s, y*y*(1-c)+c, y*z*(1-c)-x*s),
+              (x*z*(1-c)-y*s, y*z*(1-c)+x*s, z*z*(1-c)+c))
+    return m
+
+def modelview(phi, theta):
+    # camera 2 units back, plate rotated with the IMU angles
+    return translate(0.0,0.0,-2)@rotate(90-phi,-1,0,0)@rotate(theta,0,-1,0)
@@ -0,0 +1,161 @@
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# Telemetry ring in shared memory for when the GUI and the acquisition run on
+# the same host. One writer, any number of readers. The block starts with a small
+# header: magic, capacity, record width and head, the number of records written
+# so far. Record i lives in slot i % capacity, so head is also the sequence number
+# of the next record. Records are float64 rows, column 0 is time.monotonic().
+# Every reader keeps its own sequence and gets numpy views straight into the block.
+
+MAGIC=0x54455354424e4348
+HEADER=8
+# records per ring, about 20 minutes of 50 Hz telemetry
+CAPACITY=65536
+# rings created by this process
+created=set()
+
+def ringName(channel, rig=''):
+    return 'testbench_'+(rig+'_' if rig else '')+channel
+
+def attach(name):
+    # attaching must not register the block with this process' resource tracker,
+    # or the block is unlinked when the reader exits
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        shm=shared_memory.SharedMemory(name)
+        if name not in created:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+class SharedRing():
+    def __init__(self, name, capacity=CAPACITY, width=6, create=False):
+        self.name=name
+        self.owner=create
+        if create:
+            size=8*(HEADER+capacity*width)
+            try:
+                self.shm=shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                # left behind by a writer that did not exit cleanly
+                old=shared_memory.SharedMemory(name)
+                old.close()
+                old.unlink()
+                self.shm=shared_memory.SharedMemory(name, create=True, size=size)
+            created.add(name)
+            self.header=np.ndarray((HEADER,), np.uint64, self.shm.buf)
+            self.header[:]=0
+            self.header[1]=capacity
+            self.header[2]=width
+            self.header[0]=MAGIC
+        else:
+            self.shm=attach(name)
+            self.header=np.ndarray((HEADER,), np.uint64, self.shm.buf)
+            if int(self.header[0])!=MAGIC:
+                self.header=None
+                self.shm.close()
+                raise ValueError(name+' is not a telemetry ring')
+            capacity=int(self.header[1])
+            width=int(self.header[2])
+        self.capacity=capacity
+        self.width=width
+        self.data=np.ndarray((capacity, width), np.float64, self.shm.buf, offset=8*HEADER)
+        # a reader starts at the newest record, not at whatever the ring still holds
+        self.seq=self.head()
+        self.lost=0
+
+    def head(self):
+        return int(self.header[3])
+
+    def write(self, rows):
+        rows=np.asarray(rows, dtype=np.float64).reshape(-1, self.width)
+        head=self.head()
+        if len(rows)>self.capacity:
+            head+=len(rows)-self.capacity
+            rows=rows[-self.capacity:]
+        n=len(rows)
+        i=head % self.capacity
+        k=min(n, self.capacity-i)
+        self.data[i:i+k]=rows[:k]
+        self.data[:n-k]=rows[k:]
+        # readers only look below head, so move it once the rows are in place
+        self.header[3]=head+n
+
+    def read(self, max_records=None):
+        # View of the unread records up to the wrap point, empty when there is
+        # nothing new; call again for the rest. The view is only valid until the
+        # writer laps it, see lapped().
+        head=self.head()
+        if head-self.seq>self.capacity:
+            self.lost+=head-self.seq-self.capacity
+            self.seq=head-self.capacity
+        i=self.seq % self.capacity
+        n=min(head-self.seq, self.capacity-i)
+        if max_records is not None:
+            n=min(n, max_records)
+        self.seq+=n
+        return self.data[i:i+n]
+
+    def readAll(self):
+        # everything unread, as at most two views
+        views=[]
+        while True:
+            view=self.read()
+            if len(view)==0:
+                return views
+            views.append(view)
+
+    def lapped(self, seq):
+        # True once the record with sequence number seq has been overwritten
+        return self.head()-seq>self.capacity
+
+    def close(self):
+        self.data=None
+        self.header=None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a caller still holds a view, the mapping goes away with it
+            pass
+        if self.owner:
+            self.shm.unlink()
+            created.discard(self.name)
+
+class SharedTelemetry():
+    # GUI side: the loadcell and IMU rings of one rig, attached as soon as the
+    # acquisition process has created them
+    CHANNELS=(('loadcell','loadcell'),('IMU','imu'))
+
+    def __init__(self, rig='', retry=1.0):
+        self.rig=rig
+        self.retry=retry
+        self.rings={}
+        self.lastAttempt=0.0
+
+    def attach(self):
+        now=time.monotonic()
+        if now-self.lastAttempt<self.retry:
+            return
+        self.lastAttempt=now
+        for topic, channel in self.CHANNELS:
+            if topic not in self.rings:
+                try:
+                    self.rings[topic]=SharedRing(ringName(channel, self.rig))
+                except (FileNotFoundError, ValueError):
+                    pass
+
+    def poll(self):
+        # {topic: [views]} of the records written since the previous poll
+        if len(self.rings)<len(self.CHANNELS):
+            self.attach()
+        return {topic: ring.readAll() for topic, ring in self.rings.items()}
+
+    def lost(self):
+        return sum(ring.lost for ring in self.rings.values())
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings={}
@@ -0,0 +1,341 @@
+import os
+import sys
+import math
+import time
+import types
+import queue
+import random
+import threading
+from argparse import ArgumentParser
+
+# Simulated loadcell hardware for running loadcell.py off the Pi: HX711 chips
+# that convert at their data rate and shift their result out on the shared
+# clock pin, behind the subset of RPi.GPIO the loadcell code uses, including
+# edge callbacks delivered on one event thread like RPi.GPIO does. install()
+# puts the simulation in place of RPi.GPIO and the hx711 library before
+# loadcell is imported, installPlatform() the servos (gpiozero) and an IMU
+# (RTIMU) whose attitude follows them, so Rpi_mqtt imports off the Pi too.
+
+class SimulatedHX711():
+    # one chip: after every conversion DOUT goes low until the result has been
+    # clocked out; clocking while converting does nothing. counts(t) gives the
+    # raw reading.
+    def __init__(self, counts):
+        self.counts=counts
+        self.dout=1
+        self.data=0
+        self.bit=None
+
+    def convert(self, now):
+        # a result nobody read is overwritten
+        self.data=int(self.counts(now)) & 0xffffff
+        self.bit=0
+        self.dout=0
+
+    def clock(self):
+        # rising edge of the clock: next data bit, MSB first, then the gain
+        # pulse(s) end the read and DOUT stays high until the next conversion
+        if self.bit is None:
+            return
+        if self.bit<24:
+            self.dout=(self.data>>(23-self.bit)) & 1
+            self.bit+=1
+        else:
+            self.bit=None
+            self.dout=1
+
+class SimulatedGPIO():
+    BCM=11
+    BOARD=10
+    IN=1
+    OUT=0
+    LOW=0
+    HIGH=1
+    FALLING=32
+    RISING=31
+    BOTH=33
+    PUD_UP=22
+    PUD_DOWN=21
+
+    def __init__(self, chips, sck=5, rate=80, jitter=0.0005):
+        # chips: {dout pin: SimulatedHX711}, all clocked by sck
+        self.chips=chips
+        self.sck=sck
+        self.rate=rate
+        self.jitter=jitter
+        self.levels={pin: 1 for pin in chips}
+        self.levels[sck]=0
+        self.callbacks={}
+        self.conversions=0
+        self.start()
+        # the chips keep converting in a forked process too, like the real
+        # ones do for Rpi_mqtt -p
+        os.register_at_fork(after_in_child=self.start)
+
+    def start(self):
+        self.lock=threading.RLock()
+        self.events=queue.Queue()
+        self.stopEvent=threading.Event()
+        self.converter=threading.Thread(target=self.convertLoop, daemon=True)
+        self.dispatcher=threading.Thread(target=self.dispatch, daemon=True)
+        self.converter.start()
+        self.dispatcher.start()
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+        if initial is not None:
+            self.output(pin, initial)
+
+    def input(self, pin):
+        with self.lock:
+            return self.levels.get(pin, 0)
+
+    def output(self, pin, value):
+        with self.lock:
+            rising=pin==self.sck and value and not self.levels[self.sck]
+            self.levels[pin]=1 if value else 0
+            if rising:
+                for chip in self.chips.values():
+                    chip.clock()
+                self.update()
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self.lock:
+            if pin in self.callbacks:
+                raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+            self.callbacks[pin]=(edge, callback)
+
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.callbacks.pop(pin, None)
+
+    def cleanup(self):
+        with self.lock:
+            self.callbacks={}
+
+    def close(self):
+        self.stopEvent.set()
+        self.events.put(None)
+        self.converter.join()
+        self.dispatcher.join()
+
+    def update(self):
+        # new DOUT levels, queue the edges somebody listens for
+        for pin, chip in self.chips.items():
+            old=self.levels[pin]
+            if chip.dout!=old:
+                self.levels[pin]=chip.dout
+                edge=self.FALLING if old else self.RISING
+                registered=self.callbacks.get(pin)
+                if registered is not None and registered[0] in (edge, self.BOTH) and registered[1] is not None:
+                    self.events.put((registered[1], pin))
+
+    def convertLoop(self):
+        # all chips run off their own oscillators: the same rate, a little jitter
+        period=1.0/self.rate
+        due=time.monotonic()
+        while not self.stopEvent.is_set():
+            due+=period
+            delay=due-time.monotonic()
+            if delay>0:
+                time.sleep(delay)
+            for pin, chip in self.chips.items():
+                if self.jitter:
+                    time.sleep(random.random()*self.jitter/len(self.chips))
+                with self.lock:
+                    chip.convert(time.monotonic())
+                    self.update()
+            self.conversions+=1
+
+    def dispatch(self):
+        # one thread runs the callbacks in order, like RPi.GPIO
+        while True:
+            event=self.events.get()
+            if event is None:
+                return
+            callback, pin = event
+            callback(pin)
+
+def libraryHX711(gpio):
+    # HX711 class with the read loop of the hx711 library Rpi_mqtt uses: poll
+    # DOUT every 10 ms until it goes low, then clock out 24 bits and the gain pulse
+    class HX711():
+        def __init__(self, dout_pin, pd_sck_pin, gain=128, channel='A'):
+            self.dout=dout_pin
+            self.sck=pd_sck_pin
+            self.ratio=1
+            self.offset=0
+            gpio.setup(self.sck, gpio.OUT)
+            gpio.setup(self.dout, gpio.IN)
+
+        def set_scale_ratio(self, ratio):
+            self.ratio=ratio
+
+        def read(self):
+            tries=0
+            while gpio.input(self.dout) and tries<=40:
+                time.sleep(0.01)
+                tries+=1
+            if gpio.input(self.dout):
+                return False
+            value=0
+            for bit in range(24):
+                gpio.output(self.sck, 1)
+                gpio.output(self.sck, 0)
+                value=(value<<1) | gpio.input(self.dout)
+            gpio.output(self.sck, 1)
+            gpio.output(self.sck, 0)
+            return value-(1<<24) if value & 0x800000 else value
+
+        def get_raw_data_mean(self, readings=30):
+            values=[v for v in (self.read() for i in range(readings)) if v is not False]
+            return sum(values)/len(values) if values else False
+
+        def zero(self, readings=30):
+            self.offset=self.get_raw_data_mean(readings)
+            return False
+
+        def get_weight_mean(self, readings=30):
+            return (self.get_raw_data_mean(readings)-self.offset)/self.ratio
+
+    return HX711
+
+def simulatedLoadcells(rate=80, grams=(100, 120, 140, 160), ratios=(-203140, -209464, 211106, -200515), noise=200):
+    # the four chips of the test bench on pins 6, 13, 19, 26, clock on 5
+    chips={}
+    for pin, g, ratio in zip((6, 13, 19, 26), grams, ratios):
+        chips[pin]=SimulatedHX711(lambda t, g=g, ratio=ratio: 8000+g/1000*ratio+random.gauss(0, noise))
+    return SimulatedGPIO(chips, 5, rate)
+
+class SimulatedServo():
+    # gpiozero.AngularServo as far as Rpi_mqtt uses it: an angle to set
+    def __init__(self, pin, initial_angle=0.0, min_angle=-90, max_angle=90, **pulse):
+        self.pin=pin
+        self.min_angle=min_angle
+        self.max_angle=max_angle
+        self.angle=initial_angle
+
+class SimulatedIMU():
+    # RTIMU.RTIMU with a platform that tilts after the servos: phi follows the
+    # front servo, theta the right one, as a first order lag with time
+    # constant lag seconds; new data every poll interval in ms
+    def __init__(self, servos, poll=4, lag=0.15, scale=1.5, noise=0.05):
+        self.servos=servos
+        self.poll=poll
+        self.lag=lag
+        self.scale=scale
+        self.noise=noise
+        self.phi=0.0
+        self.theta=0.0
+        self.last=0.0
+        self.updated=time.monotonic()
+
+    def IMUInit(self):
+        return True
+
+    def setSlerpPower(self, power):
+        pass
+
+    def setGyroEnable(self, enable):
+        pass
+
+    def setAccelEnable(self, enable):
+        pass
+
+    def setCompassEnable(self, enable):
+        pass
+
+    def IMUGetPollInterval(self):
+        return self.poll
+
+    def IMURead(self):
+        now=time.monotonic()
+        if now-self.last<self.poll/1000:
+            return False
+        self.last=now
+        return True
+
+    def getFusionData(self):
+        now=time.monotonic()
+        k=min((now-self.updated)/self.lag, 1.0)
+        self.updated=now
+        phi=self.servos[20].angle/self.scale if 20 in self.servos else 0.0
+        theta=self.servos[12].angle/self.scale if 12 in self.servos else 0.0
+        self.phi+=(phi-self.phi)*k
+        self.theta+=(theta-self.theta)*k
+        return (math.radians(self.phi+random.gauss(0, self.noise)), math.radians(self.theta+random.gauss(0, self.noise)), 0.0)
+
+    def getIMUData(self):
+        return {'timestamp':int(time.time()*1e6), 'gyro':(0.0, 0.0, 0.0), 'accel':(0.0, 0.0, 1.0), 'fusionPose':self.getFusionData()}
+
+def installPlatform():
+    # gpiozero and RTIMU for modules imported from now on, returns the
+    # servos by pin
+    servos={}
+    def AngularServo(pin, **kwargs):
+        servos[pin]=SimulatedServo(pin, **kwargs)
+        return servos[pin]
+    gpiozero=types.ModuleType('gpiozero')
+    gpiozero.AngularServo=AngularServo
+    rtimu=types.ModuleType('RTIMU')
+    rtimu.Settings=lambda name: name
+    rtimu.RTIMU=lambda settings: SimulatedIMU(servos)
+    sys.modules['gpiozero']=gpiozero
+    sys.modules['RTIMU']=rtimu
+    return servos
+
+def install(gpio):
+    # RPi.GPIO and hx711 for modules imported from now on
+    package=types.ModuleType('RPi')
+    package.GPIO=gpio
+    library=types.ModuleType('hx711')
+    library.HX711=libraryHX711(gpio)
+    sys.modules['RPi']=package
+    sys.modules['RPi.GPIO']=gpio
+    sys.modules['hx711']=library
+
+def measure(lc, interrupts, duration, block):
+    # (cpu percent and rows per second while streaming, cpu percent idle
+    # afterwards, with the edge callbacks still registered)
+    lc.interrupts=interrupts
+    rows=0
+    cpu0=time.process_time()
+    start=time.monotonic()
+    while time.monotonic()-start<duration:
+        times, values = lc.read_block(block)
+        rows+=len(times)
+    wall=time.monotonic()-start
+    busy=100*(time.process_time()-cpu0)/wall
+    lc.idle()
+    cpu0=time.process_time()
+    time.sleep(duration)
+    idle=100*(time.process_time()-cpu0)/duration
+    return busy, rows/wall, idle
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Loadcell CPU use with polling and interrupt driven HX711 reads, on simulated hardware')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per measurement')
+    parser.add_argument('--rate', type=int, default=80, help='HX711 data rate, 10 or 80 samples per second')
+    parser.add_argument('--block', type=int, default=2, help='rows per read_block call, Rpi_mqtt lcconfig block')
+    options=parser.parse_args()
+    gpio=simulatedLoadcells(options.rate)
+    install(gpio)
+    import loadcell
+    lc=loadcell.loadcell()
+    # the simulation itself costs cpu too, measure it alone first
+    cpu0=time.process_time()
+    time.sleep(options.duration)
+    base=100*(time.process_time()-cpu0)/options.duration
+    print('simulated chips alone: {:.1f}% cpu'.format(base))
+    print(f'{"reads":>10}  {"idle cpu %":>10}  {"stream cpu %":>12}  {"rows/s":>7}')
+    for name, interrupts in (('polling', False), ('interrupt', True)):
+        busy, rate, idle = measure(lc, interrupts, options.duration, options.block)
+        print(f'{name:>10}  {idle-base:10.1f}  {busy-base:12.1f}  {rate:7.1f}')
+    if lc.sampler is not None:
+        print('interrupts: {} edges, {} reads'.format(lc.sampler.edges, lc.sampler.reads))
+    gpio.close()
@@ -0,0 +1,44 @@
+import json
+import threading
+
+# Last-value state of the service: the mode, the angle setpoints, the last
+# weight, the run, the loadcell filter and the last refused command. Every
+# change publishes the whole snapshot as one retained message on 'status',
+# so a GUI that connects mid-run gets it from the broker along with its
+# subscription instead of waiting for the next command; the rpc 'state'
+# request returns the same snapshot. 'version' counts the changes. OFFLINE
+# replaces the snapshot of a service that went away, as the broker's will
+# or on a clean shutdown.
+
+OFFLINE=json.dumps({'online':False})
+
+class StatusCache():
+    # publish(topic, payload, retain) sends a snapshot, values are the initial state
+    def __init__(self, publish, **values):
+        self.publish=publish
+        self.values=dict(values, online=True)
+        self.version=0
+        self.lock=threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            return self.values.get(key)
+
+    def update(self, **changes):
+        # publishes when something actually changed, under the lock so the
+        # broker keeps the latest snapshot when two threads update at once
+        with self.lock:
+            if all(self.values.get(key)==value for key, value in changes.items()):
+                return
+            self.values.update(changes)
+            self.version+=1
+            self.publish('status', json.dumps(self.snapshot()), True)
+
+    def refresh(self):
+        # again as it is, e.g. after connecting to a broker that lost it
+        with self.lock:
+            self.publish('status', json.dumps(self.snapshot()), True)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values, version=self.version)
@@ -0,0 +1,209 @@
+import json
+import time
+import math
+import threading
+from collections import namedtuple
+
+# Telemetry topics published by Rpi_mqtt and how their payloads decode
+TOPICS=('weight','loadcell','IMU','time','ratio','metrics')
+
+def decode(topic, payload):
+    # raises ValueError on malformed payloads
+    mstr=payload.decode('utf-8')
+    if topic in ('loadcell','IMU','metrics'):
+        return json.loads(mstr)
+    return mstr
+
+def decodeBatch(topic, payloads):
+    # one json.loads call for a whole batch of same-topic payloads
+    if topic in ('loadcell','IMU','metrics'):
+        return json.loads(b'['+b','.join(payloads)+b']')
+    return [payload.decode('utf-8') for payload in payloads]
+
+class Snapshot():
+    # everything decoded since the previous snapshot: latest values plus the
+    # receive-time stamped loadcell and IMU samples for the plot history
+    def __init__(self):
+        self.latest={}
+        self.loadcellTimes=[]
+        self.loadcell=[]
+        self.imuTimes=[]
+        self.imu=[]
+        self.messages=0
+        self.errors=0
+
+    def add(self, stamps, topic, vals):
+        # vals decoded from payloads of one topic, received at stamps
+        if not vals:
+            return
+        self.messages+=len(vals)
+        self.latest[topic]=vals[-1]
+        if topic=='loadcell':
+            self.loadcellTimes+=stamps
+            self.loadcell+=vals
+        elif topic=='IMU':
+            self.imuTimes+=stamps
+            self.imu+=vals
+
+class TelemetryModel():
+    # Latest value of every telemetry channel. The message handler only writes
+    # here, the frame timer reads it once per display refresh and repaints
+    # whatever changed since the previous frame.
+    def __init__(self):
+        self.weight='0.0'
+        self.loadcell=(0.0,0.0,0.0,0.0,0.0)
+        self.imu=(0.0,0.0)
+        self.time='00:00:00.00'
+        # rolling statistics from the Pi, see metrics.py
+        self.metrics=None
+        self.messages=0
+        self.sceneDirty=False
+        self.labelsDirty=False
+
+    def update(self, topic, val):
+        self.messages+=1
+        if topic=='weight':
+            self.weight=val
+        elif topic=='loadcell':
+            self.loadcell=val
+            self.sceneDirty=True
+        elif topic=='IMU':
+            self.imu=val
+            self.sceneDirty=True
+        elif topic=='time':
+            self.time=val
+        elif topic=='metrics':
+            self.metrics=val
+        else:
+            return
+        self.labelsDirty=True
+
+    def apply(self, snapshot):
+        for topic, val in snapshot.latest.items():
+            self.update(topic, val)
+        # update() counted one message per topic, count the whole batch instead
+        self.messages+=snapshot.messages-len(snapshot.latest)
+
+class SyntheticFeed(threading.Thread):
+    # Generates loadcell, IMU and time messages at `rate` messages per second
+    # and hands them to sink(topic, payload) like the MQTT network thread would.
+    def __init__(self, sink, rate=100):
+        super(SyntheticFeed, self).__init__(daemon=True)
+        self.sink=sink
+        self.rate=rate
+        self.sent=0
+        self.stopEvent=threading.Event()
+
+    def message(self, i, t):
+        kind=i % 3
+        if kind==0:
+            lc=[round(10+5*math.sin(t*(k+1)),2) for k in range(4)]
+            return 'loadcell', json.dumps(lc+[round(sum(lc),2)]).encode()
+        if kind==1:
+            return 'IMU', json.dumps((10*math.sin(t), 10*math.cos(0.7*t))).encode()
+        return 'time', '{:02d}:{:02d}:{:02d}:00'.format(int(t//3600), int(t//60)%60, int(t)%60).encode()
+
+    def run(self):
+        start=time.perf_counter()
+        while not self.stopEvent.is_set():
+            now=time.perf_counter()-start
+            due=int(now*self.rate)
+            # send everything that is due in one burst, then sleep a little
+            while self.sent<due:
+                self.sink(*self.message(self.sent, now))
+                self.sent+=1
+            time.sleep(0.001)
+
+    def stop(self):
+        self.stopEvent.set()
+
+def simulatedRig(broker, namespace, rate=100):
+    # a rig that publishes synthetic telemetry under namespace/ through the broker stand-in
+    prefix=namespace+'/' if namespace else ''
+    return SyntheticFeed(lambda topic, payload: broker.publish(prefix+topic, payload), rate)
+
+def topicMatches(pattern, topic):
+    # MQTT subscription matching with the + and # wildcards
+    p=pattern.split('/')
+    t=topic.split('/')
+    for i, level in enumerate(p):
+        if level=='#':
+            return True
+        if i>=len(t) or (level!='+' and level!=t[i]):
+            return False
+    return len(p)==len(t)
+
+LoopbackMessage=namedtuple('LoopbackMessage', ('topic','payload'))
+
+class LoopbackBroker():
+    # In-process stand-in for the MQTT broker, for tests and benchmarks without
+    # a network. publish() delivers on the caller's thread, like paho's network
+    # thread would; the subscribers of every topic are cached after the first match.
+    def __init__(self):
+        self.subscriptions=()
+        self.routes={}
+        self.lock=threading.Lock()
+        self.published=0
+
+    def client(self):
+        return LoopbackClient(self)
+
+    def subscribe(self, client, pattern):
+        with self.lock:
+            self.subscriptions+=((pattern, client),)
+            self.routes={}
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.subscriptions=tuple(s for s in self.subscriptions if s[1] is not client)
+            self.routes={}
+
+    def publish(self, topic, payload):
+        self.published+=1
+        clients=self.routes.get(topic)
+        if clients is None:
+            clients=tuple(c for pattern, c in self.subscriptions if topicMatches(pattern, topic))
+            self.routes[topic]=clients
+        if clients:
+            message=LoopbackMessage(topic, payload if isinstance(payload, bytes) else str(payload).encode())
+            for client in clients:
+                client.deliver(message)
+
+class LoopbackClient():
+    # the part of paho.mqtt.client.Client that MqttClient uses
+    def __init__(self, broker):
+        self.broker=broker
+        self.on_connect=None
+        self.on_message=None
+        self.on_disconnect=None
+        self.connected=False
+
+    def connect(self, host, port=1883, keepalive=60):
+        self.connected=True
+        return 0
+
+    def connect_async(self, host, port=1883, keepalive=60):
+        self.connect(host, port, keepalive)
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def loop_start(self):
+        if self.connected and self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic, qos=0):
+        self.broker.subscribe(self, topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, b'' if payload is None else payload)
+
+    def deliver(self, message):
+        if self.on_message is not None:
+            self.on_message(self, None, message)
+
+    def disconnect(self):
+        self.broker.unsubscribe(self)
+        self.connected=False
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, 0)
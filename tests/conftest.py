@@ -0,0 +1,13 @@
+import os
+import sys
+
+# The tests run on the simulated hardware from simulators.py: the loadcells
+# behind RPi.GPIO and hx711, the servos and the IMU behind gpiozero and RTIMU,
+# installed before any test imports loadcell or Rpi_mqtt.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simulators
+
+gpio=simulators.simulatedLoadcells()
+simulators.install(gpio)
+servos=simulators.installPlatform()
@@ -0,0 +1,120 @@
+import json
+import time
+import threading
+import pytest
+from campaign import parseSweep, Campaign, SETTINGS
+
+# Sweep definitions of campaign.py and campaigns run against a synthetic rig
+# whose records follow the setpoints.
+
+def test_grid_runs_serpentine():
+    steps, settings = parseSweep({'grid':{'phi':[-1, 1, 1], 'theta':[0, 2, 2]}, 'dwell':0.5, 'tolerance':1})
+    assert steps==[(-1, 0, 0.5), (-1, 2, 0.5), (0, 2, 0.5), (0, 0, 0.5), (1, 0, 0.5), (1, 2, 0.5)]
+    assert settings==dict(SETTINGS, dwell=0.5, tolerance=1.0)
+
+def test_steps_with_their_own_dwell():
+    steps, settings = parseSweep({'steps':[[1, 2], [3, 4, 0.25]]})
+    assert steps==[(1.0, 2.0, SETTINGS['dwell']), (3.0, 4.0, 0.25)]
+    steps, settings = parseSweep({'grid':{'phi':5, 'theta':[0, 1, 0.5]}})
+    assert steps==[(5.0, 0.0, 2.0), (5.0, 0.5, 2.0), (5.0, 1.0, 2.0)]
+
+@pytest.mark.parametrize('definition', [
+    [[1, 2]], 'grid', None, {}, {'grid':{'phi':[0, 1, 1]}}, {'grid':{'phi':[0, 1], 'theta':0}},
+    {'grid':{'phi':[0, 1, 0], 'theta':0}}, {'grid':[0, 1]}, {'steps':[[1]]}, {'steps':[]}, {'steps':5},
+    {'steps':[[1, 'a']]}, {'steps':[[1, None]]}, {'steps':[[1, 2, -1]]}, {'steps':[[1, 2]], 'dwell':-2},
+    {'steps':[[1, 2]], 'timeout':'long'}, {'steps':[[1, 2]], 'hold':[1]}])
+def test_malformed_sweeps_are_refused(definition):
+    with pytest.raises(ValueError):
+        parseSweep(definition)
+
+class SyntheticRig():
+    # appends IMU records that move to the setpoint within lag seconds, but
+    # not beyond reach degrees, and loadcell records of a steady thrust
+    def __init__(self, lag=0.05, reach=10.0, thrust=12.0):
+        self.records=[]
+        self.lag=lag
+        self.reach=reach
+        self.thrust=thrust
+        self.target=(0.0, 0.0)
+        self.changed=time.monotonic()
+        self.setpoints=[]
+        self.recording=True
+        self.stopEvent=threading.Event()
+        self.thread=threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def setpoint(self, phi, theta):
+        self.setpoints.append((phi, theta))
+        self.target=(phi, theta)
+        self.changed=time.monotonic()
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            now=time.monotonic()
+            phi, theta = (max(-self.reach, min(self.reach, v)) if now-self.changed>=self.lag else 99.0 for v in self.target)
+            self.records.append({'time':now, 'roll':theta, 'pitch':phi})
+            self.records.append({'time':now, 'thrust':self.thrust, 'motor1':3.0, 'motor2':3.0, 'motor3':3.0, 'motor4':3.0})
+            time.sleep(0.002)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.thread.join()
+
+@pytest.fixture
+def rig():
+    synthetic=SyntheticRig()
+    yield synthetic
+    synthetic.stop()
+
+def campaign(rig, definition, published, filename=None):
+    steps, settings = parseSweep(definition)
+    return Campaign(steps, settings, rig.setpoint, rig.records, lambda records: rig.recording,
+                    lambda topic, payload: published.append((topic, json.loads(payload))), filename, poll=0.01)
+
+def test_campaign_steps_through_the_sweep(rig, tmp_path):
+    published=[]
+    filename=str(tmp_path/'sweep_campaign.json')
+    sweep=campaign(rig, {'steps':[[2, -1], [-3, 4]], 'dwell':0.2, 'hold':0.05, 'timeout':1}, published, filename)
+    report=sweep.run()
+    assert not sweep.active
+    assert rig.setpoints==[(2.0, -1.0), (-3.0, 4.0), (0, 0)]
+    assert [topic for topic, msg in published]==['campaign/step', 'campaign/step', 'campaign/done']
+    for result, (phi, theta) in zip(sweep.results, ((2, -1), (-3, 4))):
+        assert result['settled']
+        assert 0.05<=result['settle_s']<1
+        assert (result['phi_mean'], result['theta_mean'], result['phi_std'], result['error_rms'])==(phi, theta, 0, 0)
+        assert result['imu_samples']>10 and result['loadcell_samples']>10
+        assert (result['thrust_mean'], result['motor1_mean'])==(12.0, 3.0)
+    assert report['steps']==report['planned']==2
+    assert not report['aborted'] and report['unsettled']==0
+    with open(filename) as f:
+        saved=json.load(f)
+    assert saved['report']==report
+    assert saved['steps']==sweep.results
+
+def test_unreachable_step_is_reported_unsettled(rig):
+    published=[]
+    rig.reach=5.0
+    report=campaign(rig, {'steps':[[8, 0], [1, 1]], 'dwell':0.1, 'hold':0.05, 'timeout':0.3}, published).run()
+    first, second = (msg for topic, msg in published[:2])
+    assert not first['settled'] and first['settle_s'] is None
+    assert first['phi_mean']==5.0
+    assert second['settled']
+    assert report['unsettled']==1 and not report['aborted']
+
+def test_campaign_ends_with_the_run(rig):
+    published=[]
+    sweep=campaign(rig, {'steps':[[1, 1]]*10, 'dwell':0.2, 'hold':0.05, 'timeout':1}, published)
+    threading.Timer(0.5, lambda: setattr(rig, 'recording', False)).start()
+    report=sweep.run()
+    assert report['aborted']
+    assert 0<report['steps']<10
+    assert rig.setpoints[-1]==(0, 0)
+
+def test_stop_aborts_the_campaign(rig):
+    published=[]
+    sweep=campaign(rig, {'steps':[[1, 1]]*10, 'dwell':0.2, 'hold':0.05, 'timeout':1}, published)
+    threading.Timer(0.5, sweep.stop).start()
+    report=sweep.run()
+    assert report['aborted'] and report['steps']<10
+    assert published[-1]==('campaign/done', report)
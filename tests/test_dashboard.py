@@ -0,0 +1,76 @@
+import os
+import time
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PySide6.QtWidgets import QApplication
+import GUI_mqtt
+from rpc import RpcServer
+from telemetry import LoopbackBroker, simulatedRig
+
+# A dashboard of two rigs against the in-process broker stand-in: telemetry
+# from a simulated rig reaches its own panel only, and commands go out under
+# the panel's rig namespace and come back as replies.
+
+@pytest.fixture(scope='module')
+def app():
+    return QApplication.instance() or QApplication([])
+
+def processUntil(app, condition, timeout=5.0):
+    deadline=time.monotonic()+timeout
+    while not condition():
+        if time.monotonic()>deadline:
+            return False
+        app.processEvents()
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def dashboard(app, tmp_path, monkeypatch):
+    # the panels keep downloaded runs under runs/RIG
+    monkeypatch.chdir(tmp_path)
+    broker=LoopbackBroker()
+    window=GUI_mqtt.Dashboard([('rig1', 'localhost', 1883), ('rig2', 'localhost', 1883)], broker=broker)
+    yield window, broker
+    window.close()
+
+def test_telemetry_reaches_its_rig_only(app, dashboard):
+    window, broker = dashboard
+    first, second = window.panels
+    rig=simulatedRig(broker, 'rig1', rate=300)
+    rig.start()
+    try:
+        broker.publish('rig2/weight', b'7.5')
+        assert processUntil(app, lambda: len(first.history.loadcell)>20 and len(first.history.imu)>20)
+        assert processUntil(app, lambda: second.model.weight=='7.5')
+    finally:
+        rig.stop()
+    assert first.model.weight=='0.0'
+    assert len(second.history.loadcell)==0
+    assert second.model.messages==1
+    # the total the rig sent, as decoded on the worker thread
+    assert len(first.model.loadcell)==5
+    assert first.model.loadcell[4]==pytest.approx(sum(first.model.loadcell[:4]), abs=0.02)
+
+def test_commands_round_trip_through_the_rig_namespace(app, dashboard):
+    window, broker = dashboard
+    first, second = window.panels
+    # the Pi side of rig2: plain commands are recorded, rpc requests answered
+    pi=broker.client()
+    received=[]
+    server=RpcServer(lambda topic, payload: pi.publish('rig2/'+topic, payload), {'weigh':lambda args: 12.5},
+                     run=lambda command, call: call())
+    def on_message(client, userdata, message):
+        received.append(message.topic)
+        if message.topic=='rig2/rpc':
+            server.request(message.payload)
+    pi.on_message=on_message
+    pi.subscribe('#')
+    second.autoLevel()
+    second.weigh()
+    assert processUntil(app, lambda: second.model.weight=='12.5')
+    assert 'weigh ok' in second.command_label.text()
+    assert received[:2]==['rig2/autolevel', 'rig2/rpc']
+    assert all(topic.startswith('rig2/') for topic in received)
+    assert first.model.weight=='0.0'
+    assert first.command_label.text()==''
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import zlib
+import numpy as np
+import pytest
+from download import RunSender, RunReceiver, encodeChunk, decodeChunk
+from runstore import RunStore, ENTRY, columns
+
+# Run downloads of download.py between a RunSender and a RunReceiver joined
+# by a stand-in for the MQTT topics, and the runstore.py journal they resume
+# from.
+
+def waitFor(condition, timeout=5.0):
+    deadline=time.monotonic()+timeout
+    while not condition():
+        if time.monotonic()>deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def makeRecords(n):
+    # interleaved IMU and loadcell rows as Rpi_mqtt records them
+    records=[]
+    for i in range(n):
+        t=round(0.01*i, 2)
+        if i % 2==0:
+            records.append({'time':t, 'roll':0.1*i, 'pitch':-0.1*i})
+        else:
+            records.append({'time':t, 'thrust':4.0*i, 'motor1':i, 'motor2':i, 'motor3':i, 'motor4':i})
+    return records
+
+class Link():
+    # the download topics, delivered on the publishing thread; chunks for
+    # which drop(header) is true are lost on the way
+    def __init__(self, records, store, drop=None, timeout=5.0):
+        self.records=records
+        self.drop=drop or (lambda header: False)
+        self.requests=[]
+        self.sent=[]
+        self.progress=[]
+        self.sender=RunSender(self.toGui, self.source, chunk=100, window=2, timeout=timeout)
+        self.receiver=RunReceiver(store, self.toPi, self.progress.append, retry=0)
+
+    def source(self, run):
+        if run not in ('current', 'run1'):
+            raise ValueError('no run '+run)
+        return 'run1', self.records, lambda: False
+
+    def toGui(self, topic, payload):
+        header, data = decodeChunk(payload)
+        self.sent.append(header['chunk'])
+        if not self.drop(header):
+            self.receiver.receive(payload)
+
+    def toPi(self, topic, payload):
+        payload=payload.encode()
+        if topic=='download':
+            self.requests.append(json.loads(payload))
+            self.sender.request(payload)
+        else:
+            self.sender.ack(payload)
+
+def test_download_saves_the_columns(tmp_path):
+    store=RunStore(str(tmp_path))
+    records=makeRecords(450)
+    link=Link(records, store)
+    link.receiver.request('current')
+    assert waitFor(lambda: store.finished('run1'))
+    assert link.sent==[0, 1, 2, 3, 4]
+    assert store.runs()==['run1']
+    assert not os.path.exists(store.path('run1', '.part'))
+    saved=store.load('run1')
+    for name, column in columns(records).items():
+        assert np.array_equal(saved[name], column)
+    assert any(text.startswith('run1 saved as') for text in link.progress)
+
+def test_interrupted_download_resumes(tmp_path):
+    records=makeRecords(450)
+    link=Link(records, RunStore(str(tmp_path)), drop=lambda header: header['chunk']>=2, timeout=0.5)
+    link.receiver.request('current')
+    # the sender stalls on the window of unacknowledged chunks
+    assert waitFor(lambda: link.sent==[0, 1, 2, 3])
+    time.sleep(0.6)
+    assert RunStore(str(tmp_path)).chunks('run1')==2
+    # a new GUI asks again by name and gets the chunks from 2 on
+    store=RunStore(str(tmp_path))
+    link=Link(records, store)
+    link.receiver.request('run1')
+    assert waitFor(lambda: store.finished('run1'))
+    assert link.requests==[{'run':'run1', 'from':2}]
+    assert link.sent==[2, 3, 4]
+    assert np.array_equal(store.load('run1')['imu_roll'], columns(records)['imu_roll'])
+
+def test_bad_checksum_is_asked_again(tmp_path):
+    store=RunStore(str(tmp_path))
+    records=makeRecords(450)
+    corrupted=[]
+    link=Link(records, store)
+    deliver=link.receiver.receive
+    def receive(payload):
+        header, data = decodeChunk(payload)
+        if header['chunk']==1 and not corrupted:
+            corrupted.append(payload)
+            payload=payload[:-1]+bytes([payload[-1]^0xff])
+        deliver(payload)
+    link.receiver.receive=receive
+    link.receiver.request('current')
+    assert waitFor(lambda: store.finished('run1'))
+    assert link.requests==[{'run':'current'}, {'run':'run1', 'from':1}]
+    assert link.sent.count(1)==2
+    assert np.array_equal(store.load('run1')['loadcell_thrust'], columns(records)['loadcell_thrust'])
+
+def test_finished_run_is_not_downloaded_again(tmp_path):
+    store=RunStore(str(tmp_path))
+    link=Link(makeRecords(50), store)
+    link.receiver.request('current')
+    assert waitFor(lambda: store.finished('run1'))
+    link.receiver.request('current')
+    assert waitFor(lambda: 'run1 already downloaded' in link.progress)
+    assert not link.receiver.active
+
+@pytest.mark.parametrize('payload', [b'not json', b'[1]', b'{"run": 3}', b'{"from": -1}', b'{"from": "2"}', b'\xff'])
+def test_sender_refuses_malformed_requests(payload):
+    sender=RunSender(lambda topic, payload: None, lambda run: pytest.fail('no transfer expected'))
+    with pytest.raises(ValueError):
+        sender.request(payload)
+    assert sender.generation==0
+
+@pytest.mark.parametrize('payload', [b'{}', b'[1]', b'null', b'{"run": "run1"}', b'{"run": "run1", "chunk": true}', b'{"run": "run1", "chunk": 1.5}'])
+def test_sender_refuses_malformed_acks(payload):
+    sender=RunSender(lambda topic, payload: None, lambda run: None)
+    with pytest.raises(ValueError):
+        sender.ack(payload)
+    assert sender.acked=={}
+
+@pytest.mark.parametrize('payload', [b'not json\n', b'[1]\n', b'null\n', b'{}\n', b'{"run": 1, "chunk": 0, "crc": 0, "last": true}\n',
+                                     b'{"run": "run1", "chunk": -1, "crc": 0, "last": true}\n', b'\xff\n'])
+def test_receiver_ignores_malformed_chunks(tmp_path, payload):
+    store=RunStore(str(tmp_path))
+    published=[]
+    receiver=RunReceiver(store, lambda topic, payload: published.append(topic))
+    receiver.request('current')
+    receiver.receive(payload)
+    assert receiver.active and receiver.run is None
+    # the next good chunk is taken as usual
+    receiver.receive(encodeChunk('run1', 0, makeRecords(4), True))
+    assert store.finished('run1')
+    assert published==['download', 'download/ack']
+
+def test_journal_cuts_off_a_torn_entry(tmp_path):
+    store=RunStore(str(tmp_path))
+    chunks=[zlib.compress(json.dumps(makeRecords(10)[i::3]).encode()) for i in range(3)]
+    for i, data in enumerate(chunks):
+        store.append('run1', i, data)
+    path=store.path('run1', '.part')
+    good=os.path.getsize(path)
+    # a crash in the middle of the next entry
+    with open(path, 'ab') as f:
+        f.write(ENTRY.pack(len(chunks[0]), zlib.crc32(chunks[0]))+chunks[0][:5])
+    store=RunStore(str(tmp_path))
+    assert store.chunks('run1')==3
+    assert os.path.getsize(path)==good
+    assert len(store.records('run1'))==10
+    with pytest.raises(ValueError):
+        store.append('run1', 4, chunks[0])
+    store.append('run1', 3, chunks[0])
+    assert store.chunks('run1')==4
+
+def test_journal_cuts_off_from_a_corrupted_entry(tmp_path):
+    store=RunStore(str(tmp_path))
+    chunks=[zlib.compress(json.dumps(makeRecords(10)[i::3]).encode()) for i in range(3)]
+    for i, data in enumerate(chunks):
+        store.append('run1', i, data)
+    path=store.path('run1', '.part')
+    first=ENTRY.size+len(chunks[0])
+    with open(path, 'r+b') as f:
+        f.seek(first+ENTRY.size+2)
+        byte=f.read(1)
+        f.seek(first+ENTRY.size+2)
+        f.write(bytes([byte[0]^0xff]))
+    store=RunStore(str(tmp_path))
+    assert store.chunks('run1')==1
+    assert os.path.getsize(path)==first
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from filters import FilterPipeline, Hampel
+
+# The streaming loadcell filters of filters.py: any split of the samples into
+# blocks gives the output of one call over all of them, and the Hampel stage
+# against a direct numpy version over the same windows.
+
+def spiked(n=2000, seed=1):
+    # four noisy channels with steps and single sample spikes, and where the spikes are
+    rng=np.random.default_rng(seed)
+    x=np.cumsum(rng.normal(0, 0.01, (n, 4)), axis=0)+np.array([1.0, 2.0, 3.0, 4.0])
+    x[n//2:,1]+=2.0
+    where=np.zeros((n, 4), dtype=bool)
+    where[rng.choice(n*4, 60, replace=False)//4, rng.integers(0, 4, 60)]=True
+    x[where]+=rng.choice([-1, 1], where.sum())*rng.uniform(0.5, 3, where.sum())
+    return x, where
+
+def blocks(x, sizes):
+    i=0
+    while i<len(x):
+        size=next(sizes)
+        yield x[i:i+size]
+        i+=size
+
+def streamed(pipeline, x, sizes):
+    return np.concatenate([pipeline.process(block) for block in blocks(x, sizes)])
+
+def randomSizes(seed):
+    rng=np.random.default_rng(seed)
+    while True:
+        yield int(rng.integers(0, 20))
+
+@pytest.mark.parametrize('filter, decimation', [('mean', 2), ('mean', 5), ('cic', 4), ('fir', 3), ('none', 4)])
+@pytest.mark.parametrize('despike', [0, 7, 15])
+def test_streaming_equals_one_call(filter, decimation, despike):
+    x, where = spiked()
+    whole=FilterPipeline(filter, decimation, despike=despike)
+    expected=whole.process(x)
+    assert len(expected)==len(x)//decimation
+    for sizes in (iter(lambda: 1, None), iter(lambda: 7, None), iter(lambda: 64, None), randomSizes(decimation+despike)):
+        pipeline=FilterPipeline(filter, decimation, despike=despike)
+        assert np.allclose(streamed(pipeline, x, sizes), expected, rtol=0, atol=1e-9)
+        assert pipeline.rejected()==whole.rejected()
+    if despike:
+        assert sum(whole.rejected())>=where.sum()*0.9
+    else:
+        assert whole.rejected()==[0, 0, 0, 0]
+
+def test_reset_starts_over():
+    x, where = spiked()
+    pipeline=FilterPipeline('cic', 4, despike=15)
+    first=pipeline.process(x)
+    counts=pipeline.rejected()
+    pipeline.reset()
+    assert pipeline.rejected()==[0, 0, 0, 0]
+    assert np.array_equal(pipeline.process(x), first)
+    assert pipeline.rejected()==counts
+
+def hampelReference(x, length, threshold, floor=0.02):
+    # median and MAD of the previous length raw samples with numpy, per channel
+    out=x.copy()
+    rejected=np.zeros(x.shape[1], dtype=int)
+    for c in range(x.shape[1]):
+        for i in range(len(x)):
+            window=x[max(0, i-length):i, c]
+            if len(window)>=3:
+                m=np.median(window)
+                mad=np.median(np.abs(window-m))
+                if abs(x[i,c]-m)>threshold*max(1.4826*mad, floor):
+                    out[i,c]=m
+                    rejected[c]+=1
+    return out, rejected
+
+@pytest.mark.parametrize('length, threshold', [(3, 3.0), (7, 3.0), (15, 4.0), (16, 4.0)])
+def test_hampel_matches_numpy(length, threshold):
+    x, where = spiked(600, seed=length)
+    hampel=Hampel(length, 4, threshold)
+    out=np.concatenate([hampel.process(block) for block in blocks(x, randomSizes(length))])
+    expected, rejected = hampelReference(x, length, threshold)
+    assert np.allclose(out, expected, rtol=0, atol=1e-12)
+    assert hampel.rejected.tolist()==rejected.tolist()
+
+def test_hampel_lets_a_step_through():
+    x=np.zeros((40, 1))
+    x[20:]=5.0
+    out=Hampel(7, 1).process(x)
+    # held at the old level for about half the window, then the new one
+    assert np.all(out[:20]==0.0)
+    assert np.all(out[20:24]==0.0)
+    assert np.all(out[24:]==5.0)
+
+def test_unknown_filter_is_refused():
+    with pytest.raises(ValueError):
+        FilterPipeline('median', 2)
@@ -0,0 +1,76 @@
+import time
+import numpy as np
+import pytest
+import RPi.GPIO as GPIO
+import simulators
+from loadcell import loadcell, DataReady
+
+# The HX711 reads of loadcell.py on the simulated chips: DataReady, the DOUT
+# edge source behind -i, against the polling reads of the hx711 library.
+
+# raw counts of the four chips without noise, some negative for the two's complement
+COUNTS={6: 8000-20314, 13: 8000-25135, 19: 8000+29555, 26: 8000-32082}
+
+@pytest.fixture
+def steady(monkeypatch):
+    # the chips of the installed GPIO give the same counts every conversion
+    for pin, counts in COUNTS.items():
+        monkeypatch.setattr(GPIO.chips[pin], 'counts', lambda t, counts=counts: counts)
+    # conversions from before are overwritten by then
+    time.sleep(2.0/GPIO.rate)
+
+@pytest.fixture
+def lc():
+    cells=loadcell()
+    yield cells
+    cells.idle()
+
+def streamRate(read, seconds=2.0, block=2):
+    # rows per second of read(block) after the first block
+    read(block)
+    rows=0
+    start=time.monotonic()
+    while time.monotonic()-start<seconds:
+        rows+=len(read(block)[0])
+    return rows/(time.monotonic()-start)
+
+def test_interrupts_keep_up_with_the_chips(lc):
+    lc.enableInterrupts()
+    assert streamRate(lc.read_block)==pytest.approx(GPIO.rate, rel=0.1)
+
+def test_data_ready_follows_the_data_rate():
+    gpio=simulators.simulatedLoadcells(rate=10)
+    try:
+        sampler=DataReady(gpio)
+        sampler.start()
+        assert streamRate(sampler.take, block=1)==pytest.approx(10, rel=0.1)
+        sampler.stop()
+    finally:
+        gpio.close()
+
+def test_interrupt_and_polled_readings_agree(lc, steady):
+    times, polled = lc.read_block(4)
+    lc.enableInterrupts()
+    times, interrupts = lc.read_block(4)
+    assert len(interrupts)==4
+    expected=np.array([COUNTS[pin]/ratio for pin, ratio in zip((6, 13, 19, 26), lc.ratios)])*lc.g
+    assert np.allclose(polled, expected)
+    assert np.allclose(interrupts, expected)
+
+def test_tare_and_weigh_with_interrupts(lc, steady):
+    lc.enableInterrupts()
+    expected=round(sum(COUNTS[pin]/ratio for pin, ratio in zip((6, 13, 19, 26), lc.ratios))*lc.g, 2)
+    assert lc.weigh()==pytest.approx(expected, abs=0.01)
+    lc.tare()
+    assert lc.weigh()==pytest.approx(0, abs=0.01)
+    times, values = lc.read_block(4)
+    assert np.allclose(values, 0)
+    # streaming while tare and weigh take their samples
+    lc.tare()
+    assert lc.weigh()==pytest.approx(0, abs=0.01)
+    assert len(lc.read_block(4)[0])==4
+
+def test_polled_weigh_matches_interrupts(lc, steady):
+    polled=lc.weigh()
+    lc.enableInterrupts()
+    assert lc.weigh()==polled
@@ -0,0 +1,68 @@
+import json
+import numpy as np
+import pytest
+from metrics import RollingWindow, Metrics, CHANNELS
+
+# The rolling loadcell statistics of metrics.py against numpy over the same
+# window of samples.
+
+@pytest.mark.parametrize('length', [1, 2, 5, 50])
+def test_rolling_window_matches_numpy(length):
+    rng=np.random.default_rng(length)
+    # an offset and steps, so the running sums would lose precision if they drifted
+    values=1000+rng.normal(0, 1, 600)+np.repeat(rng.normal(0, 20, 6), 100)
+    window=RollingWindow(length)
+    for i, x in enumerate(values.tolist()):
+        window.add(x)
+        last=values[max(0, i+1-length):i+1]
+        assert len(window.values)==len(last)
+        assert window.mean==pytest.approx(last.mean(), abs=1e-9)
+        assert window.variance()==pytest.approx(last.var(), abs=1e-6)
+        assert window.minima[0][1]==last.min()
+        assert window.maxima[0][1]==last.max()
+
+def test_rolling_window_with_repeated_values():
+    window=RollingWindow(3)
+    for x in (2.0, 2.0, 2.0, 1.0, 1.0, 1.0, 3.0):
+        window.add(x)
+    assert window.stats()=={'mean':1.667, 'std':0.943, 'min':1.0, 'max':3.0}
+    for x in (3.0, 3.0):
+        window.add(x)
+    assert window.stats()=={'mean':3.0, 'std':0.0, 'min':3.0, 'max':3.0}
+    assert RollingWindow(3).stats() is None
+
+def test_metrics_snapshot():
+    published=[]
+    counts=[0, 1, 2, 3]
+    metrics=Metrics(lambda topic, payload: published.append((topic, json.loads(payload))), window=4, interval=0,
+                    counters=lambda: {'rejected':counts})
+    rows=[(1.0, 2.0, 3.0, 4.0, 10.0), (2.0, 2.0, 3.0, 4.0, 11.0), (3.0, 2.0, 3.0, 4.0, 12.0)]
+    for row in rows:
+        metrics.add(row)
+    assert len(published)==3
+    topic, snapshot = published[-1]
+    assert topic=='metrics'
+    assert set(snapshot)==set(CHANNELS)|{'samples', 'ratio', 'rejected'}
+    assert snapshot['motor1']=={'mean':2.0, 'std':0.816, 'min':1.0, 'max':3.0}
+    assert snapshot['thrust']['mean']==11.0
+    assert snapshot['samples']==3 and snapshot['rejected']==[0, 1, 2, 3]
+    assert snapshot['ratio'] is None
+    metrics.setWeight('5.5')
+    assert metrics.snapshot()['ratio']==2.0
+    metrics.setWeight('not weighed')
+    assert metrics.snapshot()['ratio'] is None
+    # a new run starts from empty windows and keeps the weight
+    metrics.setWeight(11)
+    metrics.reset()
+    assert metrics.snapshot()['thrust'] is None and metrics.snapshot()['samples']==0
+    metrics.add((0, 0, 0, 0, 22.0))
+    assert metrics.snapshot()['ratio']==2.0
+
+def test_metrics_publish_at_the_interval():
+    published=[]
+    metrics=Metrics(lambda topic, payload: published.append(payload), interval=60)
+    for i in range(100):
+        metrics.add((i, i, i, i, 4*i))
+    # the first sample publishes, the rest fall within the interval
+    assert len(published)==1
+    assert metrics.snapshot()['samples']==100
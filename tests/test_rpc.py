@@ -0,0 +1,106 @@
+import json
+import time
+import pytest
+from rpc import RpcServer, RpcClient
+
+# Requests and replies of rpc.py between an RpcClient and an RpcServer, the
+# server running the requests when the test says so.
+
+class Link():
+    def __init__(self, handlers, timeout=5.0):
+        self.calls=[]
+        self.requests=[]
+        self.replies=[]
+        self.server=RpcServer(self.toClient, handlers, run=lambda command, call: self.calls.append(call))
+        self.client=RpcClient(self.toServer, 'gui1', timeout=timeout)
+
+    def toServer(self, topic, payload):
+        assert topic=='rpc'
+        self.requests.append(json.loads(payload))
+        self.server.request(payload.encode())
+
+    def toClient(self, topic, payload):
+        assert topic=='rpc/reply/gui1'
+        self.client.receive(payload.encode())
+
+    def done(self, reply, rtt):
+        self.replies.append((reply, rtt))
+
+def test_replies_pair_with_their_requests():
+    link=Link({'weigh':lambda args: 12.5, 'echo':lambda args: args})
+    first=link.client.call('weigh', done=link.done)
+    second=link.client.call('echo', {'x':1}, done=link.done)
+    assert (first, second)==(1, 2)
+    assert link.requests[1]=={'id':2, 'reply':'rpc/reply/gui1', 'command':'echo', 'args':{'x':1}}
+    assert link.client.stats()['pending']==2
+    # answered the other way round
+    time.sleep(0.01)
+    link.calls[1]()
+    link.calls[0]()
+    [(echo, rtt2), (weigh, rtt1)] = link.replies
+    assert (echo['id'], echo['command'], echo['ok'], echo['result'])==(2, 'echo', True, {'x':1})
+    assert (weigh['id'], weigh['command'], weigh['result'])==(1, 'weigh', 12.5)
+    assert rtt1>rtt2>=0.01
+    stats=link.client.stats()
+    assert (stats['pending'], stats['timeouts'])==(0, 0)
+    assert stats['max']==round(1000*rtt1, 1)
+
+def test_errors_come_back_as_replies():
+    def stop(args):
+        raise RuntimeError('no run is recording')
+    link=Link({'stop':stop, 'tare':lambda args: 1/0})
+    for command in ('stop', 'tare', 'launch'):
+        link.client.call(command, done=link.done)
+    for call in link.calls:
+        call()
+    replies={reply['command']: reply for reply, rtt in link.replies}
+    assert replies['stop']['error']=='no run is recording'
+    assert replies['tare']['error']=='division by zero'
+    assert replies['launch']['error']=='unknown command launch'
+    assert not any(reply['ok'] for reply in replies.values())
+    # unknown commands are answered at once, without running anything
+    assert len(link.calls)==2
+
+def test_unanswered_requests_time_out():
+    link=Link({'weigh':lambda args: 1.0}, timeout=0.05)
+    link.client.call('weigh', done=link.done)
+    link.client.check()
+    assert link.replies==[]
+    time.sleep(0.06)
+    link.client.call('weigh', done=link.done)
+    link.client.check()
+    assert link.replies==[({'id':1, 'command':'weigh', 'ok':False, 'error':'timeout'}, None)]
+    # a reply after the timeout is dropped, the one in time is delivered
+    link.calls[0]()
+    link.calls[1]()
+    assert [reply['id'] for reply, rtt in link.replies]==[1, 2]
+    assert link.replies[1][0]['ok']
+    stats=link.client.stats()
+    assert (stats['pending'], stats['timeouts'])==(0, 1)
+
+@pytest.mark.parametrize('payload', [b'not json', b'[1]', b'{"id": 1}', b'{"reply": "rpc/reply/gui1"}', b'\xff'])
+def test_server_ignores_malformed_requests(payload):
+    link=Link({'weigh':lambda args: 1.0})
+    link.server.request(payload)
+    assert link.calls==[] and link.server.requests==0
+
+@pytest.mark.parametrize('payload', [b'not json', b'[1]', b'{"ok": true}', b'{"id": 7, "ok": true}'])
+def test_client_ignores_malformed_and_unknown_replies(payload):
+    link=Link({'weigh':lambda args: 1.0})
+    link.client.call('weigh', done=link.done)
+    link.client.receive(payload)
+    assert link.replies==[]
+    assert link.client.stats()['pending']==1
+
+def test_server_runs_requests_on_threads():
+    replies=[]
+    server=RpcServer(lambda topic, payload: replies.append(json.loads(payload)), {'wait':lambda args: time.sleep(0.2) or 'done'})
+    start=time.monotonic()
+    for i in range(5):
+        server.request(json.dumps({'id':i, 'reply':'r', 'command':'wait'}).encode())
+    assert time.monotonic()-start<0.1
+    deadline=time.monotonic()+2
+    while len(replies)<5 and time.monotonic()<deadline:
+        time.sleep(0.01)
+    assert sorted(reply['id'] for reply in replies)==[0, 1, 2, 3, 4]
+    assert all(reply['result']=='done' and reply['seconds']>=0.2 for reply in replies)
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from simple_pid import PID
+import Rpi_mqtt
+from acquisition import control, SharedConfig
+from filters import FilterPipeline
+from imucapture import ImuCapture
+from loadcell import loadcell
+from metrics import Metrics
+from status import StatusCache
+from trigger import TriggerCapture
+
+# Rpi_mqtt's sensor loops and run commands in threads, as the service runs
+# without -p or -a, on the simulated platform. The globals are the ones its
+# __main__ sets up.
+
+class Published():
+    # stands in for the MQTT client and the telemetry transport
+    def __init__(self):
+        self.messages=[]
+
+    def publish(self, topic, payload=None, *args):
+        self.messages.append((topic, payload))
+
+def servoTable():
+    # the layout of database3.csv over -30..30 degrees
+    phi, theta = np.meshgrid(np.arange(-30, 31), np.arange(-30, 31), indexing='ij')
+    df=pd.DataFrame({'phi':phi.ravel(), 'theta':theta.ravel()})
+    for name, k in (('right',1.5), ('left',-1.5), ('front',1.5), ('back',-1.5)):
+        df[name]=np.round(k*(df['phi'] if name in ('front','back') else df['theta']), 1)
+    return df.set_index(['phi','theta'])
+
+def waitFor(condition, timeout=5.0):
+    deadline=time.monotonic()+timeout
+    while not condition():
+        if time.monotonic()>deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('logs')
+    rpi=Rpi_mqtt
+    published=Published()
+    lcconfig={'filter':'mean', 'decimation':2, 'order':3, 'taps':None, 'block':2, 'record':False, 'despike':0, 'threshold':4.0}
+    settings=dict(
+        df=servoTable(), phi=0, theta=0, phi_slider_val=0, theta_slider_val=0,
+        pidroll=PID(0.5, 0.02, 0.001, setpoint=0), pidpitch=PID(0.5, 0.02, 0.001, setpoint=0),
+        state=control(), lc=loadcell(), capture=ImuCapture(), poll_interval=None, samples={'IMU':0, 'loadcell':0},
+        lcconfig=lcconfig, lcfilter=FilterPipeline('mean', 2), lcshared=SharedConfig(lcconfig), lcversion=[0],
+        starttime=time.time(), stopwatchFlag=False, runLock=threading.Lock(), lcLock=threading.Lock(),
+        file=[], runname=None, saved={}, campaign=None, namespace='', shm=None, shmExport=False,
+        processes=False, acquisition=[], client=published, telemetry=published,
+        trigger=TriggerCapture(published.publish, directory='logs'), metrics=Metrics(published.publish))
+    settings['status']=StatusCache(lambda topic, payload, retain: published.publish(topic, payload), mode='autolevel',
+                                   setpoint=[0, 0], weight=None, run={'name':None, 'active':False, 'start':None}, filter=lcconfig, error=None)
+    for name, value in settings.items():
+        monkeypatch.setattr(rpi, name, value, raising=False)
+    rpi.state.autolevel=True
+    rpi.startService()
+    assert waitFor(lambda: rpi.state.imuIdle and rpi.state.loadcellIdle)
+    yield rpi
+    rpi.stop()
+    rpi.state.service=False
+    waitFor(lambda: threading.active_count()<=2)
+
+def test_second_start_is_refused(service):
+    name=service.startRun()
+    assert waitFor(lambda: not service.state.imuIdle and not service.state.loadcellIdle)
+    with pytest.raises(RuntimeError, match='recording'):
+        service.startRun()
+    assert service.runname==name
+    service.stop()
+    assert waitFor(lambda: service.state.imuIdle and service.state.loadcellIdle)
+    assert any('thrust' in record for record in service.file)
+    assert any('roll' in record for record in service.file)
+
+def test_start_after_stop(service):
+    service.startRun()
+    time.sleep(0.3)
+    service.stop()
+    assert waitFor(lambda: service.state.imuIdle and service.state.loadcellIdle)
+    service.startRun()
+    assert waitFor(lambda: len(service.file)>10)
+    service.stop()
+
+def test_failed_run_goes_back_to_idle(service, monkeypatch):
+    # an attitude outside the servo table ends the IMU run, not the loop
+    monkeypatch.setattr(service, 'df', servoTable().iloc[:0])
+    service.startRun()
+    assert waitFor(lambda: not service.state.imu)
+    service.stop()
+    assert waitFor(lambda: service.state.imuIdle and service.state.loadcellIdle)
+    monkeypatch.setattr(service, 'df', servoTable())
+    service.startRun()
+    assert waitFor(lambda: any('roll' in record for record in service.file))
+    service.stop()
+
+def test_save_keeps_recording(service):
+    # the records stay a list after a save, a run can go on appending to them
+    service.startRun()
+    assert waitFor(lambda: len(service.file)>10)
+    filename=service.saveFile()
+    assert os.path.exists(filename)
+    count=len(service.file)
+    assert waitFor(lambda: len(service.file)>count)
+    service.stop()
+    assert waitFor(lambda: service.state.imuIdle and service.state.loadcellIdle)
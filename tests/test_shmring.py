@@ -0,0 +1,84 @@
+import os
+import uuid
+import numpy as np
+import pytest
+from shmring import SharedRing
+
+# The shared memory telemetry ring of shmring.py: one writer and readers
+# attached by name, across the wrap point and when the writer laps a reader.
+
+@pytest.fixture
+def ring():
+    writer=SharedRing('testbench_test_'+uuid.uuid4().hex[:8], capacity=8, width=2, create=True)
+    yield writer
+    writer.close()
+
+def rows(start, stop):
+    return np.column_stack((np.arange(start, stop), -np.arange(start, stop))).astype(np.float64)
+
+def test_reader_starts_at_the_newest_record(ring):
+    ring.write(rows(0, 3))
+    reader=SharedRing(ring.name)
+    assert (reader.capacity, reader.width)==(8, 2)
+    assert reader.readAll()==[]
+    ring.write(rows(3, 5))
+    assert np.array_equal(np.concatenate(reader.readAll()), rows(3, 5))
+    reader.close()
+
+def test_read_across_the_wrap_point(ring):
+    reader=SharedRing(ring.name)
+    ring.write(rows(0, 6))
+    assert np.array_equal(reader.read(), rows(0, 6))
+    # slots 6, 7 and then 0..2: one view up to the wrap point, the rest on the next read
+    ring.write(rows(6, 11))
+    first=reader.read()
+    assert np.array_equal(first, rows(6, 8))
+    assert np.array_equal(reader.read(), rows(8, 11))
+    assert len(reader.read())==0
+    assert reader.lost==0
+    ring.write(rows(11, 14))
+    assert np.array_equal(reader.read(max_records=2), rows(11, 13))
+    assert np.array_equal(reader.read(), rows(13, 14))
+    reader.close()
+
+def test_overrun_counts_the_lost_records(ring):
+    reader=SharedRing(ring.name)
+    ring.write(rows(0, 2))
+    seq=reader.seq
+    ring.write(rows(2, 13))
+    assert ring.head()==13
+    assert reader.lapped(seq)
+    # the reader lost the 5 oldest and goes on from the oldest record still in the ring
+    assert np.array_equal(np.concatenate(reader.readAll()), rows(5, 13))
+    assert reader.lost==5
+    assert not reader.lapped(reader.seq)
+    reader.close()
+
+def test_write_longer_than_the_ring_keeps_the_newest(ring):
+    reader=SharedRing(ring.name)
+    ring.write(rows(0, 20))
+    assert ring.head()==20
+    assert np.array_equal(np.concatenate(reader.readAll()), rows(12, 20))
+    assert reader.lost==12
+    reader.close()
+
+def test_writer_in_another_process(ring):
+    reader=SharedRing(ring.name)
+    pid=os.fork()
+    if pid==0:
+        writer=SharedRing(ring.name)
+        for i in range(0, 30, 3):
+            writer.write(rows(i, i+3))
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert np.array_equal(np.concatenate(reader.readAll()), rows(22, 30))
+    assert reader.lost==22
+    reader.close()
+
+def test_attach_refuses_other_blocks(ring):
+    # a block of the same name that does not start with the ring's magic
+    ring.header[0]=0
+    with pytest.raises(ValueError):
+        SharedRing(ring.name)
+    with pytest.raises(FileNotFoundError):
+        SharedRing('testbench_test_'+uuid.uuid4().hex[:8])
@@ -0,0 +1,100 @@
+import time
+import socket
+import threading
+import pytest
+from transport import UdpTransport, UDP_HEADER
+
+# The brokerless UDP telemetry of transport.py on the loopback interface:
+# every datagram delivered in order, gaps in the sequence counted as lost
+# and datagrams older than the newest one dropped as late.
+
+def waitFor(condition, timeout=5.0):
+    deadline=time.monotonic()+timeout
+    while not condition():
+        if time.monotonic()>deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def receiver():
+    transport=UdpTransport('127.0.0.1', 0)
+    messages=[]
+    transport.start(lambda topic, payload: messages.append((topic, payload)))
+    transport.messages=messages
+    transport.port=transport.sock.getsockname()[1]
+    yield transport
+    transport.stop()
+
+@pytest.fixture
+def raw(receiver):
+    # sends datagrams with any sequence number, from a socket of its own
+    sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def send(seq, topic='IMU', payload=b'[0, 0]'):
+        sock.sendto(UDP_HEADER.pack(seq, len(topic))+topic.encode()+payload, ('127.0.0.1', receiver.port))
+    yield send
+    sock.close()
+
+def test_messages_arrive_in_order(receiver):
+    sender=UdpTransport('127.0.0.1', receiver.port)
+    sender.publish('loadcell', '[1, 2, 3, 4, 10]')
+    sender.publish('IMU', b'[0.5, -0.5]')
+    sender.publish('time', 12)
+    assert waitFor(lambda: len(receiver.messages)==3)
+    assert receiver.messages==[('loadcell', b'[1, 2, 3, 4, 10]'), ('IMU', b'[0.5, -0.5]'), ('time', b'12')]
+    assert (receiver.received, receiver.lost, receiver.late)==(3, 0, 0)
+    sender.stop()
+
+def test_publishing_threads_share_one_sequence(receiver):
+    sender=UdpTransport('127.0.0.1', receiver.port)
+    def publish(topic):
+        for i in range(1000):
+            sender.publish(topic, str(i))
+            if i % 100==0:
+                time.sleep(0.001)
+    threads=[threading.Thread(target=publish, args=(topic,)) for topic in ('IMU', 'loadcell', 'time')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sender.sent==3000
+    assert waitFor(lambda: receiver.received+receiver.late==3000)
+    assert (receiver.received, receiver.lost, receiver.late)==(3000, 0, 0)
+    sender.stop()
+
+def test_gaps_count_as_lost(receiver, raw):
+    for seq in (0, 1, 2, 5, 6, 10):
+        raw(seq)
+    assert waitFor(lambda: receiver.received==6)
+    assert receiver.lost==2+3
+    assert receiver.late==0
+
+def test_late_datagrams_are_dropped(receiver, raw):
+    for seq, payload in ((0, b'0'), (1, b'1'), (3, b'3'), (2, b'2'), (4, b'4')):
+        raw(seq, payload=payload)
+    assert waitFor(lambda: receiver.received+receiver.late==5)
+    assert [payload for topic, payload in receiver.messages]==[b'0', b'1', b'3', b'4']
+    assert (receiver.lost, receiver.late)==(1, 1)
+
+def test_sequence_wraps_and_senders_restart(receiver, raw):
+    # the counter wraps at 2**32 without a gap
+    raw(0xfffffffe)
+    raw(0xffffffff)
+    raw(0)
+    raw(1)
+    assert waitFor(lambda: receiver.received==4)
+    # a restarted sender begins at 0 again, that is no loss either
+    raw(0)
+    raw(1)
+    assert waitFor(lambda: receiver.received==6)
+    assert (receiver.lost, receiver.late)==(0, 0)
+
+def test_senders_are_counted_apart(receiver, raw):
+    sender=UdpTransport('127.0.0.1', receiver.port)
+    raw(100)
+    sender.publish('IMU', '[0, 0]')
+    raw(101)
+    sender.publish('IMU', '[0, 0]')
+    assert waitFor(lambda: receiver.received==4)
+    assert (receiver.lost, receiver.late)==(0, 0)
+    sender.stop()
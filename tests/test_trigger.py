@@ -0,0 +1,142 @@
+import json
+import time
+import numpy as np
+import pytest
+from trigger import TriggerCapture, SETTINGS
+
+# Triggered capture of trigger.py on synthetic sample times: IMU at 100 Hz
+# and loadcell blocks of 8 at 80 Hz, the thrust given as a function of time.
+
+def waitFor(condition, timeout=5.0):
+    deadline=time.monotonic()+timeout
+    while not condition():
+        if time.monotonic()>deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class Bench():
+    def __init__(self, directory, **settings):
+        self.saved=[]
+        self.trigger=TriggerCapture(lambda topic, payload: self.saved.append(payload), imuRate=100, loadcellRate=80, directory=str(directory))
+        self.trigger.configure(settings)
+        self.trigger.start('run1')
+        self.t=0.0
+
+    def feed(self, seconds, thrust=lambda t: np.zeros_like(t)):
+        # the samples of the next seconds, as the sensor loops add them
+        end=self.t+seconds
+        while self.t<end-1e-9:
+            times=self.t+np.arange(8)/80
+            for t in np.arange(self.t, self.t+0.1-1e-9, 0.01):
+                self.trigger.addImu(round(t, 6), 1.0, 2.0)
+            self.trigger.addLoadcell(times, np.repeat(thrust(times)[:,None]/4, 4, axis=1))
+            self.t=round(self.t+0.1, 6)
+
+    def windows(self, count=1):
+        assert waitFor(lambda: len(self.saved)>=count)
+        results=[]
+        for payload in self.saved:
+            info=json.loads(payload)
+            with np.load(info['file']) as f:
+                results.append((info, dict(f)))
+        return results
+
+def step(at, high=50.0):
+    return lambda t: np.where(t>=at, high, 10.0)
+
+def test_window_is_cut_around_the_crossing(tmp_path):
+    bench=Bench(tmp_path, pre=1.0, post=0.5, above=30)
+    bench.feed(3.0, step(2.0))
+    [(info, window)] = bench.windows()
+    assert info['reason']=='above' and info['time']==2.0
+    assert float(window['trigger_time'])==2.0
+    assert str(window['trigger_reason'])=='above'
+    # every sample from pre before to post after the trigger, nothing else
+    assert window['imu_time'][0]==pytest.approx(1.0) and window['imu_time'][-1]==pytest.approx(2.5)
+    assert len(window['imu_time'])==151
+    assert np.all(np.diff(window['imu_time'])>0)
+    assert window['loadcell_time'][0]==pytest.approx(1.0) and window['loadcell_time'][-1]==pytest.approx(2.5)
+    assert np.array_equal(window['loadcell_thrust'], np.where(window['loadcell_time']>=2.0, 50.0, 10.0))
+    assert np.allclose(window['loadcell_motor1'], window['loadcell_thrust']/4)
+    assert info['file'].endswith('run1_trigger_2.000.npz')
+
+def test_thresholds_fire_on_the_crossing_only(tmp_path):
+    # above from 2.0 on for good: one window, not one per sample above
+    bench=Bench(tmp_path, pre=0.5, post=0.5, above=30, holdoff=0.5)
+    bench.feed(5.0, step(2.0))
+    bench.windows()
+    time.sleep(0.1)
+    assert bench.trigger.count==1
+
+def test_crossing_between_blocks(tmp_path):
+    # the last sample of one block below, the first of the next above
+    bench=Bench(tmp_path, pre=0.5, post=0.2, below=5)
+    bench.feed(2.0, lambda t: np.where(t>=1.1-1e-9, 0.0, 10.0))
+    [(info, window)] = bench.windows()
+    assert info['reason']=='below' and info['time']==pytest.approx(1.1)
+
+def test_holdoff_ignores_crossings_until_rearmed(tmp_path):
+    # pulses above 30 at 1, 1.9 and 3: the one at 1.9 falls in the holdoff
+    pulses=lambda t: np.where(((t>=1) & (t<1.2)) | ((t>=1.9) & (t<2.1)) | ((t>=3) & (t<3.2)), 50.0, 10.0)
+    bench=Bench(tmp_path, pre=0.5, post=0.5, above=30, holdoff=0.8)
+    bench.feed(4.5, pulses)
+    bench.windows(2)
+    time.sleep(0.1)
+    assert [info['time'] for info, window in bench.windows()]==[1.0, 3.0]
+
+def test_rate_fires_on_a_fast_change(tmp_path):
+    ramp=lambda t: np.where(t<2, 10.0+t, np.where(t<2.05, 10.0+t+400*(t-2), 32.0+t))
+    bench=Bench(tmp_path, pre=0.5, post=0.5, rate=100)
+    bench.feed(3.0, ramp)
+    [(info, window)] = bench.windows()
+    assert info['reason']=='rate' and 2.0<info['time']<=2.05
+
+def test_manual_trigger_only_while_recording(tmp_path):
+    bench=Bench(tmp_path, pre=0.5, post=0.5)
+    bench.feed(1.0)
+    assert bench.trigger.fire()
+    # one window at a time
+    assert not bench.trigger.fire()
+    bench.feed(1.0)
+    [(info, window)] = bench.windows()
+    assert info['reason']=='manual'
+    assert info['time']==pytest.approx(0.99)
+    bench.trigger.stop()
+    assert not bench.trigger.fire()
+    bench.trigger.start('run2')
+    assert not bench.trigger.fire()
+    bench.feed(0.5)
+    assert bench.trigger.fire()
+
+def test_stop_saves_a_pending_window(tmp_path):
+    bench=Bench(tmp_path, pre=0.5, post=1.0)
+    bench.feed(1.0)
+    assert bench.trigger.fire()
+    bench.feed(0.3)
+    bench.trigger.stop()
+    [(info, window)] = bench.windows()
+    # only the post samples that came before the stop
+    assert window['imu_time'][-1]==pytest.approx(1.29)
+    assert not bench.trigger.fire()
+    # no automatic triggers either once stopped
+    bench.trigger.configure({'above':30})
+    bench.feed(1.0, step(1.5))
+    time.sleep(0.1)
+    assert len(bench.saved)==1
+
+@pytest.mark.parametrize('settings', [[1], 'pre', {'pre':-1}, {'post':None}, {'holdoff':'x'}, {'above':'x'}, {'rate':[1]}, {'pre':float('nan')}])
+def test_configure_refuses_bad_settings(tmp_path, settings):
+    trigger=TriggerCapture(lambda topic, payload: None, directory=str(tmp_path))
+    with pytest.raises(ValueError):
+        trigger.configure(settings)
+    assert trigger.settings==SETTINGS
+
+def test_configure_sizes_the_rings(tmp_path):
+    trigger=TriggerCapture(lambda topic, payload: None, imuRate=100, loadcellRate=80, directory=str(tmp_path))
+    trigger.configure({'pre':3, 'post':1, 'above':None, 'unknown':5})
+    assert trigger.settings==dict(SETTINGS, pre=3.0, post=1.0)
+    assert trigger.imu.capacity==int((3+1+0.25+0.5)*100)
+    trigger.setRates(500, 10)
+    trigger.start('run1')
+    assert (trigger.imu.capacity, trigger.loadcell.capacity)==(int(4.75*500), int(4.75*10))
@@ -0,0 +1,108 @@
+import socket
+import struct
+import threading
+
+# Telemetry transports. Both sides talk to a transport: the Pi publishes
+# telemetry with publish(topic, payload), the GUI calls start(sink) and gets
+# sink(topic, payload) on a background thread for every message, the same
+# callback MqttClient uses. Commands always stay on MQTT.
+
+UDP_PORT=5005
+# sequence number and topic length in front of every datagram
+UDP_HEADER=struct.Struct('!IB')
+
+class MqttTransport():
+    # telemetry on the MQTT connection that carries the commands; client is a
+    # paho client or GUI_mqtt.MqttClient
+    def __init__(self, client):
+        self.client=client
+        self.sent=0
+        self.received=0
+        self.lost=0
+
+    def publish(self, topic, payload):
+        self.sent+=1
+        self.client.publish(topic, payload)
+
+    def start(self, sink):
+        def receive(topic, payload):
+            self.received+=1
+            sink(topic, payload)
+        if hasattr(self.client, 'setSink'):
+            self.client.setSink(receive)
+        else:
+            self.client.on_message=lambda client, userdata, msg: receive(msg.topic, msg.payload)
+
+    def stop(self):
+        pass
+
+class UdpTransport():
+    # Brokerless datagrams, one per message: no broker hop and no head-of-line
+    # blocking, a lost datagram is simply gone. Every datagram carries a sequence
+    # number; the receiver counts the gaps as lost and drops datagrams that arrive
+    # after a newer one, since only the latest value matters.
+    def __init__(self, host='', port=UDP_PORT):
+        self.address=(host, port)
+        self.sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.seq=0
+        self.sent=0
+        self.received=0
+        self.lost=0
+        self.late=0
+        self.thread=None
+        self.stopEvent=threading.Event()
+        # publish is called from the IMU, loadcell and stopwatch threads at once,
+        # every datagram must get a sequence number of its own and go out in order
+        self.lock=threading.Lock()
+
+    def publish(self, topic, payload):
+        if isinstance(topic, str):
+            topic=topic.encode()
+        if isinstance(payload, str):
+            payload=payload.encode()
+        elif not isinstance(payload, bytes):
+            payload=str(payload).encode()
+        with self.lock:
+            self.sock.sendto(UDP_HEADER.pack(self.seq, len(topic))+topic+payload, self.address)
+            self.seq=(self.seq+1) & 0xffffffff
+            self.sent+=1
+
+    def start(self, sink):
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*2**20)
+        self.sock.bind(self.address)
+        self.sock.settimeout(0.2)
+        self.thread=threading.Thread(target=self.receive, args=(sink,), daemon=True)
+        self.thread.start()
+
+    def receive(self, sink):
+        expected={}
+        while not self.stopEvent.is_set():
+            try:
+                data, sender = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(data)<UDP_HEADER.size:
+                continue
+            seq, n = UDP_HEADER.unpack_from(data)
+            # gap to the expected sequence, modulo 2**32 so the counter may wrap
+            gap=(seq-expected.get(sender, seq)) & 0xffffffff
+            if gap>=0x80000000:
+                if sender in expected and seq==0:
+                    # the sender restarted
+                    gap=0
+                else:
+                    self.late+=1
+                    continue
+            self.lost+=gap
+            expected[sender]=(seq+1) & 0xffffffff
+            self.received+=1
+            start=UDP_HEADER.size
+            sink(data[start:start+n].decode(), data[start+n:])
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.sock.close()
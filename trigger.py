@@ -0,0 +1,184 @@
+import os
+import json
+import threading
+import numpy as np
+from ringbuffer import RingBuffer
+
+# Triggered capture (Rpi_mqtt 'trigger'). While a run records, the newest
+# pre+post seconds of IMU and full rate loadcell samples are kept in fixed size
+# rings, so memory does not grow however long the bench runs. A trigger, thrust
+# crossing a threshold, thrust changing faster than a rate or a manual
+# 'trigger' message, takes the window from pre seconds before to post seconds
+# after it once the post samples are in, and saves it as
+# logs/RUN_trigger_SECONDS.npz with the columns named like runstore.columns.
+# Saving happens on a thread of its own, the sensor loops only touch memory.
+
+IMU_DTYPE=np.dtype([('time','f8'),('roll','f4'),('pitch','f4')])
+LOADCELL_DTYPE=np.dtype([('time','f8'),('thrust','f4'),('motor1','f4'),('motor2','f4'),('motor3','f4'),('motor4','f4')])
+# pre and post in seconds; above, below (N) and rate (N/s) of the thrust,
+# None is off; holdoff seconds after a window before the next automatic trigger
+SETTINGS={'pre':2.0, 'post':1.0, 'above':None, 'below':None, 'rate':None, 'holdoff':1.0}
+# the loadcell samples come in blocks, wait this long for the last ones of a window
+SLACK=0.25
+
+class TriggerCapture():
+    # publish(topic, payload) reports every saved window on 'trigger/saved';
+    # the sample rates size the rings, setRates() gives the ones the sensors
+    # actually run at
+    def __init__(self, publish, imuRate=250, loadcellRate=80, directory='logs'):
+        self.publish=publish
+        self.imuRate=imuRate
+        self.loadcellRate=loadcellRate
+        self.directory=directory
+        self.settings=dict(SETTINGS)
+        self.lock=threading.Lock()
+        self.run='trigger'
+        self.active=False
+        self.reset()
+
+    def configure(self, settings):
+        # e.g. {"pre": 2, "post": 0.5, "above": 40, "rate": 300}; new pre or
+        # post sizes the rings again and starts them empty. ValueError leaves
+        # the settings as they were
+        if not isinstance(settings, dict):
+            raise ValueError('trigger settings are a JSON object')
+        try:
+            changes={key: None if value is None else float(value) for key, value in settings.items() if key in SETTINGS}
+        except TypeError as e:
+            raise ValueError('bad trigger settings: '+str(e))
+        for key in ('pre','post','holdoff'):
+            if key in changes and (changes[key] is None or not changes[key]>=0):
+                raise ValueError(key+' must be a number of seconds >= 0')
+        with self.lock:
+            old=(self.settings['pre'], self.settings['post'])
+            self.settings.update(changes)
+            resize=old!=(self.settings['pre'], self.settings['post'])
+        if resize:
+            self.reset(self.run)
+        print('trigger: '+json.dumps(self.settings))
+
+    def setRates(self, imuRate, loadcellRate):
+        # takes effect with the next reset()
+        with self.lock:
+            self.imuRate=imuRate
+            self.loadcellRate=loadcellRate
+
+    def start(self, run):
+        # a run starts recording, triggers are taken until stop()
+        self.reset(run)
+        with self.lock:
+            self.active=True
+
+    def stop(self):
+        # the run stopped: no more triggers, and a pending window, whose post
+        # samples will not come any more, is saved with the samples it has
+        with self.lock:
+            self.active=False
+            window=self.cut() if self.pending is not None else None
+        if window is not None:
+            self.saveLater(*window)
+
+    def reset(self, run=None):
+        # empty rings and nothing pending
+        seconds=self.settings['pre']+self.settings['post']+SLACK+0.5
+        with self.lock:
+            if run is not None:
+                self.run=run
+            self.imu=RingBuffer(int(seconds*self.imuRate), IMU_DTYPE)
+            self.loadcell=RingBuffer(int(seconds*self.loadcellRate), LOADCELL_DTYPE)
+            self.pending=None
+            self.last=None
+            self.rearm=-np.inf
+            self.latest=-np.inf
+            self.count=0
+
+    def addImu(self, t, roll, pitch):
+        self.imu.append((t, roll, pitch))
+        self.advance(t)
+
+    def addLoadcell(self, times, values):
+        # times and an (n, 4) block of motor1..motor4, as loadcell.read_block
+        if len(times)==0:
+            return
+        thrust=values.sum(axis=1)
+        rows=np.empty(len(times), dtype=LOADCELL_DTYPE)
+        rows['time']=times
+        rows['thrust']=thrust
+        for i in range(4):
+            rows['motor'+str(i+1)]=values[:,i]
+        self.loadcell.extend(rows)
+        with self.lock:
+            if self.pending is None and self.active:
+                hit=self.check(np.asarray(times, dtype=np.float64), thrust)
+                if hit is not None:
+                    self.pending=hit
+            self.last=(times[-1], thrust[-1])
+        self.advance(times[-1])
+
+    def check(self, times, thrust):
+        # earliest sample in the block that fires a condition, (time, reason) or None
+        s=self.settings
+        if s['above'] is None and s['below'] is None and s['rate'] is None:
+            return None
+        t0, x0 = self.last if self.last is not None else (times[0], thrust[0])
+        t=np.concatenate(([t0], times))
+        x=np.concatenate(([x0], thrust))
+        armed=times>=self.rearm
+        hits=[]
+        # thresholds fire on the crossing, not on every sample beyond them
+        if s['above'] is not None:
+            hits.append(((x[:-1]<=s['above']) & (x[1:]>s['above']) & armed, 'above'))
+        if s['below'] is not None:
+            hits.append(((x[:-1]>=s['below']) & (x[1:]<s['below']) & armed, 'below'))
+        if s['rate'] is not None:
+            rate=np.diff(x)/np.maximum(np.diff(t), 1e-6)
+            hits.append(((np.abs(rate)>=s['rate']) & armed, 'rate'))
+        first=[(np.argmax(hit), reason) for hit, reason in hits if hit.any()]
+        if not first:
+            return None
+        i, reason = min(first)
+        return float(times[i]), reason
+
+    def fire(self, reason='manual'):
+        # trigger now, at the newest sample; False when nothing records or a window is pending
+        with self.lock:
+            if self.pending is not None or not self.active or not np.isfinite(self.latest):
+                return False
+            self.pending=(float(self.latest), reason)
+            return True
+
+    def advance(self, t):
+        # once the post samples of a pending trigger are in, cut the window out
+        # of the rings and save it
+        with self.lock:
+            self.latest=max(self.latest, t)
+            if self.pending is None or self.latest<self.pending[0]+self.settings['post']+SLACK:
+                return
+            window=self.cut()
+        self.saveLater(*window)
+
+    def cut(self):
+        # the pending window out of the rings, called with the lock held
+        t0, reason = self.pending
+        self.pending=None
+        self.rearm=t0+self.settings['post']+self.settings['holdoff']
+        self.count+=1
+        lo, hi = t0-self.settings['pre'], t0+self.settings['post']
+        imu=self.imu.latest()
+        lc=self.loadcell.latest()
+        return self.run, t0, reason, imu[(imu['time']>=lo) & (imu['time']<=hi)], lc[(lc['time']>=lo) & (lc['time']<=hi)]
+
+    def saveLater(self, run, t0, reason, imu, lc):
+        filename=os.path.join(self.directory, '{}_trigger_{:.3f}.npz'.format(run, t0))
+        threading.Thread(target=self.save, args=(filename, t0, reason, imu, lc), daemon=True).start()
+
+    def save(self, filename, t0, reason, imu, lc):
+        columns={'trigger_time':np.float64(t0), 'trigger_reason':np.array(reason)}
+        for table, rows in (('imu', imu), ('loadcell', lc)):
+            for name in rows.dtype.names:
+                columns[table+'_'+name]=rows[name].astype(np.float64)
+        with open(filename+'.tmp', 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(filename+'.tmp', filename)
+        print('Trigger capture saved as '+filename+' ('+reason+', '+str(len(imu))+' IMU and '+str(len(lc))+' loadcell samples)')
+        self.publish('trigger/saved', json.dumps({'file':filename, 'reason':reason, 'time':round(t0, 3), 'imu':len(imu), 'loadcell':len(lc)}))
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+from PySide6.QtWidgets import QWidget, QMainWindow
+from PySide6.QtCore import Qt, QPointF, QRectF
+from PySide6.QtGui import QPainter, QPen, QColor, QPolygonF
+from runstore import columns
+from imucapture import IMU_DTYPE
+from plots import PlotWidget
+
+# Offline run viewer (GUI_mqtt --view). A run is read through a columnar copy
+# next to it, NAME.cols/ with one .npy per column named like runstore.columns,
+# which is memory-mapped, never loaded. The first time a run is opened every
+# column gets a min/max pyramid, cached in NAME.cols/lod/: level k has one
+# (min, max) bin per FACTOR**k samples, down to about LEAF bins. Drawing picks
+# the finest level with at most two bins per pixel, so zooming and panning
+# only read the bins in view, however many samples the run has.
+
+# raw full rate captures: loadcell.LOADCELL_DTYPE (loadcell.py needs the Pi's
+# GPIO to import) and imucapture.IMU_DTYPE
+RAW={'_loadcell.bin':('loadcell', np.dtype([('time','f8'),('motor1','f4'),('motor2','f4'),('motor3','f4'),('motor4','f4')])),
+     '_imu.bin':('imu', IMU_DTYPE)}
+FACTOR=8
+LEAF=1024
+# samples per step when converting and building, a multiple of FACTOR
+CHUNK=1<<22
+
+def columnsPath(source):
+    if source.rstrip(os.sep).endswith('.cols'):
+        return source.rstrip(os.sep)
+    return os.path.splitext(source)[0]+'.cols'
+
+def convert(source, directory):
+    # a saved run (logs/*.json), a runstore or trigger .npz or a raw capture
+    # (logs/*_loadcell.bin, logs/*_imu.bin) -> one .npy per column; raw
+    # captures are copied a chunk at a time, so they may be larger than memory
+    tmp=directory+'.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    raw=[spec for suffix, spec in RAW.items() if source.endswith(suffix)]
+    if raw:
+        table, dtype = raw[0]
+        rows=np.memmap(source, dtype=dtype, mode='r')
+        for name in dtype.names:
+            out=np.lib.format.open_memmap(os.path.join(tmp, table+'_'+name+'.npy'), mode='w+', dtype=dtype[name], shape=(len(rows),))
+            for start in range(0, len(rows), CHUNK):
+                out[start:start+CHUNK]=rows[name][start:start+CHUNK]
+            out.flush()
+            del out
+        del rows
+    elif source.endswith('.npz'):
+        with np.load(source) as f:
+            for name in f.files:
+                if f[name].ndim==1 and f[name].dtype.kind=='f':
+                    np.save(os.path.join(tmp, name+'.npy'), f[name])
+    else:
+        with open(source) as f:
+            data=columns(json.load(f))
+        for name, values in data.items():
+            np.save(os.path.join(tmp, name+'.npy'), values)
+    os.replace(tmp, directory)
+
+class Pyramid():
+    # min/max levels of the columns of one table (names share TABLE_time)
+    def __init__(self, directory, table, names):
+        self.directory=directory
+        self.table=table
+        self.names=names
+        self.lod=os.path.join(directory, 'lod')
+        load=lambda name: np.load(os.path.join(directory, table+'_'+name+'.npy'), mmap_mode='r')
+        self.times=[load('time')]
+        self.levels={name: [load(name)] for name in names}
+        if not self.cached():
+            start=time.perf_counter()
+            self.build()
+            print('{} pyramid of {} samples built in {:.1f} s'.format(table, len(self.times[0]), time.perf_counter()-start))
+        with open(os.path.join(self.lod, table+'.json')) as f:
+            levels=json.load(f)['levels']
+        for k in range(1, levels+1):
+            self.times.append(np.load(self.levelPath('time', k), mmap_mode='r'))
+            for name in names:
+                self.levels[name].append(np.load(self.levelPath(name, k), mmap_mode='r'))
+
+    def levelPath(self, name, k):
+        return os.path.join(self.lod, '{}_{}.{}.npy'.format(self.table, name, k))
+
+    def cached(self):
+        # the index is written last, a build cut short is built again
+        try:
+            with open(os.path.join(self.lod, self.table+'.json')) as f:
+                index=json.load(f)
+        except (OSError, ValueError):
+            return False
+        return index['samples']==len(self.times[0]) and index['factor']==FACTOR and index['names']==self.names
+
+    def build(self):
+        os.makedirs(self.lod, exist_ok=True)
+        times=self.times[0]
+        sources={name: self.levels[name][0] for name in self.names}
+        count=len(times)
+        k=0
+        while count>LEAF:
+            k+=1
+            bins=-(-count//FACTOR)
+            tout=np.lib.format.open_memmap(self.levelPath('time', k), mode='w+', dtype=times.dtype, shape=(bins,))
+            outs={name: np.lib.format.open_memmap(self.levelPath(name, k), mode='w+', dtype=sources[name].dtype, shape=(bins, 2)) for name in self.names}
+            for start in range(0, count, CHUNK):
+                stop=min(start+CHUNK, count)
+                b0=start//FACTOR
+                edges=np.arange(0, stop-start, FACTOR)
+                # a bin starts at the time of its first sample
+                tout[b0:b0+len(edges)]=times[start:stop:FACTOR]
+                for name in self.names:
+                    block=np.asarray(sources[name][start:stop])
+                    lo, hi = (block, block) if k==1 else (block[:,0], block[:,1])
+                    outs[name][b0:b0+len(edges),0]=np.minimum.reduceat(lo, edges)
+                    outs[name][b0:b0+len(edges),1]=np.maximum.reduceat(hi, edges)
+            for out in [tout]+list(outs.values()):
+                out.flush()
+            times=tout
+            sources=outs
+            count=bins
+        with open(os.path.join(self.lod, self.table+'.json'), 'w') as f:
+            json.dump({'samples':len(self.times[0]), 'factor':FACTOR, 'levels':k, 'names':self.names}, f)
+
+    def span(self):
+        times=self.times[0]
+        return (float(times[0]), float(times[-1])) if len(times) else (0.0, 1.0)
+
+    def query(self, name, t0, t1, width):
+        # (x, y, level) of a polyline of the column between t0 and t1: the
+        # samples themselves when they fit, else min/max pairs of the finest
+        # level with at most two bins per pixel
+        times=self.times[0]
+        i0=max(int(np.searchsorted(times, t0))-1, 0)
+        i1=min(int(np.searchsorted(times, t1))+1, len(times))
+        k=0
+        while k<len(self.times)-1 and (i1-i0)//FACTOR**k>2*width:
+            k+=1
+        if k==0:
+            return np.asarray(times[i0:i1], dtype=np.float64), np.asarray(self.levels[name][0][i0:i1], dtype=np.float64), 0
+        b0=i0//FACTOR**k
+        b1=min(-(-i1//FACTOR**k), len(self.times[k]))
+        x=np.asarray(self.times[k][b0:b1], dtype=np.float64)
+        return np.repeat(x, 2), np.asarray(self.levels[name][k][b0:b1], dtype=np.float64).ravel(), k
+
+class LogRun():
+    def __init__(self, source):
+        directory=columnsPath(source)
+        if not os.path.isdir(directory):
+            start=time.perf_counter()
+            convert(source, directory)
+            print('{} converted to {} in {:.1f} s'.format(source, directory, time.perf_counter()-start))
+        self.directory=directory
+        names=sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.npy'))
+        tables={}
+        for name in names:
+            table, _, column = name.partition('_')
+            if column and column!='time' and table+'_time' in names:
+                tables.setdefault(table, []).append(column)
+        self.pyramids={table: Pyramid(directory, table, columns) for table, columns in tables.items()}
+
+    def span(self):
+        spans=[pyramid.span() for pyramid in self.pyramids.values() if len(pyramid.times[0])]
+        if not spans:
+            return 0.0, 1.0
+        return min(s[0] for s in spans), max(s[1] for s in spans)
+
+class ViewerWidget(QWidget):
+    # one panel per table; wheel zooms around the cursor, drag pans, double click shows the whole run
+    colors=dict([('motor'+str(i+1), color) for i, (name, color) in enumerate(PlotWidget.thrustSeries[:4])]+
+                [('thrust', PlotWidget.thrustSeries[4][1]), ('roll', PlotWidget.attitudeSeries[0][1]), ('pitch', PlotWidget.attitudeSeries[1][1])])
+    palette=(QColor(255,80,80), QColor(80,200,80), QColor(80,140,255), QColor(230,200,40), QColor(255,120,220), QColor(80,220,220))
+
+    def __init__(self, run, parent=None):
+        super(ViewerWidget, self).__init__(parent)
+        self.run=run
+        self.t0, self.t1 = run.span()
+        self.dragX=None
+        self.status=''
+        self.setMinimumSize(400, 300)
+        self.setMouseTracking(False)
+
+    def reset(self):
+        self.t0, self.t1 = self.run.span()
+        self.update()
+
+    def plotRect(self, i, n):
+        h=self.height()/max(n, 1)
+        return QRectF(0, i*h, self.width(), h).adjusted(48, 16, -8, -16)
+
+    def timeAt(self, x):
+        rect=self.plotRect(0, 1)
+        return self.t0+(x-rect.left())/max(rect.width(), 1)*(self.t1-self.t0)
+
+    def paintEvent(self, event):
+        start=time.perf_counter()
+        painter=QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        read=0
+        levels=[]
+        tables=list(self.run.pyramids.items())
+        for i, (table, pyramid) in enumerate(tables):
+            n, k = self.drawPanel(painter, self.plotRect(i, len(tables)), table, pyramid)
+            read+=n
+            levels.append(table+' level '+str(k))
+        painter.end()
+        self.status='{:.3f} to {:.3f} s  {}  {:.0f} kB read  {:.1f} ms'.format(self.t0, self.t1, '  '.join(levels), read/1000, (time.perf_counter()-start)*1000)
+        window=self.window()
+        if isinstance(window, QMainWindow):
+            window.statusBar().showMessage(self.status)
+
+    def drawPanel(self, painter, rect, table, pyramid):
+        painter.setPen(QPen(QColor(90,90,90)))
+        painter.drawRect(rect)
+        painter.drawText(QPointF(rect.left(), rect.top()-4), table)
+        width=max(int(rect.width()), 2)
+        lines=[]
+        read=0
+        level=0
+        for name in pyramid.names:
+            x, y, level = pyramid.query(name, self.t0, self.t1, width)
+            read+=x.nbytes//(2 if level else 1)+y.nbytes
+            if len(x):
+                lines.append((name, x, y))
+        if not lines:
+            return read, level
+        lo=min(y.min() for name, x, y in lines)
+        hi=max(y.max() for name, x, y in lines)
+        if hi-lo<1e-6:
+            hi+=0.5
+            lo-=0.5
+        painter.drawText(QPointF(2, rect.top()+10), str(round(hi,2)))
+        painter.drawText(QPointF(2, rect.bottom()), str(round(lo,2)))
+        sx=rect.width()/max(self.t1-self.t0, 1e-9)
+        sy=rect.height()/(hi-lo)
+        painter.save()
+        painter.setClipRect(rect)
+        for i, (name, x, y) in enumerate(lines):
+            color=self.colors.get(name, self.palette[i % len(self.palette)])
+            px=rect.left()+(x-self.t0)*sx
+            py=rect.bottom()-(y-lo)*sy
+            painter.setPen(QPen(color, 1))
+            painter.drawPolyline(QPolygonF([QPointF(a, b) for a, b in zip(px.tolist(), py.tolist())]))
+        painter.restore()
+        for i, (name, x, y) in enumerate(lines):
+            painter.setPen(QPen(self.colors.get(name, self.palette[i % len(self.palette)]), 1))
+            painter.drawText(QPointF(rect.left()+6+i*56, rect.top()+12), name)
+        return read, level
+
+    def zoom(self, factor, at):
+        # factor<1 zooms in, keeping the time under the cursor in place
+        lo, hi = self.run.span()
+        span=max((self.t1-self.t0)*factor, 1e-6)
+        left=at-(at-self.t0)*factor
+        self.t0=max(left, lo-0.05*(hi-lo))
+        self.t1=min(self.t0+span, hi+0.05*(hi-lo))
+        self.update()
+
+    def pan(self, dt):
+        self.t0+=dt
+        self.t1+=dt
+        self.update()
+
+    def wheelEvent(self, event):
+        steps=event.angleDelta().y()/120
+        self.zoom(0.8**steps, self.timeAt(event.position().x()))
+
+    def mousePressEvent(self, event):
+        self.dragX=event.position().x()
+
+    def mouseMoveEvent(self, event):
+        if self.dragX is not None:
+            x=event.position().x()
+            self.pan(self.timeAt(self.dragX)-self.timeAt(x))
+            self.dragX=x
+
+    def mouseReleaseEvent(self, event):
+        self.dragX=None
+
+    def mouseDoubleClickEvent(self, event):
+        self.reset()
+
+class ViewerWindow(QMainWindow):
+    def __init__(self, source):
+        super(ViewerWindow, self).__init__()
+        self.setWindowTitle(os.path.basename(source))
+        self.viewer=ViewerWidget(LogRun(source), self)
+        self.setCentralWidget(self.viewer)
+        self.resize(1200, 700)